@@ -0,0 +1,236 @@
+"""
+Time every conversion stage on a synthetic corpus and write the results as JSON.
+
+    python benchmarks/bench_suite.py --breadth 8 --depth 4 --output results.json
+    python benchmarks/bench_suite.py --baseline results.json --threshold 0.15
+
+Stages: MubuPost.__init__, MubuPost.parse_to_opml, the outline extraction alone (on an already parsed DOM),
+Transformer.to_markdown, Parser.parse, Generator.write, loading the same model from a lib.snapshot file, markdown
+rendered from the XML and from the lazy views of the snapshot, and the whole MubuPost.to_markdown, serial and with its
+top level subtrees on --jobs processes (use a wide --breadth, with fewer than MubuPost.SUBTREE_MIN_JOBS CPUs or an
+export under SUBTREE_MIN_BYTES that stage runs serially too).
+Each stage runs in a fresh process, so its peak RSS is not inflated by the stages before it. With --baseline the
+exit status is 1 if a stage got slower than the baseline by more than --threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lxml import etree  # noqa: E402
+
+from benchmarks.corpus import CorpusSpec, add_spec_arguments, spec_from_args, write_corpus  # noqa: E402
+from lib.opml_processor import Generator, Parser  # noqa: E402
+from lib.snapshot import Snapshot, write_snapshot  # noqa: E402
+from mubu2markdown import MubuPost, Transformer  # noqa: E402
+
+
+def _stage_mubu_init(html_path, xml_path, work_dir, options):
+    return lambda: MubuPost(html_path, use_mubu_img=True)
+
+
+def _stage_parse_to_opml(html_path, xml_path, work_dir, options):
+    # a fresh post every run, a post keeps its DOM
+    return lambda: MubuPost(html_path, use_mubu_img=True).parse_to_opml()
+
+
+def _stage_elements_to_outlines(html_path, xml_path, work_dir, options):
+    post = MubuPost(html_path, use_mubu_img=True)
+    items = post.dom.xpath('//body/ul[@class="node-list"]/li')
+    return lambda: post._elements_to_outlines(items)
+
+
+def _stage_to_markdown(html_path, xml_path, work_dir, options):
+    transformer = Transformer(MubuPost(html_path, use_mubu_img=True).parse_to_opml())
+    target = os.path.join(work_dir, 'out.md')
+    return lambda: transformer.to_markdown(target)
+
+
+def _stage_parser_parse(html_path, xml_path, work_dir, options):
+    return lambda: Parser(file_path=xml_path).parse()
+
+
+def _stage_generator_write(html_path, xml_path, work_dir, options):
+    generator = Generator(Parser(file_path=xml_path).parse(), 'out')
+    target = os.path.join(work_dir, 'out.xml')
+
+    def run():
+        if os.path.exists(target):
+            os.remove(target)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.write(work_dir)
+    return run
+
+
+def _stage_snapshot_load(html_path, xml_path, work_dir, options):
+    target = os.path.join(work_dir, 'out.snap')
+    write_snapshot(Parser(file_path=xml_path).parse(), target)
+
+    def run():
+        with Snapshot(target) as snapshot:
+            snapshot.to_opml()
+    return run
+
+
+def _stage_parser_markdown(html_path, xml_path, work_dir, options):
+    target = os.path.join(work_dir, 'out.md')
+    return lambda: Transformer(Parser(file_path=xml_path).parse()).to_markdown(target)
+
+
+def _stage_snapshot_markdown(html_path, xml_path, work_dir, options):
+    # the lazy path: views over the mapped file, nothing materialized
+    snapshot_path = os.path.join(work_dir, 'out.snap')
+    write_snapshot(Parser(file_path=xml_path).parse(), snapshot_path)
+    target = os.path.join(work_dir, 'out.md')
+
+    def run():
+        with Snapshot(snapshot_path) as snapshot:
+            Transformer(snapshot.opml()).to_markdown(target)
+    return run
+
+
+def _stage_post_to_markdown(html_path, xml_path, work_dir, options):
+    target = os.path.join(work_dir, 'out.md')
+    return lambda: MubuPost(html_path, use_mubu_img=True).to_markdown(target)
+
+
+def _stage_post_to_markdown_jobs(html_path, xml_path, work_dir, options):
+    target = os.path.join(work_dir, 'out.md')
+    return lambda: MubuPost(html_path, use_mubu_img=True).to_markdown(target, jobs=options['jobs'])
+
+
+STAGES = {
+    'MubuPost.__init__': _stage_mubu_init,
+    'MubuPost.parse_to_opml': _stage_parse_to_opml,
+    'MubuPost._elements_to_outlines': _stage_elements_to_outlines,
+    'Transformer.to_markdown': _stage_to_markdown,
+    'Parser.parse': _stage_parser_parse,
+    'Generator.write': _stage_generator_write,
+    'Snapshot.to_opml': _stage_snapshot_load,
+    'Parser.parse+to_markdown': _stage_parser_markdown,
+    'Snapshot.opml+to_markdown': _stage_snapshot_markdown,
+    'MubuPost.to_markdown': _stage_post_to_markdown,
+    'MubuPost.to_markdown(jobs)': _stage_post_to_markdown_jobs,
+}
+
+
+def _max_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _run_stage(name, html_path, xml_path, repeat, options, result_queue):
+    with tempfile.TemporaryDirectory() as work_dir:
+        run = STAGES[name](html_path, xml_path, work_dir, options)
+        rss_before = _max_rss_kb()
+        timings = []
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - begin)
+        result_queue.put((timings, _max_rss_kb(), _max_rss_kb() - rss_before))
+
+
+def measure_stage(name, html_path, xml_path, repeat, options):
+    ctx = multiprocessing.get_context('spawn')
+    result_queue = ctx.Queue()
+    p = ctx.Process(target=_run_stage, args=(name, str(html_path), str(xml_path), repeat, options, result_queue))
+    p.start()
+    timings, peak_rss_kb, rss_growth_kb = result_queue.get()
+    p.join()
+    return timings, peak_rss_kb, rss_growth_kb
+
+
+def run_suite(spec: CorpusSpec, repeat=3, stages=None, jobs=None):
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        html_path, xml_path = write_corpus(spec, corpus_dir)
+        nodes = spec.node_count()
+        options = {'jobs': jobs or os.cpu_count()}
+        results = {}
+        for name in stages or STAGES:
+            timings, peak_rss_kb, rss_growth_kb = measure_stage(name, html_path, xml_path, repeat, options)
+            best = min(timings)
+            results[name] = {
+                'seconds_best': best,
+                'seconds_all': timings,
+                'nodes': nodes,
+                'nodes_per_sec': nodes / best if best > 0 else None,
+                'peak_rss_kb': peak_rss_kb,
+                'rss_growth_kb': rss_growth_kb,
+            }
+        return {
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'lxml': '.'.join(map(str, etree.LXML_VERSION)),
+                'libxml2': '.'.join(map(str, etree.LIBXML_VERSION)),
+                'platform': platform.platform(),
+                'repeat': repeat,
+                'jobs': options['jobs'],
+                'html_bytes': os.path.getsize(html_path),
+                'xml_bytes': os.path.getsize(xml_path),
+                'spec': spec.to_dict(),
+            },
+            'stages': results,
+        }
+
+
+def compare(current, baseline, threshold):
+    """
+    Print the per-stage change against a baseline result, returns the names of the stages that regressed.
+    """
+    regressed = []
+    for name, stage in current['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old:
+            continue
+        ratio = stage['seconds_best'] / old['seconds_best']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressed.append(name)
+        print(f'{name:<30} {old["seconds_best"]:.4f}s -> {stage["seconds_best"]:.4f}s ({ratio - 1:+.1%}){flag}')
+    return regressed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_spec_arguments(arg_parser)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--jobs', type=int, help='workers of the (jobs) stages, default: one per CPU')
+    arg_parser.add_argument('--stage', action='append', choices=list(STAGES), help='only run these stages')
+    arg_parser.add_argument('--output', help='write the JSON results here, default: stdout')
+    arg_parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    arg_parser.add_argument('--threshold', type=float, default=0.1, help='tolerated slowdown, default: %(default)s')
+    args = arg_parser.parse_args()
+
+    result = run_suite(spec_from_args(args), args.repeat, args.stage, args.jobs)
+    for name, stage in result['stages'].items():
+        print(f'{name:<30} {stage["seconds_best"]:.4f}s {stage["nodes_per_sec"]:>12,.0f} nodes/s '
+              f'peak rss {stage["peak_rss_kb"] / 1024:.1f}MB', file=sys.stderr)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + '\n', encoding='utf-8')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
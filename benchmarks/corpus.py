@@ -0,0 +1,194 @@
+"""
+Synthetic Mubu HTML exports and OPML files for the benchmarks.
+
+    python benchmarks/corpus.py --breadth 6 --depth 4 --format-density 0.5 out_dir/
+
+Everything is drawn from a seeded random.Random, so the same arguments always give the same corpus.
+"""
+import argparse
+import html
+import random
+import sys
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lib.opml_processor import OPML, Head, Body, Outline  # noqa: E402
+
+WORDS = ('outline', 'mubu', 'markdown', 'note', 'tree', 'node', 'export', 'python', 'lxml', 'stream', 'parse',
+         'render', 'heading', 'image', 'code', 'link', '中文', '测试', '幕布')
+FORMATS = ('bold', 'italic', 'strikethrough', 'codespan', 'bold italic')
+
+
+@dataclass
+class CorpusSpec:
+    # children per node
+    breadth: int = 6
+    # levels of nesting, top level is 1
+    depth: int = 4
+    # inline spans in a node's content
+    spans: int = 4
+    # share of spans with a formatting class
+    format_density: float = 0.3
+    # share of nodes with a note
+    notes: float = 0.3
+    # share of notes holding a code block
+    code_blocks: float = 0.2
+    # share of nodes with an uploaded image, and of notes with a markdown image
+    images: float = 0.2
+    # share of spans turned into links
+    links: float = 0.1
+    seed: int = 2020
+
+    def node_count(self):
+        return sum(self.breadth ** d for d in range(1, self.depth + 1))
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class _Draw:
+    def __init__(self, spec: CorpusSpec):
+        self.spec = spec
+        self.rnd = random.Random(spec.seed)
+
+    def hit(self, share):
+        return self.rnd.random() < share
+
+    def words(self, n=3):
+        return ' '.join(self.rnd.choice(WORDS) for _ in range(n))
+
+
+def _content_html(draw: _Draw, index):
+    spans = []
+    for i in range(draw.spec.spans):
+        text = html.escape(f'{draw.words()} {index}.{i}')
+        if draw.hit(draw.spec.links):
+            spans.append(f'<a class="content-link" href="https://example.com/{index}/{i}">'
+                         f'<span class="content-link-text">{text}</span></a>')
+        elif draw.hit(draw.spec.format_density):
+            spans.append(f'<span class="{draw.rnd.choice(FORMATS)}">{text}</span>')
+        else:
+            spans.append(f'<span>{text}</span>')
+    return f'<div class="content mm-editor">{"".join(spans)}</div>'
+
+
+def _note_html(draw: _Draw, index):
+    parts = [f'<span>{html.escape(draw.words(6))}</span>']
+    if draw.hit(draw.spec.images):
+        parts.append('<span>![image](</span>'
+                     f'<a class="content-link" href="https://img.example.com/note/{index}.png">n</a>')
+    if draw.hit(draw.spec.code_blocks):
+        parts.append(f'<span>```python\nprint({index})\n```</span>')
+    return f'<div class="note mm-editor">{"".join(parts)}</div>'
+
+
+def synthetic_mubu_html(spec: CorpusSpec):
+    """
+    A Mubu HTML export following spec, returns (html, node count).
+    """
+    draw = _Draw(spec)
+    out = ['<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>',
+           '<div class="title">Synthetic corpus 20200101</div><ul class="node-list">']
+    counter = 0
+    # explicit stack of (level, remaining siblings) so deep corpora do not recurse
+    stack = [[1, spec.breadth]]
+    while stack:
+        top = stack[-1]
+        if top[1] == 0:
+            stack.pop()
+            if stack:
+                out.append('</ul></div></li>')
+            continue
+        top[1] -= 1
+        level = top[0]
+        counter += 1
+        heading = f' heading{level}' if level <= 3 else ''
+        out.append(f'<li class="node{heading}">')
+        out.append(_content_html(draw, counter))
+        if draw.hit(spec.images):
+            out.append(f'<ul class="image-list"><li class="image-item">'
+                       f'<img src="https://img.example.com/{counter}.png"></li></ul>')
+        if draw.hit(spec.notes):
+            out.append(_note_html(draw, counter))
+        if level < spec.depth:
+            out.append('<div class="children"><ul>')
+            stack.append([level + 1, spec.breadth])
+        else:
+            out.append('</li>')
+    out.append('</ul><div class="publish"><a href="https://mubu.com">幕布文档</a></div></body></html>')
+    return ''.join(out), counter
+
+
+def synthetic_opml(spec: CorpusSpec):
+    """
+    An OPML model following spec, with the attributes MubuPost would set, returns (opml, node count).
+    """
+    draw = _Draw(spec)
+    roots = []
+    counter = 0
+    stack = [(1, roots)]
+    while stack:
+        level, holder = stack.pop()
+        for _ in range(spec.breadth):
+            counter += 1
+            text = ' '.join(f'**{draw.words()}**' if draw.hit(spec.format_density) else draw.words()
+                            for _ in range(spec.spans))
+            if level <= 3:
+                text = '#' * level + ' ' + text
+            attrs = {}
+            if draw.hit(spec.images):
+                attrs['mubu_imgs'] = str([f'https://img.example.com/{counter}.png'])
+            if draw.hit(spec.notes):
+                text += f'\n>{draw.words(6)}'
+                if draw.hit(spec.code_blocks):
+                    attrs['mkd_codes'] = str([f'```python\nprint({counter})\n```'])
+            o = Outline(text, attrs=attrs or None)
+            holder.append(o)
+            if level < spec.depth:
+                o.sub_outlines = []
+                stack.append((level + 1, o.sub_outlines))
+    opml = OPML(Head('Synthetic corpus 20200101', create_date='20200101', modified_date='20200101'), Body(roots))
+    return opml, counter
+
+
+def write_corpus(spec: CorpusSpec, out_dir, name='synthetic'):
+    """
+    Write <name>.html and <name>.xml into out_dir, returns their paths.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    html_path = out_dir / f'{name}.html'
+    html_path.write_text(synthetic_mubu_html(spec)[0], encoding='utf-8')
+    xml_path = out_dir / f'{name}.xml'
+    with open(xml_path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        synthetic_opml(spec)[0].write_xml(f)
+    return html_path, xml_path
+
+
+def add_spec_arguments(arg_parser):
+    defaults = CorpusSpec()
+    for field, value in defaults.to_dict().items():
+        arg_parser.add_argument(f'--{field.replace("_", "-")}', type=type(value), default=value)
+
+
+def spec_from_args(args):
+    return CorpusSpec(**{k: getattr(args, k) for k in CorpusSpec().to_dict()})
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_spec_arguments(arg_parser)
+    arg_parser.add_argument('--name', default='synthetic')
+    arg_parser.add_argument('out_dir')
+    args = arg_parser.parse_args()
+    spec = spec_from_args(args)
+    for p in write_corpus(spec, args.out_dir, args.name):
+        print(p)
+    print(f'{spec.node_count()} nodes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Local conversion server: keeps a pool of warm worker processes so a conversion costs milliseconds instead of an
+interpreter start.
+
+    python conversion_server.py --port 8765 --workers 4
+    python conversion_server.py --unix /tmp/mubu2markdown.sock
+
+    curl --data-binary @post.html 'http://127.0.0.1:8765/convert?from=mubu&to=markdown&use_mubu_img=1'
+    curl --data-binary @post.xml 'http://127.0.0.1:8765/convert?from=opml&to=markdown'
+    curl http://127.0.0.1:8765/stats
+
+At most --max-pending conversions are accepted at a time, more get 503 right away. A conversion that takes longer
+than --timeout gets 504; the worker still finishes it in the background and it counts as pending until then.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+from lib.opml_processor import Parser
+from mubu2markdown import MubuPost, Transformer
+
+SOURCES = ('mubu', 'opml')
+TARGETS = ('markdown', 'opml')
+CONTENT_TYPES = {
+    'markdown': 'text/markdown; charset=utf-8',
+    'opml': 'text/x-opml; charset=utf-8',
+}
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 422: 'Unprocessable Entity', 503: 'Service Unavailable',
+           504: 'Gateway Timeout'}
+
+
+def _warm_up():
+    # pay the imports and the first parser setup before the first request does
+    etree.HTML(b'<html><body><ul class="node-list"></ul></body></html>', parser=etree.HTMLParser(huge_tree=True))
+    return os.getpid()
+
+
+def convert(source_kind, target_kind, body: bytes, use_mubu_img=False):
+    """
+    Worker side of a /convert request, returns the converted text.
+    """
+    if source_kind == 'mubu':
+        opml = MubuPost(body, use_mubu_img=use_mubu_img).parse_to_opml()
+    else:
+        opml = Parser(xml_string=body.decode('utf-8')).parse()
+    if target_kind == 'markdown':
+        return Transformer(opml).to_markdown_string()
+    return XML_DECLARATION + opml.to_xml_string()
+
+
+class _HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+
+class Stats:
+    def __init__(self, window=1024):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.converted = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.finished_at = collections.deque(maxlen=window)
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+        self.finished_at.append(time.monotonic())
+
+    @staticmethod
+    def _percentile(ordered, p):
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def summary(self):
+        now = time.monotonic()
+        ordered = sorted(self.latencies)
+        last_minute = sum(1 for t in self.finished_at if now - t <= 60)
+        uptime = now - self.started
+        return {
+            'uptime_seconds': uptime,
+            'requests': self.requests,
+            'converted': self.converted,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'in_flight': self.in_flight,
+            'latency_ms': {f'p{int(p * 100)}': (v * 1000 if v is not None else None)
+                           for p, v in ((p, self._percentile(ordered, p)) for p in (0.5, 0.95, 0.99))},
+            'throughput_per_second': {
+                'overall': self.converted / uptime if uptime > 0 else 0.0,
+                'last_minute': last_minute / 60,
+            },
+        }
+
+
+class ConversionServer:
+    def __init__(self, workers=None, max_pending=64, timeout=30.0, max_body=64 * 1024 * 1024):
+        self.workers = workers or os.cpu_count()
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_body = max_body
+        self.stats = Stats()
+        self.pool = None
+
+    async def start_pool(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        # one warm-up per worker, all in parallel so every process gets spawned now
+        pids = await asyncio.gather(*(loop.run_in_executor(self.pool, _warm_up) for _ in range(self.workers)))
+        return sorted(set(pids))
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise _HttpError(400, 'malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = b''
+        if 'transfer-encoding' in headers:
+            raise _HttpError(411, 'send a Content-Length, chunked bodies are not supported')
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise _HttpError(400, 'malformed Content-Length')
+        if length < 0:
+            raise _HttpError(400, 'negative Content-Length')
+        if length > self.max_body:
+            raise _HttpError(413, f'body larger than {self.max_body} bytes')
+        if length:
+            body = await reader.readexactly(length)
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        return method, target, body, keep_alive
+
+    @staticmethod
+    async def _respond(writer, status, text, content_type='text/plain; charset=utf-8', keep_alive=True, extra=None):
+        payload = text.encode('utf-8')
+        head = [f'HTTP/1.1 {status} {REASONS.get(status, "")}', f'Content-Type: {content_type}',
+                f'Content-Length: {len(payload)}', f'Connection: {"keep-alive" if keep_alive else "close"}']
+        for k, v in (extra or {}).items():
+            head.append(f'{k}: {v}')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+        await writer.drain()
+
+    def _release(self):
+        self.stats.in_flight -= 1
+
+    async def _convert(self, query, body):
+        source_kind = query.get('from', ['mubu'])[0]
+        target_kind = query.get('to', ['markdown'])[0]
+        if source_kind not in SOURCES or target_kind not in TARGETS:
+            raise _HttpError(400, f'from must be one of {SOURCES}, to one of {TARGETS}')
+        if not body:
+            raise _HttpError(400, 'empty body')
+        use_mubu_img = query.get('use_mubu_img', ['0'])[0].lower() in ('1', 'true', 'yes')
+        if self.stats.in_flight >= self.max_pending:
+            self.stats.rejected += 1
+            raise _HttpError(503, 'too many pending conversions, retry later', {'Retry-After': '1'})
+        self.stats.in_flight += 1
+        begin = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        job = self.pool.submit(convert, source_kind, target_kind, body, use_mubu_img)
+        # the slot is the worker's: a timed out conversion keeps it until the worker is done with it (or it is
+        # cancelled before it started), so max_pending bounds the pool's queue
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            text = await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise _HttpError(504, f'conversion took longer than {self.timeout}s')
+        except Exception as e:
+            self.stats.failed += 1
+            raise _HttpError(422, f'{type(e).__name__}: {e}')
+        self.stats.converted += 1
+        self.stats.record(time.perf_counter() - begin)
+        return text, CONTENT_TYPES[target_kind]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, body, keep_alive = request
+                    self.stats.requests += 1
+                    url = urllib.parse.urlsplit(target)
+                    if url.path == '/convert':
+                        if method != 'POST':
+                            raise _HttpError(405, 'POST the document to /convert')
+                        text, content_type = await self._convert(urllib.parse.parse_qs(url.query), body)
+                        await self._respond(writer, 200, text, content_type, keep_alive)
+                    elif url.path == '/stats':
+                        await self._respond(writer, 200, json.dumps(self.stats.summary(), indent=2),
+                                            'application/json', keep_alive)
+                    else:
+                        raise _HttpError(404, 'try POST /convert or GET /stats')
+                except _HttpError as e:
+                    await self._respond(writer, e.status, e.message + '\n', keep_alive=keep_alive, extra=e.headers)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None):
+        pids = await self.start_pool()
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            where = ', '.join(f'{s.getsockname()[0]}:{s.getsockname()[1]}' for s in server.sockets)
+        print(f'Serving on {where} with {len(pids)} warm workers', flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--unix', help='listen on this unix socket instead of TCP')
+    arg_parser.add_argument('--workers', type=int, default=None, help='worker processes, default: one per CPU')
+    arg_parser.add_argument('--max-pending', type=int, default=64, help='conversions accepted at a time')
+    arg_parser.add_argument('--timeout', type=float, default=30.0, help='seconds per conversion')
+    arg_parser.add_argument('--max-body', type=int, default=64, help='largest accepted upload in MB')
+    args = arg_parser.parse_args(argv)
+
+    server = ConversionServer(args.workers, args.max_pending, args.timeout, args.max_body * 1024 * 1024)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
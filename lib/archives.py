@@ -0,0 +1,146 @@
+"""
+Read exports straight out of zip and tar archives and write results into a zip, without extracting anything to disk.
+
+    for name, mtime in zip_members('export.zip', accept):
+        post = MubuPost(open_zip_member('export.zip', name), modified_time=mtime)
+
+Zip members can be opened in any order, so workers open the archive themselves (and keep the last MAX_OPEN_ZIPS
+archives open) and decompress in parallel. Compressed tars only read front to back: iter_tar_members() streams them
+and hands out each member's bytes.
+Dates come from the archive: the UTC mtime of the zip extended timestamp field if there is one, the local DOS time of
+the entry otherwise, the mtime of tar members.
+"""
+import os
+import struct
+import tarfile
+import time
+import zipfile
+from pathlib import PurePosixPath
+
+ZIP_SUFFIXES = ('.zip',)
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+# zip extra field with unix timestamps
+_EXTENDED_TIMESTAMP = 0x5455
+
+# archives open_zip_member() keeps open in a process, the least recently used one is closed first
+MAX_OPEN_ZIPS = 4
+# archive path -> ((mtime, size) when it was opened, ZipFile), least recently used first
+_open_zips = {}
+
+
+def is_zip(path):
+    return str(path).lower().endswith(ZIP_SUFFIXES)
+
+
+def is_tar(path):
+    return str(path).lower().endswith(TAR_SUFFIXES)
+
+
+def is_archive(path):
+    return is_zip(path) or is_tar(path)
+
+
+def archive_stem(path):
+    """
+    File name of the archive without its (possibly double) suffix: export.tar.gz -> export.
+    """
+    name = PurePosixPath(str(path).replace('\\', '/')).name
+    for suffix in ZIP_SUFFIXES + TAR_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def _zip_mtime(info: zipfile.ZipInfo):
+    extra = info.extra
+    i = 0
+    while i + 4 <= len(extra):
+        header, size = struct.unpack_from('<HH', extra, i)
+        if header == _EXTENDED_TIMESTAMP and size >= 5 and extra[i + 4] & 1:
+            return struct.unpack_from('<i', extra, i + 5)[0]
+        i += 4 + size
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+def zip_members(path, accept=None):
+    """
+    (name, mtime) of the zip's files that accept(name) takes, in archive order.
+    """
+    with zipfile.ZipFile(path) as zf:
+        return [(info.filename, _zip_mtime(info)) for info in zf.infolist()
+                if not info.is_dir() and (accept is None or accept(info.filename))]
+
+
+def open_zip_member(path, name):
+    """
+    Binary stream of one member, decompressed while it is read. The archive stays open for the next member, until
+    MAX_OPEN_ZIPS other archives were opened since, close_zip() or until it changes on disk.
+    """
+    path = os.fspath(path)
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    entry = _open_zips.pop(path, None)
+    if entry is not None and entry[0] != signature:
+        entry[1].close()
+        entry = None
+    if entry is None:
+        while len(_open_zips) >= MAX_OPEN_ZIPS:
+            _open_zips.pop(next(iter(_open_zips)))[1].close()
+        entry = signature, zipfile.ZipFile(path)
+    _open_zips[path] = entry
+    return entry[1].open(name)
+
+
+def close_zip(path):
+    """
+    Close the archive open_zip_member() keeps open for path, if any. Members opened from it can still be read.
+    """
+    entry = _open_zips.pop(os.fspath(path), None)
+    if entry is not None:
+        entry[1].close()
+
+
+def iter_tar_members(path, accept=None):
+    """
+    Yield (name, mtime, bytes) of the tar's regular files that accept(name) takes, reading the archive once.
+    """
+    with tarfile.open(path, mode='r|*') as tf:
+        for info in tf:
+            if not info.isfile() or (accept is not None and not accept(info.name)):
+                continue
+            with tf.extractfile(info) as f:
+                yield info.name, info.mtime, f.read()
+
+
+def member_output_name(name, suffix):
+    """
+    Where the conversion of a member goes, relative to the output: its path in the archive with another suffix.
+    Absolute and parent parts are dropped, nothing ends up outside the output.
+    """
+    parts = [p for p in PurePosixPath(name).parts if p not in ('/', '..', '.')]
+    return str(PurePosixPath(*parts).with_suffix(suffix))
+
+
+class ZipWriter:
+    """
+    Output archive: members are compressed and added as results come in.
+    """
+
+    def __init__(self, path):
+        self.zf = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def write(self, name, data: bytes, mtime=None):
+        # zip dates start in 1980
+        info = zipfile.ZipInfo(name, date_time=max(time.localtime(mtime or time.time())[:6], (1980, 1, 1, 0, 0, 0)))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self.zf.writestr(info, data)
+
+    def close(self):
+        self.zf.close()
@@ -0,0 +1,252 @@
+"""
+Fetch the images of converted posts and store them locally.
+
+    store = AssetStore('assets')
+    report = ImageLocalizer(store).localize([opml], link_base='markdown')
+
+ImageLocalizer collects the mubu_imgs and mkd_imgs URLs of the outline trees, downloads every distinct URL once on a
+thread pool, and rewrites the attributes to the stored files, so Transformer then links the local copies.
+Downloads go through one small pool of keep-alive connections per host, its size is the per-host concurrency limit.
+AssetStore names files by the sha256 of their content, the same image is stored once whatever post or URL it came
+from. Outlines of a compact OutlineTable are read-only and cannot be rewritten.
+"""
+import hashlib
+import http.client
+import mimetypes
+import os
+import pathlib
+import queue
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import tree_walker
+from lib.opml_processor import list_attr
+from lib.outline_table import OutlineView
+
+_CONTENT_TYPE_SUFFIXES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/svg+xml': '.svg',
+}
+_IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.bmp')
+_REDIRECTS = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+
+
+class FetchError(RuntimeError):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class AssetStore:
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+
+    def put(self, data: bytes, suffix=''):
+        """
+        Store data under its content hash, returns the path. Storing the same bytes again is a no-op.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        p = self.root / digest[:2] / f'{digest}{suffix}'
+        if p.exists():
+            return p
+        p.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=p.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, p)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return p
+
+
+class _HostPool:
+    """
+    At most `size` keep-alive connections to one host, get() blocks while they are all in use.
+    """
+
+    def __init__(self, scheme, netloc, size, timeout):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        for _ in range(size):
+            self.idle.put(None)
+
+    def get(self):
+        conn = self.idle.get()
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            conn = cls(self.netloc, timeout=self.timeout)
+        return conn
+
+    def put(self, conn, reusable=True):
+        if not reusable:
+            conn.close()
+            conn = None
+        self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            if conn is not None:
+                conn.close()
+
+
+class ImageLocalizer:
+    def __init__(self, store: AssetStore, max_workers=16, per_host=4, retries=3, timeout=30, backoff=0.5,
+                 user_agent='mubu2markdown'):
+        self.store = store
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.user_agent = user_agent
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def _pool(self, scheme, netloc):
+        with self._pools_lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                pool = _HostPool(scheme, netloc, self.per_host, self.timeout)
+                self._pools[(scheme, netloc)] = pool
+            return pool
+
+    def close(self):
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+    def _get_once(self, url):
+        """
+        One GET with redirects, returns (body, content type).
+        """
+        for _ in range(_MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise FetchError(f'Unsupported url: {url}')
+            target = parts.path or '/'
+            if parts.query:
+                target += '?' + parts.query
+            pool = self._pool(parts.scheme, parts.netloc)
+            conn = pool.get()
+            reusable = False
+            try:
+                conn.request('GET', target, headers={'User-Agent': self.user_agent})
+                response = conn.getresponse()
+                body = response.read()
+                reusable = not response.will_close
+            finally:
+                pool.put(conn, reusable)
+            if response.status in _REDIRECTS and response.getheader('Location'):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                raise FetchError(f'HTTP {response.status} for {url}', status=response.status)
+            return body, response.getheader('Content-Type')
+        raise FetchError(f'Too many redirects for {url}')
+
+    def fetch(self, url):
+        """
+        Download url into the store with retries, returns the stored path.
+        """
+        attempt = 0
+        while True:
+            try:
+                body, content_type = self._get_once(url)
+                return self.store.put(body, self._suffix(url, content_type))
+            except (OSError, http.client.HTTPException, FetchError) as e:
+                status = getattr(e, 'status', None)
+                # client errors will not get better
+                if attempt >= self.retries or (status is not None and 400 <= status < 500):
+                    raise
+                attempt += 1
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+
+    @staticmethod
+    def _suffix(url, content_type):
+        path_suffix = pathlib.PurePosixPath(urllib.parse.urlsplit(url).path).suffix.lower()
+        if path_suffix in _IMAGE_SUFFIXES:
+            return path_suffix
+        if content_type:
+            mime = content_type.split(';')[0].strip().lower()
+            return _CONTENT_TYPE_SUFFIXES.get(mime) or mimetypes.guess_extension(mime) or ''
+        return ''
+
+    def fetch_all(self, urls):
+        """
+        Download every distinct url concurrently, returns ({url: stored path}, {url: error}).
+        """
+        distinct = list(dict.fromkeys(urls))
+        done, failed = {}, {}
+        if not distinct:
+            return done, failed
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(distinct))) as pool:
+            futures = {url: pool.submit(self.fetch, url) for url in distinct}
+            for url, f in futures.items():
+                try:
+                    done[url] = f.result()
+                except Exception as e:
+                    failed[url] = e
+        return done, failed
+
+    @staticmethod
+    def _mkd_image_url(mkd_image):
+        # '![alt](url' as MubuPost._parse_note collects it
+        i = mkd_image.rfind('](')
+        return mkd_image[i + 2:].rstrip(')').strip() if i >= 0 else None
+
+    def localize(self, opmls, link_base=None):
+        """
+        Fetch the images of all given OPML trees at once and point their attributes at the stored files, relative to
+        link_base (usually the markdown output directory) if given. Images that could not be fetched keep their url.
+        Returns ({url: stored path}, {url: error}).
+        """
+        return self.localize_outlines((o for opml in opmls
+                                       for o, _ in tree_walker.preorder(opml.body.outlines, tree_walker.sub_outlines)),
+                                      link_base)
+
+    def localize_outlines(self, outlines, link_base=None):
+        """
+        localize() for the given outlines only, not their sub_outlines.
+        """
+        outlines = [o for o in outlines if o.attrs and ('mubu_imgs' in o.attrs or 'mkd_imgs' in o.attrs)]
+        if any(isinstance(o, OutlineView) for o in outlines):
+            # its attrs are a fresh copy on every access, rewriting them would change nothing
+            raise RuntimeError('OutlineView is read-only, localize the images of an Outline tree')
+        urls = []
+        for o in outlines:
+            urls.extend(list_attr(o.attrs.get('mubu_imgs')))
+            urls.extend(u for u in map(self._mkd_image_url, list_attr(o.attrs.get('mkd_imgs'))) if u)
+        done, failed = self.fetch_all(urls)
+
+        def link(url):
+            p = done.get(url)
+            if p is None:
+                return url
+            return pathlib.Path(os.path.relpath(p, link_base) if link_base else os.path.abspath(p)).as_posix()
+
+        for o in outlines:
+            if o.attrs.get('mubu_imgs'):
+                o.attrs['mubu_imgs'] = [link(u) for u in list_attr(o.attrs['mubu_imgs'])]
+            if o.attrs.get('mkd_imgs'):
+                rewritten = []
+                for mi in list_attr(o.attrs['mkd_imgs']):
+                    url = self._mkd_image_url(mi)
+                    rewritten.append(mi[:mi.rfind('](') + 2] + link(url) if url else mi)
+                o.attrs['mkd_imgs'] = rewritten
+        return done, failed
@@ -0,0 +1,148 @@
+"""
+On-disk cache of finished conversions, keyed by a hash of the exported bytes, the conversion options and CACHE_VERSION.
+
+    <cache_dir>/<key[:2]>/<key>.md   rendered markdown
+
+Entries are written to a temporary file and renamed into place, so concurrent workers never see half an entry.
+Reading an entry refreshes its mtime, evict() drops the least recently used entries until the cache fits max_bytes,
+invalidate() the entry of one key.
+"""
+import hashlib
+import os
+import pathlib
+import tempfile
+
+MARKDOWN_SUFFIX = '.md'
+# OPML models cached by older versions, still evicted and cleared
+OPML_SUFFIX = '.xml'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# part of every key: bump it whenever the rendering changes, entries of older versions are then never hit (and age out)
+CACHE_VERSION = 2
+READ_CHUNK_SIZE = 1 << 20
+
+
+class ConversionCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        assert cache_dir
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _hasher(options):
+        h = hashlib.sha256(f'v{CACHE_VERSION}\0'.encode('utf-8'))
+        for k in sorted(options):
+            h.update(f'{k}={options[k]!r}\0'.encode('utf-8'))
+        return h
+
+    @staticmethod
+    def key(source_bytes, **options):
+        h = ConversionCache._hasher(options)
+        h.update(source_bytes)
+        return h.hexdigest()
+
+    @staticmethod
+    def key_of_file(file_path, **options):
+        h = ConversionCache._hasher(options)
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _path(self, key, suffix):
+        return self.cache_dir / key[:2] / f'{key}{suffix}'
+
+    def _read(self, key, suffix):
+        p = self._path(key, suffix)
+        try:
+            data = p.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(p)
+        except FileNotFoundError:
+            # evicted in between, we still have the bytes
+            pass
+        return data
+
+    def _write(self, key, suffix, data: bytes):
+        p = self._path(key, suffix)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=p.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, p)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def get_markdown(self, key):
+        """
+        The cached markdown bytes, None on a miss.
+        """
+        return self._read(key, MARKDOWN_SUFFIX)
+
+    def put(self, key, markdown: bytes):
+        self._write(key, MARKDOWN_SUFFIX, markdown)
+
+    def _entries(self):
+        if not self.cache_dir.is_dir():
+            return
+        for bucket in self.cache_dir.iterdir():
+            if not bucket.is_dir():
+                continue
+            for p in bucket.iterdir():
+                if p.suffix not in (MARKDOWN_SUFFIX, OPML_SUFFIX):
+                    continue
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                yield p, st
+
+    def size(self):
+        return sum(st.st_size for _, st in self._entries())
+
+    def evict(self):
+        """
+        Remove least recently used files until the cache fits max_bytes, returns the number of files removed.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        total = sum(st.st_size for _, st in entries)
+        removed = 0
+        for p, st in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= st.st_size
+            removed += 1
+        return removed
+
+    def invalidate(self, key):
+        """
+        Drop the entry of key, returns whether there was one.
+        """
+        removed = False
+        for suffix in (MARKDOWN_SUFFIX, OPML_SUFFIX):
+            try:
+                self._path(key, suffix).unlink()
+                removed = True
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def clear(self):
+        """
+        Drop every entry, returns the number of files removed.
+        """
+        removed = 0
+        for p, _ in list(self._entries()):
+            try:
+                p.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
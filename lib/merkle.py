@@ -0,0 +1,208 @@
+"""
+Merkle hashes of outline subtrees, to re-render only the branches of a post that changed since the last run.
+
+    hashes = SubtreeHashes(opml.body.outlines)
+    body, manifest, reused = render_incremental(hashes, render_node, Manifest.load(path), previous_body)
+    manifest.save(path)
+
+The digest of an outline covers its text, its attributes and the digests of its children, in order, so two subtrees
+with the same digest render the same (attributes hash by repr(), a list and its str() from Parser do not match).
+Every rendering that writes each outline in pre-order (markdown does) puts a subtree in one contiguous slice of the
+output, a Manifest keeps the digest and the start offset of every node of the last output: a subtree whose digest is
+found again is copied out of the previous output instead of rendered, its nodes are not even visited.
+plan_incremental() tells which outlines will be rendered before anything is, e.g. to fetch the images of only those.
+Hashing still walks the whole tree and costs more than the markdown of a node (about 1.8x), the savings come with
+renderings that cost more per node, like fetching images.
+A Manifest also keeps a digest of the render options (options_digest()): what an outline renders to can depend on
+more than the outline, e.g. where its images are stored, and a manifest written with other options is not reused.
+"""
+import hashlib
+import struct
+import sys
+from array import array
+
+DIGEST_SIZE = 16
+MAGIC = b'MBMERK\x00\x02'
+# magic, node count, body length, body digest, options digest
+_HEADER = struct.Struct(f'<8sQQ{DIGEST_SIZE}s{DIGEST_SIZE}s')
+NO_OPTIONS = bytes(DIGEST_SIZE)
+
+
+def body_digest(body: bytes):
+    return hashlib.blake2b(body, digest_size=DIGEST_SIZE).digest()
+
+
+def options_digest(options: dict = None):
+    """
+    Fingerprint of the render options, NO_OPTIONS for none.
+    """
+    if not options:
+        return NO_OPTIONS
+    return hashlib.blake2b(repr(sorted(options.items())).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+class SubtreeHashes:
+    """
+    The outlines in pre-order with the digest and the node count of the subtree each one roots.
+    """
+
+    def __init__(self, outlines):
+        nodes = self.nodes = []
+        digests = self.digests = []
+        self.sizes = array('i')
+        sizes = []
+        blake2b = hashlib.blake2b
+        # the explicit stack of tree_walker.walk, inlined: hashing has to stay cheaper than rendering to pay off
+        stack = [iter(outlines)]
+        # (index, [own key, child digests...]) of the outlines whose children are being hashed
+        path = []
+        while stack:
+            o = next(stack[-1], None)
+            if o is None:
+                stack.pop()
+                if path:
+                    i, parts = path.pop()
+                    d = digests[i] = blake2b(b''.join(parts), digest_size=DIGEST_SIZE).digest()
+                    sizes[i] = len(nodes) - i
+                    if path:
+                        path[-1][1].append(d)
+                continue
+            attrs = o.attrs
+            key = f'{o.text}\0{attrs!r}'.encode('utf-8') if attrs else o.text.encode('utf-8')
+            i = len(nodes)
+            nodes.append(o)
+            children = o.sub_outlines
+            if children:
+                digests.append(None)
+                sizes.append(0)
+                path.append((i, [key, b'\1']))
+                stack.append(iter(children))
+                continue
+            d = blake2b(key, digest_size=DIGEST_SIZE).digest()
+            digests.append(d)
+            sizes.append(1)
+            if path:
+                path[-1][1].append(d)
+        self.sizes.extend(sizes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class Manifest:
+    """
+    Digest and start offset of every node of a rendered body, offsets has one more entry: the body length.
+    options is the options_digest() of the rendering.
+    """
+
+    def __init__(self, digests: bytes, offsets: array, digest: bytes, options: bytes = NO_OPTIONS):
+        self.digests = digests
+        self.offsets = offsets
+        self.digest = digest
+        self.options = options
+        self._positions = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def position(self, digest):
+        """
+        Pre-order index of a node with this subtree digest, None if there is none.
+        """
+        if self._positions is None:
+            positions = {}
+            d = self.digests
+            for k in range(len(self) - 1, -1, -1):
+                positions[d[k * DIGEST_SIZE:(k + 1) * DIGEST_SIZE]] = k
+            self._positions = positions
+        return self._positions.get(digest)
+
+    def matches(self, body: bytes):
+        return len(body) == self.offsets[-1] and body_digest(body) == self.digest
+
+    def save(self, path):
+        offsets = array('q', self.offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, len(self), self.offsets[-1], self.digest, self.options))
+            f.write(self.digests)
+            f.write(offsets.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """
+        The manifest at path, None if there is none or it is not one.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, count, length, digest, options = _HEADER.unpack_from(data, 0)
+        digests_end = _HEADER.size + count * DIGEST_SIZE
+        if magic != MAGIC or len(data) != digests_end + 8 * (count + 1):
+            return None
+        offsets = array('q', struct.unpack_from(f'<{count + 1}q', data, digests_end))
+        if offsets[-1] != length:
+            return None
+        return cls(data[_HEADER.size:digests_end], offsets, digest, options)
+
+
+def plan_incremental(hashes: SubtreeHashes, previous: Manifest = None):
+    """
+    Decide what to render: a list of (index, previous index) in pre-order, previous index is None for an outline that
+    has to be rendered and the position of the same subtree in previous otherwise, its descendants are then skipped.
+    """
+    digests, sizes = hashes.digests, hashes.sizes
+    n = len(hashes)
+    if previous is None:
+        return [(i, None) for i in range(n)]
+    plan = []
+    i = 0
+    while i < n:
+        k = previous.position(digests[i])
+        plan.append((i, k))
+        i += 1 if k is None else sizes[i]
+    return plan
+
+
+def render_incremental(hashes: SubtreeHashes, render_node, previous: Manifest = None, previous_body: bytes = None,
+                       plan=None, options: bytes = NO_OPTIONS):
+    """
+    Render the body outline by outline with render_node(outline) -> str, copying the subtrees that previous knows from
+    previous_body (which must be the body previous was made for, see Manifest.matches, with the same options).
+    Returns (body bytes, Manifest of the new body with options, number of outlines reused).
+    """
+    if previous is None or previous_body is None:
+        previous = None
+    if plan is None:
+        plan = plan_incremental(hashes, previous)
+    n = len(hashes)
+    nodes, sizes = hashes.nodes, hashes.sizes
+    offsets = array('q', bytes(8 * (n + 1)))
+    chunks = []
+    position = 0
+    reused = 0
+    if previous is not None:
+        previous_view = memoryview(previous_body)
+        old_offsets = previous.offsets
+    for i, k in plan:
+        if k is None:
+            offsets[i] = position
+            b = render_node(nodes[i]).encode('utf-8')
+            chunks.append(b)
+            position += len(b)
+            continue
+        size = sizes[i]
+        begin, end = old_offsets[k], old_offsets[k + size]
+        delta = position - begin
+        offsets[i:i + size] = array('q', [x + delta for x in old_offsets[k:k + size]])
+        chunks.append(previous_view[begin:end])
+        position += end - begin
+        reused += size
+    offsets[n] = position
+    body = b''.join(chunks)
+    return body, Manifest(b''.join(hashes.digests), offsets, body_digest(body), options), reused
@@ -0,0 +1,140 @@
+"""
+Opt-in instrumentation for MubuPost, Transformer, Parser and Generator.
+
+Pass a Metrics to any of them to collect stage durations, counters (nodes, spans, images, codes...) and bytes read
+and written; every measurement is also handed to an optional callback as it happens:
+
+    m = Metrics(callback=print)
+    MubuPost(path, metrics=m).to_markdown()
+    m.write_json('metrics.json')
+
+Without one they use NULL_METRICS, whose methods do nothing (merge() included) and whose `enabled` is False, so hot
+loops only pay a boolean test.
+"""
+import cProfile
+import contextlib
+import json
+import pstats
+import time
+
+STAGE = 'stage'
+COUNT = 'count'
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'begin')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.name, time.perf_counter() - self.begin)
+        return False
+
+
+class Metrics:
+    enabled = True
+
+    def __init__(self, callback=None):
+        """
+        callback(kind, name, value) is called with (STAGE, name, seconds) and (COUNT, name, increment).
+        """
+        self.callback = callback
+        self.stages = {}
+        self.stage_calls = {}
+        self.counts = {}
+
+    def stage(self, name):
+        """
+        Context manager timing one stage, repeated stages of the same name add up.
+        """
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+        if self.callback:
+            self.callback(STAGE, name, seconds)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+        if self.callback:
+            self.callback(COUNT, name, n)
+
+    def merge(self, other):
+        """
+        Add the measurements of another Metrics, e.g. one returned by a worker process.
+        """
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + other.stage_calls.get(name, 0)
+        for name, n in other.counts.items():
+            self.counts[name] = self.counts.get(name, 0) + n
+        return self
+
+    def summary(self):
+        return {
+            'stages': {name: {'seconds': seconds, 'calls': self.stage_calls[name]}
+                       for name, seconds in self.stages.items()},
+            'counts': dict(self.counts),
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.summary(), ensure_ascii=False, **kwargs)
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json(indent=2))
+            f.write('\n')
+
+    def __getstate__(self):
+        # callbacks are often lambdas, ship only the numbers to and from worker processes
+        return {'callback': None, 'stages': self.stages, 'stage_calls': self.stage_calls, 'counts': self.counts}
+
+
+class _NullMetrics(Metrics):
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def merge(self, other):
+        return self
+
+    def __bool__(self):
+        return False
+
+
+_NULL_STAGE = contextlib.nullcontext()
+
+NULL_METRICS = _NullMetrics()
+
+
+@contextlib.contextmanager
+def profiled(output_path=None, sort_by='cumulative', limit=30):
+    """
+    Run the body under cProfile, dump the stats to output_path (for snakeviz, pstats...) or print the top `limit`
+    entries.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_path:
+            profiler.dump_stats(output_path)
+        else:
+            pstats.Stats(profiler).sort_stats(sort_by).print_stats(limit)
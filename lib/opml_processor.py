@@ -2,12 +2,66 @@
 http://opml.org/spec2.opml
 """
 
+import ast
+import io
+import operator
+import os
 import pathlib
 from lxml import etree
 from abc import abstractmethod
 
+from lib import tree_walker
+from lib.metrics import Metrics, NULL_METRICS
+
+
+_ATTRIBUTE_ESCAPES = (
+    ('&', '&amp;'),
+    ('<', '&lt;'),
+    ('>', '&gt;'),
+    ('"', '&quot;'),
+    ('\n', '&#10;'),
+    ('\r', '&#13;'),
+    ('\t', '&#9;'),
+)
+
+
+def escape_attribute(value):
+    s = str(value)
+    for raw, escaped in _ATTRIBUTE_ESCAPES:
+        if raw in s:
+            s = s.replace(raw, escaped)
+    return s
+
+
+# attributes MubuPost stores as lists, Parser hands them over as their str()
+LIST_ATTRS = ('mubu_imgs', 'mkd_imgs', 'mkd_codes')
+
+
+def list_attr(value):
+    """
+    The items of a LIST_ATTRS attribute, whether it is the list MubuPost built or its str() read back from OPML;
+    [] for none. Raises SyntaxError for a string that is not a list.
+    """
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        parsed = None
+    if not isinstance(parsed, list):
+        raise SyntaxError(f'expected the str() of a list, got {value[:80]!r}')
+    return parsed
+
+
+# children_of for serialization, dispatches to the subclass' xml_children
+_xml_children = operator.methodcaller('xml_children')
+
 
 class Element:
+    __slots__ = ()
+
     @abstractmethod
     def my_tag(self):
         pass
@@ -19,36 +73,60 @@ class Element:
     def _on_append_attributes(self, collector: dict):
         pass
 
+    # written after the element when it is serialized as a child of another element
+    XML_TAIL = ''
+
+    def xml_children(self):
+        return None
+
     def children_content(self):
-        return ''
+        return ''.join(Element._iter_xml(self.xml_children() or ()))
 
     def has_children(self):
         return False
 
-    @staticmethod
-    def _add_property(s, key, value):
-        return f'{s} {key}="{value}"'
-
     def __str__(self):
         return self.my_tag()
 
-    def to_xml_string(self):
-        s = '<' + self.my_tag()
+    def _start_tag(self):
         attrs = {}
         self._on_append_attributes(attrs)
-        if attrs and len(attrs) > 0:
-            for k, v in attrs.items():
-                s = self._add_property(s, k, v)
-        if self.has_children():
-            s += '>\n'
-            s += self.children_content()
-            s += f'</{self.my_tag()}>'
-        else:
-            s += '/>'
-        return s
+        if not attrs:
+            return '<' + self.my_tag()
+        return '<' + self.my_tag() + ''.join(f' {k}="{escape_attribute(v)}"' for k, v in attrs.items())
+
+    @staticmethod
+    def _iter_xml(elements, root=None):
+        for event, e in tree_walker.iterwalk(elements, _xml_children):
+            if event == tree_walker.START:
+                yield e._start_tag() + ('>\n' if e.has_children() else '/>')
+            elif e is root:
+                if e.has_children():
+                    yield f'</{e.my_tag()}>'
+            elif e.has_children():
+                yield f'</{e.my_tag()}>{e.XML_TAIL}'
+            else:
+                yield e.XML_TAIL
+
+    def iter_xml(self):
+        """
+        Yield the XML of this element chunk by chunk, so the whole document never has to be held in memory.
+        """
+        return self._iter_xml((self,), root=self)
+
+    def write_xml(self, fp):
+        write = fp.write
+        for chunk in self.iter_xml():
+            write(chunk)
+
+    def to_xml_string(self):
+        return ''.join(self.iter_xml())
 
 
 class Head(Element):
+    __slots__ = ('title', 'create_date', 'modified_date', 'owner_name', 'owner_email')
+    XML_TAIL = '\n'
+
     def is_valid(self):
         return self.title is not None
 
@@ -82,6 +160,9 @@ class Head(Element):
 
 
 class Outline(Element):
+    __slots__ = ('text', 'sub_outlines', 'attrs')
+    XML_TAIL = '\n'
+
     def is_valid(self):
         return self.text is not None
 
@@ -112,18 +193,17 @@ class Outline(Element):
         for k, v in self.attrs.items():
             collector[k] = v
 
-    def children_content(self):
-        s = ''
-        for so in self.sub_outlines:
-            s += f'{so.to_xml_string()}\n'
-        return s
+    def xml_children(self):
+        return self.sub_outlines
 
 
 class Body(Element):
+    __slots__ = ('outlines',)
+
     def is_valid(self):
         if len(self.outlines) == 0:
             return False
-        for l in self.outlines:
+        for l, _ in tree_walker.preorder(self.outlines, tree_walker.sub_outlines):
             if not l.is_valid():
                 return False
         return True
@@ -137,16 +217,15 @@ class Body(Element):
     def has_children(self):
         return True
 
-    def children_content(self):
+    def xml_children(self):
         if not self.outlines or len(self.outlines) == 0:
             raise RuntimeError("No one outline found.")
-        s = ''
-        for o in self.outlines:
-            s += f'{o.to_xml_string()}\n'
-        return s
+        return self.outlines
 
 
 class OPML(Element):
+    __slots__ = ('head', 'body')
+
     def is_valid(self):
         return self.head.is_valid() and self.body.is_valid()
 
@@ -165,29 +244,47 @@ class OPML(Element):
     def _on_append_attributes(self, collector: dict):
         collector['version'] = '2.0'
 
-    def children_content(self):
-        return f'{self.head.to_xml_string()}\n{self.body.to_xml_string()}'
+    def xml_children(self):
+        return self.head, self.body
 
 
 class Generator:
-    def __init__(self, opml: OPML, file_name):
+    def __init__(self, opml: OPML, file_name, metrics: Metrics = None):
         self.file_name = file_name
         self.opml = opml
+        self.metrics = metrics or NULL_METRICS
 
     def write(self, path):
         file_path = f'{path}/{self.file_name}.xml'
         if pathlib.Path(file_path).exists():
             raise RuntimeError(f'File already exist: {file_path}')
-        with open(file_path, mode='w', encoding='utf-8') as f:
-            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-            f.write(self.opml.to_xml_string())
+        with self.metrics.stage('Generator.write'):
+            with open(file_path, mode='w', encoding='utf-8') as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                self.opml.write_xml(f)
+        if self.metrics.enabled:
+            self.metrics.count('bytes_written', os.path.getsize(file_path))
 
         print(f'DONE output file: {file_path}')
 
 
 class Parser:
-    def __init__(self, xml_string: str = None, file_path: str = None):
+    """
+    streaming=True parses the source in one pass with etree.iterparse: the document is validated while the model is
+    built and processed elements are cleared, instead of parsing (and holding) the whole tree up front.
+    huge_tree=True lifts libxml2's safety limits for very large or very deep documents.
+    compact=True stores the outlines in a flat lib.outline_table.OutlineTable, the body then holds read-only views.
+    """
+
+    def __init__(self, xml_string: str = None, file_path: str = None, streaming: bool = False,
+                 huge_tree: bool = False, compact: bool = False, metrics: Metrics = None):
         assert xml_string or file_path
+        self.metrics = metrics or NULL_METRICS
+        self.streaming = streaming
+        self.huge_tree = huge_tree
+        self.compact = compact
+        self.file_path = None
+        self.xml_bytes = None
         if xml_string:
             self.xml_bytes = bytes(xml_string, encoding='utf-8')
         else:
@@ -195,24 +292,38 @@ class Parser:
             if not p.exists() or not p.is_file():
                 raise RuntimeError(f'IO Error, target file ({file_path}) cant open in the right way, please make sure '
                                    f'it exist and is a file format.')
-            with open(file_path, 'r', encoding='utf-8') as source_file:
-                self.xml_bytes = bytes(source_file.read(), encoding='utf-8')
+            if streaming:
+                size = p.stat().st_size
+                assert size > 0
+                # lxml reads the file itself, validation happens in parse()
+                self.file_path = file_path
+                self.metrics.count('bytes_read', size)
+                return
+            with self.metrics.stage('Parser.read'):
+                with open(file_path, 'r', encoding='utf-8') as source_file:
+                    self.xml_bytes = bytes(source_file.read(), encoding='utf-8')
         assert len(self.xml_bytes) > 0
-        try:
-            etree.XML(self.xml_bytes)
-        except Exception as e:
-            raise RuntimeError('Input content is not a valid XML, please check it.', e)
-
-    @staticmethod
-    def _config_parser():
-        return etree.XMLParser(
+        self.metrics.count('bytes_read', len(self.xml_bytes))
+        if streaming:
+            return
+        with self.metrics.stage('Parser.validate'):
+            try:
+                etree.XML(self.xml_bytes, parser=self._config_parser())
+            except Exception as e:
+                raise RuntimeError('Input content is not a valid XML, please check it.', e)
+
+    def _parser_options(self):
+        return dict(
             ns_clean=True,
             remove_comments=True,
             no_network=True,
             load_dtd=False,
-            huge_tree=False
+            huge_tree=self.huge_tree
         )
 
+    def _config_parser(self):
+        return etree.XMLParser(**self._parser_options())
+
     """
       tag  key in attrib attrib[key]
        |       |           |
@@ -220,7 +331,33 @@ class Parser:
     """
 
     def parse(self):
-        xml_tree = etree.fromstring(self.xml_bytes, parser=self._config_parser())
+        with self.metrics.stage('Parser.parse'):
+            if self.streaming:
+                return self._parse_streaming()
+            xml_tree = etree.fromstring(self.xml_bytes, parser=self._config_parser())
+            return self._build_opml(etree.iterwalk(xml_tree, events=('start', 'end')))
+
+    def _parse_streaming(self):
+        source = self.file_path if self.file_path else io.BytesIO(self.xml_bytes)
+        options = self._parser_options()
+        # iterparse has no ns_clean switch
+        options.pop('ns_clean')
+        events = etree.iterparse(source, events=('start', 'end'), **options)
+        try:
+            return self._build_opml(events, release_processed=True)
+        except etree.XMLSyntaxError as e:
+            raise RuntimeError('Input content is not a valid XML, please check it.', e)
+
+    @staticmethod
+    def _release(raw_n):
+        # outlines are already turned into the model at this point, drop the lxml nodes behind us
+        raw_n.clear(keep_tail=True)
+        parent = raw_n.getparent()
+        if parent is not None:
+            while raw_n.getprevious() is not None:
+                del parent[0]
+
+    def _build_opml(self, events, release_processed=False):
         is_opml = False
 
         head = None
@@ -230,11 +367,19 @@ class Parser:
 
         body_outlines = []
 
+        outline_count = 0
+
+        table = None
+        if self.compact:
+            # imported here, outline_table builds on this module
+            from lib.outline_table import OutlineTable, NO_NODE
+            table = OutlineTable()
+
         def opt_value(atts: dict, key: str):
             assert atts
             return atts[key] if key in atts else None
 
-        for event, raw_n in etree.iterwalk(xml_tree, events=('start', 'end')):
+        for event, raw_n in events:
             # str
             tag = raw_n.tag
             # dict
@@ -244,13 +389,13 @@ class Parser:
             if event == 'start':
                 if tag == 'opml':
                     if is_opml:
-                        raise SyntaxError('<opml> already entered, but there has another one at line:' + source_line)
+                        raise SyntaxError(f'<opml> already entered, but there has another one at line:{source_line}')
                     else:
                         is_opml = True
                 elif tag == 'head':
                     head_title = opt_value(attrs, 'title')
                     if not head_title:
-                        raise SyntaxError('<head> must has a "title" attribute, line:' + source_line)
+                        raise SyntaxError(f'<head> must has a "title" attribute, line:{source_line}')
                     create_date = opt_value(attrs, 'dateCreated')
                     modified_date = opt_value(attrs, 'dateModified')
                     owner_name = opt_value(attrs, 'ownerName')
@@ -258,13 +403,15 @@ class Parser:
                     head = Head(head_title, create_date, modified_date,
                                 owner_name, owner_email)
                 elif tag == 'outline':
+                    outline_count += 1
                     text = opt_value(attrs, 'text')
                     if not text:
-                        raise SyntaxError('<outline> must has a "title" attribute, line:' + source_line)
-                    y = {}
-                    for k, y[k] in attrs.items():
-                        pass
+                        raise SyntaxError(f'<outline> must has a "title" attribute, line:{source_line}')
+                    y = dict(attrs)
                     y.pop('text', None)
+                    if table is not None:
+                        outline_stack.append(table.append(text, y, outline_stack[-1] if outline_stack else NO_NODE))
+                        continue
                     o = Outline(text, None, y if len(y) > 0 else None)
                     if len(outline_stack) > 0:
                         top_o = outline_stack[-1]
@@ -275,9 +422,15 @@ class Parser:
             if event == 'end':
                 if tag == 'outline':
                     outline_stack.pop()
+                    if release_processed:
+                        self._release(raw_n)
+                elif tag == 'head':
+                    if release_processed:
+                        self._release(raw_n)
                 elif tag == 'body':
-                    body = Body(body_outlines)
+                    body = Body(table.freeze().roots() if table is not None else body_outlines)
                 elif tag == 'opml':
+                    self.metrics.count('outlines', outline_count)
                     ret = OPML(head, body)
                     if not ret.is_valid():
                         raise SyntaxError('Wrong OPML structure, check the input content.')
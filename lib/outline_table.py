@@ -0,0 +1,183 @@
+"""
+Flat, array-backed storage for big outline trees.
+
+Every outline is a row: its parent, first child and next sibling are indices in typed arrays (-1 for none), its text is
+a reference into a list of interned strings and its attributes an index into a table of de-duplicated (key, value)
+tuples. A node costs a few machine words instead of an object, a __dict__, a list and a dict.
+
+OutlineView puts the Outline interface on top of a row, so Transformer, validation and serialization work on a table
+without knowing about it. It is an Element, not an Outline, so a view carries its two slots and nothing else.
+"""
+from array import array
+
+from lib.opml_processor import Element
+
+NO_NODE = -1
+
+
+class OutlineView(Element):
+    """
+    Read-only outline backed by one row of an OutlineTable. Views are created on demand and hold no data of their own.
+    """
+    __slots__ = ('table', 'index')
+    XML_TAIL = '\n'
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def text(self):
+        return self.table.texts[self.index]
+
+    @property
+    def attrs(self):
+        return self.table.attrs_of(self.index)
+
+    @property
+    def sub_outlines(self):
+        children = self.table.children_of(self.index)
+        return [OutlineView(self.table, c) for c in children] if children else None
+
+    def is_valid(self):
+        return self.text is not None
+
+    def my_tag(self):
+        return 'outline'
+
+    def has_children(self):
+        return self.table.has_children(self.index)
+
+    def _on_append_attributes(self, collector: dict):
+        collector['text'] = self.text
+        attrs = self.attrs
+        if attrs:
+            collector.update(attrs)
+
+    def xml_children(self):
+        return self.sub_outlines
+
+    def __str__(self):
+        return f'{self.my_tag()} text={self.text}, children={len(self.table.children_of(self.index))}'
+
+    def append_child(self, child):
+        raise RuntimeError('OutlineView is read-only, use OutlineTable.append()')
+
+    def __eq__(self, other):
+        return isinstance(other, OutlineView) and other.table is self.table and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+
+class OutlineTable:
+    def __init__(self):
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.attr_index = array('i')
+        self.texts = []
+        self.attr_table = []
+        self.root_indices = array('i')
+        # only needed while building, see freeze()
+        self._last_child = array('i')
+        self._strings = {}
+        self._attr_rows = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _intern(self, s):
+        if not isinstance(s, str):
+            return s
+        return self._strings.setdefault(s, s)
+
+    def _attr_row(self, attrs):
+        if not attrs:
+            return NO_NODE
+        row = tuple((self._intern(k), self._intern(v)) for k, v in attrs.items())
+        try:
+            index = self._attr_rows.get(row)
+        except TypeError:
+            # unhashable values (lists from MubuPost) are stored as they are
+            index = None
+            hashable = False
+        else:
+            hashable = True
+        if index is None:
+            index = len(self.attr_table)
+            self.attr_table.append(row)
+            if hashable:
+                self._attr_rows[row] = index
+        return index
+
+    def append(self, text, attrs=None, parent=NO_NODE):
+        """
+        Add an outline as the last child of parent (or as the last root), returns its index.
+        """
+        assert text
+        index = len(self.texts)
+        self.texts.append(self._intern(text))
+        self.attr_index.append(self._attr_row(attrs))
+        self.parent.append(parent)
+        self.first_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self._last_child.append(NO_NODE)
+        if parent == NO_NODE:
+            if self.root_indices:
+                self.next_sibling[self.root_indices[-1]] = index
+            self.root_indices.append(index)
+        else:
+            previous = self._last_child[parent]
+            if previous == NO_NODE:
+                self.first_child[parent] = index
+            else:
+                self.next_sibling[previous] = index
+            self._last_child[parent] = index
+        return index
+
+    def freeze(self):
+        """
+        Drop the bookkeeping only needed by append().
+        """
+        self._last_child = array('i')
+        self._strings = {}
+        self._attr_rows = {}
+        return self
+
+    def has_children(self, index):
+        return self.first_child[index] != NO_NODE
+
+    def children_of(self, index):
+        ret = []
+        c = self.first_child[index]
+        while c != NO_NODE:
+            ret.append(c)
+            c = self.next_sibling[c]
+        return ret
+
+    def attrs_of(self, index):
+        row = self.attr_index[index]
+        if row == NO_NODE:
+            return None
+        return dict(self.attr_table[row])
+
+    def roots(self):
+        """
+        Views of the top level outlines, ready for Body.
+        """
+        return [OutlineView(self, i) for i in self.root_indices]
+
+    @classmethod
+    def from_outlines(cls, outlines):
+        """
+        Compact an existing Outline tree.
+        """
+        table = cls()
+        stack = [(o, NO_NODE) for o in reversed(outlines)]
+        while stack:
+            o, parent = stack.pop()
+            index = table.append(o.text, o.attrs, parent)
+            if o.sub_outlines:
+                stack.extend((c, index) for c in reversed(o.sub_outlines))
+        return table.freeze()
@@ -0,0 +1,291 @@
+"""
+Persistent full-text index of converted outlines, in SQLite FTS5.
+
+    with SearchIndex('index.db') as index:
+        index.index_opml('posts/a.html', opml, digest)
+        for hit in index.search('lxml iterparse'):
+            print(hit.document, hit.node_path, hit.line, hit.text)
+
+Every outline is a row: its document, its path in the tree ('2.1.4': fourth child of the first child of the second
+top level outline), its depth and heading level, the line it starts on in the markdown Transformer writes, its text
+and code blocks (searchable) and its images. Rows are built first and written in one short transaction that replaces
+the document's rows, several processes can share an index; re-indexing is skipped if the digest did not change.
+IndexSink collects the rows while a conversion renders, see lib.sinks.
+CJK characters are indexed one by one and queries searched as phrases, so any substring of Chinese text is found.
+"""
+import argparse
+import contextlib
+import json
+import re
+import sqlite3
+import sys
+import time
+from typing import NamedTuple
+
+from lib import tree_walker
+from lib.opml_processor import OPML, Head, list_attr
+from lib.sinks import Sink
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    title TEXT,
+    digest TEXT,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS outlines (
+    id INTEGER PRIMARY KEY,
+    doc_id INTEGER NOT NULL,
+    node_path TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    heading INTEGER,
+    line INTEGER NOT NULL,
+    images TEXT
+);
+CREATE INDEX IF NOT EXISTS outlines_doc ON outlines (doc_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS outline_fts USING fts5 (text, code);
+'''
+_CJK = '\u2e80-\u2fff\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_CJK_RE = re.compile(f'([{_CJK}])')
+# the spaces _segment() put around CJK characters
+_CJK_GAP_RE = re.compile(f' (?=[{_CJK}])|(?<=[{_CJK}]) ')
+_HEADING_RE = re.compile(r'(#{1,6}) ')
+
+
+def _segment(text):
+    return _CJK_RE.sub(r' \1 ', text) if text else text
+
+
+def _unsegment(text):
+    return _CJK_GAP_RE.sub('', text) if text else text
+
+
+def to_match_query(query):
+    """
+    Turn words into an FTS5 query: every whitespace separated term must appear, each one searched as a phrase.
+    """
+    terms = [_segment(t).strip() for t in query.split()]
+    return ' AND '.join('"' + t.replace('"', '""') + '"' for t in terms if t)
+
+
+class SearchHit(NamedTuple):
+    document: str
+    title: str
+    node_path: str
+    line: int
+    heading: int
+    text: str
+    rank: float
+
+
+class SearchIndex:
+    def __init__(self, path, timeout=30.0):
+        """
+        Several processes may write the same index, each write waits up to timeout seconds for the others.
+        """
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                # switching to WAL does not wait for the busy timeout: workers creating the index together retry
+                if self.db.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+                    self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.executescript(_SCHEMA)
+                break
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or time.monotonic() > deadline:
+                    self.db.close()
+                    raise
+                time.sleep(0.05)
+        self.db.execute('PRAGMA synchronous=NORMAL')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.db.close()
+
+    def is_current(self, document, digest):
+        row = self.db.execute('SELECT digest FROM documents WHERE path = ?', (str(document),)).fetchone()
+        return row is not None and digest is not None and row[0] == digest
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def _replace_document(self, db, document, title, digest):
+        row = db.execute('SELECT id FROM documents WHERE path = ?', (document,)).fetchone()
+        if row is None:
+            return db.execute('INSERT INTO documents (path, title, digest, indexed_at) VALUES (?, ?, ?, ?)',
+                              (document, title, digest, time.time())).lastrowid
+        doc_id = row[0]
+        db.execute('DELETE FROM outline_fts WHERE rowid IN (SELECT id FROM outlines WHERE doc_id = ?)', (doc_id,))
+        db.execute('DELETE FROM outlines WHERE doc_id = ?', (doc_id,))
+        db.execute('UPDATE documents SET title = ?, digest = ?, indexed_at = ? WHERE id = ?',
+                   (title, digest, time.time(), doc_id))
+        return doc_id
+
+    def remove(self, document):
+        with self._transaction() as db:
+            row = db.execute('SELECT id FROM documents WHERE path = ?', (str(document),)).fetchone()
+            if row is None:
+                return False
+            db.execute('DELETE FROM outline_fts WHERE rowid IN (SELECT id FROM outlines WHERE doc_id = ?)', (row[0],))
+            db.execute('DELETE FROM outlines WHERE doc_id = ?', (row[0],))
+            db.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+        return True
+
+    def index_outlines(self, document, head: Head, outlines, digest=None, to_text=None):
+        """
+        Replace the rows of document with the (outline, depth) stream, in document order. to_text(outline) is the
+        markdown of an outline, to count lines like Transformer; without it an outline counts as its text.
+        Skipped (returns False) if document was indexed with the same digest before.
+        """
+        document = str(document)
+        if self.is_current(document, digest):
+            return False
+        rows = OutlineRows(to_text)
+        for outline, depth in outlines:
+            rows.add(outline, depth)
+        self.replace(document, head.title, digest, rows)
+        return True
+
+    def replace(self, document, title, digest, rows: 'OutlineRows'):
+        """
+        Write the rows built for document in one transaction, in place of the ones it had.
+        """
+        with self._transaction() as db:
+            # an IMMEDIATE transaction holds the write lock, ids taken from max(id) stay ours until COMMIT
+            doc_id = self._replace_document(db, str(document), title, digest)
+            next_id = (db.execute('SELECT max(id) FROM outlines').fetchone()[0] or 0) + 1
+            ids = range(next_id, next_id + len(rows.rows))
+            db.executemany('INSERT INTO outlines (id, doc_id, node_path, depth, heading, line, images) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)', ((i, doc_id) + r for i, r in zip(ids, rows.rows)))
+            db.executemany('INSERT INTO outline_fts (rowid, text, code) VALUES (?, ?, ?)',
+                           ((i,) + t for i, t in zip(ids, rows.texts)))
+
+    def index_opml(self, document, opml: OPML, digest=None, to_text=None):
+        return self.index_outlines(document, opml.head,
+                                   tree_walker.preorder(opml.body.outlines or (), tree_walker.sub_outlines),
+                                   digest, to_text)
+
+    def search(self, query, limit=20, raw=False):
+        """
+        Best matches first. query is words that must all appear, or FTS5 query syntax with raw=True (e.g. 'code:lxml').
+        """
+        match = query if raw else to_match_query(query)
+        if not match:
+            return []
+        rows = self.db.execute(
+            'SELECT d.path, d.title, o.node_path, o.line, o.heading, f.text, f.rank '
+            'FROM outline_fts f JOIN outlines o ON o.id = f.rowid JOIN documents d ON d.id = o.doc_id '
+            'WHERE outline_fts MATCH ? ORDER BY f.rank LIMIT ?', (match, limit))
+        return [SearchHit(path, title, node_path, line, heading, _unsegment(text), rank)
+                for path, title, node_path, line, heading, text, rank in rows]
+
+    def stats(self):
+        documents, = self.db.execute('SELECT count(*) FROM documents').fetchone()
+        outlines, = self.db.execute('SELECT count(*) FROM outlines').fetchone()
+        return {'documents': documents, 'outlines': outlines}
+
+
+class OutlineRows:
+    """
+    The rows of one document, built from its (outline, depth) stream in document order without touching the index:
+    node paths and markdown lines follow the stream. SearchIndex.replace() writes them.
+    """
+
+    def __init__(self, to_text=None):
+        self.to_text = to_text
+        self.counters = []
+        self.line = 1
+        self.rows = []
+        self.texts = []
+
+    def add(self, outline, depth):
+        counters = self.counters
+        del counters[depth + 1:]
+        if len(counters) <= depth:
+            counters.append(0)
+        counters[depth] += 1
+        text = outline.text
+        attrs = outline.attrs or {}
+        m = _HEADING_RE.match(text)
+        images = list_attr(attrs.get('mubu_imgs')) + list_attr(attrs.get('mkd_imgs'))
+        codes = list_attr(attrs.get('mkd_codes'))
+        self.rows.append(('.'.join(map(str, counters)), depth, len(m.group(1)) if m else None, self.line,
+                          json.dumps(images, ensure_ascii=False) if images else None))
+        self.texts.append((_segment(text), _segment('\n'.join(codes)) if codes else None))
+        rendered = self.to_text(outline) if self.to_text else text
+        self.line += rendered.count('\n') + 1
+
+
+class IndexSink(Sink):
+    """
+    Index a document in the same traversal that renders it: SearchIndex.index_outlines() as a lib.sinks sink. The rows
+    are collected while the traversal runs and written by end(), the index is only locked for that write (the rows of
+    the document are held in memory until then, streaming or not).
+    """
+
+    def __init__(self, index: SearchIndex, document, digest=None, to_text=None):
+        self.index = index
+        self.document = str(document)
+        self.digest = digest
+        self.to_text = to_text
+        self._title = None
+        self._rows = None
+
+    def start(self, head):
+        if self.index.is_current(self.document, self.digest):
+            return
+        self._title = head.title
+        self._rows = OutlineRows(self.to_text)
+
+    def node(self, outline, depth):
+        if self._rows is not None:
+            self._rows.add(outline, depth)
+
+    def end(self):
+        if self._rows is not None:
+            rows, self._rows = self._rows, None
+            self.index.replace(self.document, self._title, self.digest, rows)
+
+    def close(self):
+        """
+        Drop the rows of a document whose rendering failed half way.
+        """
+        self._rows = None
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Search an index written by mubu2markdown.py --index.')
+    arg_parser.add_argument('index', help='the index database')
+    arg_parser.add_argument('query', nargs='+', help='words that must all appear, FTS5 syntax with --raw')
+    arg_parser.add_argument('-n', '--limit', type=int, default=20)
+    arg_parser.add_argument('--raw', action='store_true', help='pass the query to FTS5 as it is')
+    args = arg_parser.parse_args(argv)
+    with SearchIndex(args.index) as index:
+        begin = time.perf_counter()
+        hits = index.search(' '.join(args.query), args.limit, args.raw)
+        seconds = time.perf_counter() - begin
+    for hit in hits:
+        first_line = hit.text.split('\n', 1)[0]
+        print(f'{hit.document}:{hit.line} [{hit.node_path}] {first_line}')
+    print(f'{len(hits)} hits in {seconds * 1000:.1f}ms', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
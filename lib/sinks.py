@@ -0,0 +1,186 @@
+"""
+Render one outline traversal into several formats at once.
+
+    with open('post.xml', 'w') as xml, open('post.json', 'w') as js:
+        render_opml(opml, [OpmlSink(xml), JsonSink(js)])
+
+A sink consumes the (outline, depth) stream in document order that tree_walker.preorder() and
+MubuPost.iter_outline_events() produce, fan_out() hands every node to all sinks before it moves on, so N formats cost
+one walk of the tree (or one pass over the export) instead of N. Sinks only see depths, never sub_outlines, the nested
+formats find out whether a node has children from the node that follows it.
+The markdown sink lives next to Transformer, in mubu2markdown.MarkdownSink.
+"""
+import json
+
+from lib import tree_walker
+from lib.metrics import Metrics, NULL_METRICS
+from lib.opml_processor import OPML, Head
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+class Sink:
+    def __init__(self, fp):
+        self.write = fp.write
+
+    def start(self, head: Head):
+        pass
+
+    def node(self, outline, depth):
+        pass
+
+    def end(self):
+        pass
+
+
+class NestedSink(Sink):
+    """
+    Base of the formats that wrap children in their parent: holds back one node until the next one tells whether it
+    has children, then calls open() for it and close() for every node whose subtree is complete.
+    """
+
+    def __init__(self, fp):
+        super().__init__(fp)
+        self._pending = None
+        self._open = []
+
+    def start(self, head):
+        self._pending = None
+        self._open = []
+
+    def _flush(self, next_depth):
+        if self._pending is not None:
+            outline, depth = self._pending
+            self._pending = None
+            has_children = next_depth > depth
+            self.open(outline, depth, has_children)
+            if has_children:
+                self._open.append(outline)
+        while len(self._open) > next_depth:
+            outline = self._open.pop()
+            self.close(outline, len(self._open))
+
+    def node(self, outline, depth):
+        self._flush(depth)
+        self._pending = outline, depth
+
+    def end(self):
+        self._flush(0)
+
+    def open(self, outline, depth, has_children):
+        pass
+
+    def close(self, outline, depth):
+        pass
+
+
+class OpmlSink(NestedSink):
+    """
+    The same bytes Generator writes (without the declaration if declaration=False).
+    """
+
+    def __init__(self, fp, declaration=True):
+        super().__init__(fp)
+        self.declaration = declaration
+        self._empty = True
+
+    def start(self, head):
+        super().start(head)
+        self._empty = True
+        if self.declaration:
+            self.write(XML_DECLARATION)
+        self.write('<opml version="2.0">\n')
+        self.write(f'{head._start_tag()}/>{head.XML_TAIL}<body>\n')
+
+    def open(self, outline, depth, has_children):
+        self._empty = False
+        self.write(outline._start_tag() + ('>\n' if has_children else f'/>{outline.XML_TAIL}'))
+
+    def close(self, outline, depth):
+        self.write(f'</outline>{outline.XML_TAIL}')
+
+    def end(self):
+        super().end()
+        if self._empty:
+            raise RuntimeError("No one outline found.")
+        self.write('</body></opml>')
+
+
+class TextSink(Sink):
+    """
+    The outline as indented plain text, `indent` per level, continuation lines of a node indented like its first one.
+    """
+
+    def __init__(self, fp, indent='  '):
+        super().__init__(fp)
+        self.indent = indent
+
+    def start(self, head):
+        self.write(f'{head.title}\n\n')
+
+    def node(self, outline, depth):
+        prefix = self.indent * depth
+        text = outline.text
+        if '\n' in text:
+            text = text.replace('\n', '\n' + prefix)
+        self.write(f'{prefix}{text}\n')
+
+
+class JsonSink(NestedSink):
+    """
+    {"title", "dateCreated", "dateModified", "outlines": [{"text", "attrs", "children"}]}, attrs and children are left
+    out when empty. Written as the tree is walked, the document is never built in memory.
+    """
+
+    def __init__(self, fp):
+        super().__init__(fp)
+        self._comma = False
+
+    def start(self, head):
+        super().start(head)
+        self._comma = False
+        self.write('{"title": ' + json.dumps(head.title, ensure_ascii=False))
+        for key, value in (('dateCreated', head.create_date), ('dateModified', head.modified_date)):
+            if value:
+                self.write(f', "{key}": {json.dumps(value, ensure_ascii=False)}')
+        self.write(', "outlines": [\n')
+
+    def open(self, outline, depth, has_children):
+        node = {'text': outline.text}
+        if outline.attrs:
+            node['attrs'] = outline.attrs
+        # the object stays open for its children
+        text = json.dumps(node, ensure_ascii=False)[:-1]
+        self.write((',\n' if self._comma else '') + text + (', "children": [\n' if has_children else '}'))
+        self._comma = not has_children
+
+    def close(self, outline, depth):
+        self.write(']}')
+        self._comma = True
+
+    def end(self):
+        super().end()
+        self.write('\n]}\n')
+
+
+def fan_out(head: Head, outlines, sinks, metrics: Metrics = None):
+    """
+    Feed head and the (outline, depth) stream to every sink in a single pass.
+    """
+    metrics = metrics or NULL_METRICS
+    nodes = [s.node for s in sinks]
+    count = 0
+    with metrics.stage('sinks.fan_out'):
+        for s in sinks:
+            s.start(head)
+        for outline, depth in outlines:
+            for node in nodes:
+                node(outline, depth)
+            count += 1
+        for s in sinks:
+            s.end()
+    metrics.count('outlines_rendered', count)
+
+
+def render_opml(opml: OPML, sinks, metrics: Metrics = None):
+    fan_out(opml.head, tree_walker.preorder(opml.body.outlines or (), tree_walker.sub_outlines), sinks, metrics)
@@ -0,0 +1,339 @@
+"""
+Compact binary snapshots of OPML models.
+
+    write_snapshot(opml, 'post.snap')
+    with Snapshot('post.snap') as snap:
+        Transformer(snap.opml()).to_markdown()
+
+A snapshot is an outline tree laid out in preorder, so a node is two int32 columns and its text. Opening one
+memory-maps the file and reads nothing but the header: the node columns are used in place and texts and attribute rows
+are decoded when a node is first looked at, so the outlines handed out are lazy OutlineViews. Attribute values keep
+their type, the image and code lists come back as lists and need no re-parsing. to_opml() decodes every text at once.
+
+Layout, little-endian, sections 4-byte aligned:
+
+    header   MAGIC, then uint32 node, string and attribute row counts, and the offsets of the sections
+    nodes    int32[nodes] x 2             end of the subtree (the node after the last descendant), attribute row (-1
+                                          for none); the children of n are n + 1 up to its end, each followed by the
+                                          node at its end, the roots are 0 up to the node count the same way
+    texts    uint32[nodes + 1] offsets, then the utf-8 texts in node order, each followed by a NUL
+    strings  uint32[strings + 1] offsets, then the utf-8 attribute keys and values and head fields, NUL terminated
+    attrs    uint32[rows + 1] word offsets, then the rows: per attribute a key string id (with LIST_BIT set for a
+             list), then a value string id, or a count followed by string ids
+    head     int32[5] string ids of title, dateCreated, dateModified, ownerName, ownerEmail (-1 for none)
+"""
+import mmap
+import struct
+import sys
+from array import array
+
+from lib.opml_processor import LIST_ATTRS, OPML, Head, Body, Outline, list_attr
+from lib.outline_table import OutlineTable, OutlineView, NO_NODE
+
+MAGIC = b'MBSNAP\x00\x02'
+_HEADER = struct.Struct('<8s8I')
+LIST_BIT = 1 << 31
+
+
+def _column(values, typecode='i'):
+    a = array(typecode, values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+
+def _pad(out):
+    out.extend(b'\0' * (-len(out) % 4))
+
+
+def _string_section(out, strings):
+    """
+    Append the offsets and the NUL terminated bytes of strings.
+    """
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s) + 1)
+    out.extend(_column(offsets, 'I'))
+    out.extend(b'\0'.join(strings))
+    if strings:
+        out.extend(b'\0')
+    _pad(out)
+
+
+def _typed(key, value):
+    if isinstance(value, str) and key in LIST_ATTRS and value.startswith('['):
+        try:
+            return list_attr(value)
+        except SyntaxError:
+            return value
+    return value
+
+
+def _preorder(table):
+    """
+    The node indices of table in preorder and, by position in that order, the end of every subtree.
+    """
+    order = []
+    stack = list(reversed(table.root_indices))
+    while stack:
+        index = stack.pop()
+        order.append(index)
+        stack.extend(reversed(table.children_of(index)))
+    position = {index: p for p, index in enumerate(order)}
+    ends = list(range(1, len(order) + 1))
+    for p in range(len(order) - 1, -1, -1):
+        parent = table.parent[order[p]]
+        if parent != NO_NODE:
+            q = position[parent]
+            if ends[p] > ends[q]:
+                ends[q] = ends[p]
+    return order, ends
+
+
+def write_snapshot(opml: OPML, path):
+    """
+    Write the model to path, returns the number of bytes written.
+    """
+    outlines = opml.body.outlines or []
+    if outlines and isinstance(outlines[0], OutlineView) and isinstance(outlines[0].table, OutlineTable):
+        table = outlines[0].table
+    else:
+        table = OutlineTable.from_outlines(outlines)
+    order, ends = _preorder(table)
+    string_ids = {}
+    strings = []
+
+    def sid(s):
+        if s is None:
+            return NO_NODE
+        s = str(s)
+        i = string_ids.get(s)
+        if i is None:
+            i = string_ids[s] = len(strings)
+            strings.append(s.encode('utf-8'))
+        return i
+
+    words = array('I')
+    row_offsets = [0]
+    for row in table.attr_table:
+        for key, value in row:
+            value = _typed(key, value)
+            if isinstance(value, (list, tuple)):
+                words.extend((sid(key) | LIST_BIT, len(value)))
+                words.extend(map(sid, value))
+            else:
+                words.extend((sid(key), sid(value)))
+        row_offsets.append(len(words))
+
+    head = opml.head
+    head_ids = [sid(head.title), sid(head.create_date), sid(head.modified_date), sid(head.owner_name),
+                sid(head.owner_email)]
+
+    out = bytearray(_HEADER.size)
+    nodes_off = len(out)
+    out.extend(_column(ends))
+    out.extend(_column(table.attr_index[i] for i in order))
+    texts_off = len(out)
+    _string_section(out, [table.texts[i].encode('utf-8') for i in order])
+    strings_off = len(out)
+    _string_section(out, strings)
+    attrs_off = len(out)
+    out.extend(_column(row_offsets, 'I'))
+    out.extend(_column(words, 'I'))
+    head_off = len(out)
+    out.extend(_column(head_ids))
+    _HEADER.pack_into(out, 0, MAGIC, len(order), len(strings), len(table.attr_table),
+                      nodes_off, texts_off, strings_off, attrs_off, head_off)
+    with open(path, 'wb') as f:
+        f.write(out)
+    return len(out)
+
+
+def _row_items(words, position, end, string):
+    """
+    The (key, value) pairs of the attribute row in words[position:end], string maps a string id to its string.
+    """
+    items = []
+    while position < end:
+        key = words[position]
+        if key & LIST_BIT:
+            count = words[position + 1]
+            items.append((string(key & ~LIST_BIT), [string(i) for i in words[position + 2:position + 2 + count]]))
+            position += 2 + count
+        else:
+            items.append((string(key), string(words[position + 1])))
+            position += 2
+    return items
+
+
+class _Texts:
+    # table.texts for OutlineView: the text of a node, decoded on first use
+    __slots__ = ('snapshot',)
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, index):
+        return self.snapshot.text(index)
+
+    def __len__(self):
+        return self.snapshot.node_count
+
+
+class Snapshot:
+    """
+    A memory-mapped snapshot, with the table interface OutlineView reads from. Views must not outlive close().
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = None
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise RuntimeError(f'Empty snapshot: {path}')
+        if len(self._mm) < _HEADER.size or self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise RuntimeError(f'Not a snapshot (or another version): {path}')
+        _, nodes, strings, rows, nodes_off, texts_off, strings_off, attrs_off, head_off = \
+            _HEADER.unpack_from(self._mm, 0)
+        self.node_count = nodes
+        self._view = memoryview(self._mm)
+        self.subtree_end = self._column(nodes_off, nodes)
+        self.attr_index = self._column(nodes_off + 4 * nodes, nodes)
+        self._text_offsets = self._column(texts_off, nodes + 1, 'I')
+        self._texts_blob = texts_off + 4 * (nodes + 1)
+        self._string_offsets = self._column(strings_off, strings + 1, 'I')
+        self._strings_blob = strings_off + 4 * (strings + 1)
+        self._row_offsets = self._column(attrs_off, rows + 1, 'I')
+        self._rows = self._column(attrs_off + 4 * (rows + 1), self._row_offsets[rows], 'I')
+        self._head_ids = self._column(head_off, 5)
+        self._strings = {}
+        self._decoded_rows = {}
+        self.texts = _Texts(self)
+
+    def _column(self, offset, count, typecode='i'):
+        raw = self._view[offset:offset + 4 * count]
+        if sys.byteorder == 'little':
+            return raw.cast(typecode)
+        a = array(typecode, raw.tobytes())
+        a.byteswap()
+        return a
+
+    def __len__(self):
+        return self.node_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        for name in ('subtree_end', 'attr_index', '_text_offsets', '_string_offsets', '_row_offsets', '_rows',
+                     '_head_ids'):
+            column = getattr(self, name, None)
+            if isinstance(column, memoryview):
+                column.release()
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+            self._view = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def _decode(self, blob, offsets, index):
+        # the offsets include the NUL after every string
+        return str(self._mm[blob + offsets[index]:blob + offsets[index + 1] - 1], 'utf-8')
+
+    def _decode_all(self, blob, offsets, count):
+        decoded = str(self._mm[blob:blob + offsets[count]], 'utf-8').split('\0')
+        if len(decoded) != count + 1:
+            # a string holding a NUL of its own
+            decoded = [self._decode(blob, offsets, i) for i in range(count)]
+        return decoded
+
+    def text(self, index):
+        return self._decode(self._texts_blob, self._text_offsets, index)
+
+    def string(self, string_id):
+        if string_id == NO_NODE:
+            return None
+        s = self._strings.get(string_id)
+        if s is None:
+            s = self._strings[string_id] = self._decode(self._strings_blob, self._string_offsets, string_id)
+        return s
+
+    def _decode_row(self, row):
+        return tuple(_row_items(self._rows, self._row_offsets[row], self._row_offsets[row + 1], self.string))
+
+    def attrs_of(self, index):
+        row = self.attr_index[index]
+        if row == NO_NODE:
+            return None
+        decoded = self._decoded_rows.get(row)
+        if decoded is None:
+            decoded = self._decoded_rows[row] = self._decode_row(row)
+        # lists are copied, callers may edit them
+        return {k: list(v) if isinstance(v, list) else v for k, v in decoded}
+
+    def has_children(self, index):
+        return self.subtree_end[index] > index + 1
+
+    def children_of(self, index):
+        ret = []
+        c, end = index + 1, self.subtree_end[index]
+        while c < end:
+            ret.append(c)
+            c = self.subtree_end[c]
+        return ret
+
+    @property
+    def root_indices(self):
+        ret = []
+        c = 0
+        while c < self.node_count:
+            ret.append(c)
+            c = self.subtree_end[c]
+        return ret
+
+    def roots(self):
+        return [OutlineView(self, i) for i in self.root_indices]
+
+    def head(self):
+        return Head(*(self.string(i) for i in self._head_ids))
+
+    def opml(self):
+        """
+        The model as lazy views over the mapped file.
+        """
+        return OPML(self.head(), Body(self.roots()))
+
+    def to_opml(self):
+        """
+        The model as plain, editable Outline objects that do not depend on the file any more.
+        """
+        count = self.node_count
+        texts = self._decode_all(self._texts_blob, self._text_offsets, count)
+        string = self._decode_all(self._strings_blob, self._string_offsets, len(self._string_offsets) - 1).__getitem__
+        words, row_offsets = self._rows.tolist(), self._row_offsets.tolist()
+        ends = self.subtree_end.tolist()
+        rows = self.attr_index.tolist()
+        built = [None] * count
+        for index in range(count - 1, -1, -1):
+            children = None
+            c, end = index + 1, ends[index]
+            if c < end:
+                children = []
+                while c < end:
+                    children.append(built[c])
+                    c = ends[c]
+            attrs = None
+            row = rows[index]
+            if row != NO_NODE:
+                attrs = dict(_row_items(words, row_offsets[row], row_offsets[row + 1], string))
+            built[index] = Outline(texts[index], children, attrs)
+        return OPML(self.head(), Body([built[i] for i in self.root_indices]))
@@ -0,0 +1,71 @@
+"""
+Depth-first traversal with an explicit stack, shared by extraction, validation, rendering and serialization.
+
+Nothing in here recurses, so the depth of a tree is only bounded by memory. Trees are described by a
+children_of(node) callable returning an iterable (or None) of the node's children; it is called right after the node
+was entered, so a visitor may build the children of a node while handling it.
+"""
+import operator
+
+START = 'start'
+END = 'end'
+
+_DONE = object()
+
+# children_of for Outline trees
+sub_outlines = operator.attrgetter('sub_outlines')
+
+
+def preorder(roots, children_of):
+    """
+    Yield (node, depth) in pre-order, roots have depth 0.
+    """
+    stack = [iter(roots)]
+    while stack:
+        node = next(stack[-1], _DONE)
+        if node is _DONE:
+            stack.pop()
+            continue
+        yield node, len(stack) - 1
+        children = children_of(node)
+        if children:
+            stack.append(iter(children))
+
+
+def iterwalk(roots, children_of):
+    """
+    Yield (START, node) before and (END, node) after the children of every node, like etree.iterwalk.
+    """
+    stack = [iter(roots)]
+    path = []
+    while stack:
+        node = next(stack[-1], _DONE)
+        if node is _DONE:
+            stack.pop()
+            if path:
+                yield END, path.pop()
+            continue
+        yield START, node
+        path.append(node)
+        stack.append(iter(children_of(node) or ()))
+
+
+def walk(roots, children_of, enter=None, leave=None):
+    """
+    Callback flavour of iterwalk: enter(node, depth) in pre-order, leave(node, depth) in post-order.
+    """
+    stack = [iter(roots)]
+    path = []
+    while stack:
+        node = next(stack[-1], _DONE)
+        if node is _DONE:
+            stack.pop()
+            if path:
+                node = path.pop()
+                if leave is not None:
+                    leave(node, len(path))
+            continue
+        if enter is not None:
+            enter(node, len(path))
+        path.append(node)
+        stack.append(iter(children_of(node) or ()))
@@ -0,0 +1,185 @@
+"""
+Report the files of some directories that were added or rewritten.
+
+    with Watcher(['exports'], accept=lambda p: p.suffix == '.html') as watcher:
+        while True:
+            for path in watcher.next_batch():
+                ...
+
+On Linux the directories are watched with inotify (through ctypes, nothing to install): every event names its file,
+nothing is rescanned. Elsewhere, or when inotify is not available, they are polled: one scandir per poll_interval,
+comparing mtime and size. Either way a file is only reported once it has been quiet for `debounce` seconds, so an
+export that is still being written, or copied in many writes, comes out once, complete.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct('iIII')
+
+
+class _Inotify:
+    def __init__(self, dirs):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        try:
+            for d in dirs:
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+                if wd < 0:
+                    e = ctypes.get_errno()
+                    raise OSError(e, f'inotify_add_watch {d}: {os.strerror(e)}')
+                self.dirs[wd] = Path(d)
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def read(self, timeout):
+        """
+        Paths touched within timeout seconds (None: wait for one), None if events were lost and a rescan is due.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name and not mask & IN_ISDIR and wd in self.dirs:
+                paths.append(self.dirs[wd] / os.fsdecode(name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller:
+    def __init__(self, dirs, interval):
+        self.dirs = [Path(d) for d in dirs]
+        self.interval = interval
+        self.next_scan = time.monotonic() + interval
+        self.seen = self._scan()
+
+    def _scan(self):
+        seen = {}
+        for d in self.dirs:
+            try:
+                with os.scandir(d) as entries:
+                    for e in entries:
+                        if e.is_file():
+                            st = e.stat()
+                            seen[Path(e.path)] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                continue
+        return seen
+
+    def read(self, timeout):
+        wait = self.next_scan - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(wait, 0))
+        self.next_scan = time.monotonic() + self.interval
+        previous, self.seen = self.seen, self._scan()
+        # a scan lists files in directory order, report them in the order they were written like inotify does
+        return sorted((p for p, state in self.seen.items() if previous.get(p) != state), key=lambda p: self.seen[p])
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    def __init__(self, dirs, accept=None, debounce=1.0, poll_interval=2.0, use_inotify=None):
+        """
+        accept(path) filters the files to report. use_inotify: None to use it if the platform has it, False to poll.
+        """
+        self.dirs = [Path(d) for d in dirs]
+        self.accept = accept or (lambda p: True)
+        self.debounce = debounce
+        self.source = None
+        if use_inotify is not False:
+            try:
+                self.source = _Inotify(self.dirs)
+            except (OSError, AttributeError, TypeError):
+                if use_inotify:
+                    raise
+        if self.source is None:
+            self.source = _Poller(self.dirs, poll_interval)
+        # path -> time of its last event
+        self.pending = {}
+
+    @property
+    def polling(self):
+        return isinstance(self.source, _Poller)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.source.close()
+
+    def _rescan(self):
+        # inotify dropped events, the only time the directories are listed
+        now = time.monotonic()
+        for d in self.dirs:
+            for p in d.iterdir():
+                if p.is_file() and self.accept(p):
+                    self.pending[p] = now
+
+    def next_batch(self, timeout=None):
+        """
+        Wait up to timeout seconds (None: until there is one) and return the accepted files that were quiet for
+        debounce seconds, in the order they changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            wait = None
+            if self.pending:
+                wait = max(min(self.pending.values()) + self.debounce - now, 0)
+            if deadline is not None:
+                left = max(deadline - now, 0)
+                wait = left if wait is None else min(wait, left)
+            paths = self.source.read(wait)
+            now = time.monotonic()
+            if paths is None:
+                self._rescan()
+            else:
+                for p in paths:
+                    if self.accept(p):
+                        # re-insert, the dict stays ordered by last event
+                        self.pending.pop(p, None)
+                        self.pending[p] = now
+            settled = [p for p, t in self.pending.items() if now - t >= self.debounce]
+            for p in settled:
+                del self.pending[p]
+            settled = [p for p in settled if p.is_file()]
+            if settled or (deadline is not None and now >= deadline):
+                return settled
@@ -1,14 +1,37 @@
 """
 http://xpather.com/
 """
+import argparse
+import contextlib
 import datetime
+import glob
+import hashlib
+import io
+import itertools
+import mmap
 import os
+import pickle
 import re
+import stat
+import sys
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from pathlib import Path
 
 from lxml import etree
 
-from lib.opml_processor import OPML, Head, Body, Outline
+from lib import tree_walker
+from lib.archives import ZipWriter, archive_stem, close_zip, is_archive, is_zip, iter_tar_members, \
+    member_output_name, open_zip_member, zip_members
+from lib.assets import AssetStore, ImageLocalizer
+from lib.conversion_cache import ConversionCache, DEFAULT_MAX_BYTES
+from lib.merkle import Manifest, SubtreeHashes, options_digest, plan_incremental, render_incremental
+from lib.metrics import Metrics, NULL_METRICS
+from lib.opml_processor import OPML, Head, Body, Outline, list_attr
+from lib.search_index import IndexSink, SearchIndex
+from lib.sinks import Sink, OpmlSink, TextSink, JsonSink, fan_out, render_opml
+from lib.watcher import Watcher
 
 """
 Roadmap:
@@ -18,22 +41,14 @@ Roadmap:
 
 
 class Transformer:
-    def __init__(self, source: OPML):
+    # ad for self
+    FOOTER = ('\n', '> Generated by (Mubu2Markdown)[https://github.com/lkv1988/mubu2markdown]')
+
+    def __init__(self, source: OPML, metrics: Metrics = None):
         self.source = source
+        self.metrics = metrics or NULL_METRICS
 
-    @staticmethod
-    def _split_py_array_str_to_array(arr_str):
-        if type(arr_str) is list:
-            return arr_str
-        array_str_re = re.compile(r'\[(.*)\]')
-        array_item_re = re.compile(r"\'(.*?)\'")
-        found = array_str_re.findall(arr_str)
-        if not found or len(found) > 1:
-            raise SyntaxError('in this usage, the input string should be a array __str__ output, or I should make '
-                              'this method more robust')
-        return array_item_re.findall(found[0])
-
-    def _traversal_outline(self, outline, content_holder):
+    def _outline_to_text(self, outline):
         if not outline:
             raise RuntimeError("UNLIKELY, nullable outline, -293")
         simple_text = outline.text
@@ -55,66 +70,393 @@ class Transformer:
             if 'mkd_codes' in keys:
                 mkd_multiline_codes = nullable_markdown_attrs['mkd_codes']
         if mubu_images:
-            mubu_images = self._split_py_array_str_to_array(mubu_images)
+            mubu_images = list_attr(mubu_images)
             if mubu_images:
                 for mui in mubu_images:
                     simple_text += f'![]({mui})'
         if mkd_images:
-            mkd_images = self._split_py_array_str_to_array(mkd_images)
+            mkd_images = list_attr(mkd_images)
             if mkd_images:
                 for mi in mkd_images:
                     simple_text += f'\n{mi}'
         if mkd_multiline_codes:
-            mkd_multiline_codes = self._split_py_array_str_to_array(mkd_multiline_codes)
+            mkd_multiline_codes = list_attr(mkd_multiline_codes)
             if mkd_multiline_codes:
                 # TODO make multiline codes show better, now need to be adjusted by manual
                 for code in mkd_multiline_codes:
                     simple_text += f'\n{code}'
         if simple_text.startswith('> '):
             simple_text += '\n'
-        content_holder.append(simple_text)
-        if outline.sub_outlines and len(outline.sub_outlines) > 0:
-            for o in outline.sub_outlines:
-                self._traversal_outline(o, content_holder)
+        return simple_text
+
+    def iter_markdown(self):
+        """
+        Yield the markdown outline by outline while the tree is walked, nothing but the current outline is buffered.
+        """
+        assert self.source.head and self.source.body
+        return self.render_outlines(tree_walker.preorder(self.source.body.outlines, tree_walker.sub_outlines))
+
+    def render_outlines(self, outlines):
+        """
+        Markdown sink for a stream of (outline, depth) in document order, e.g. MubuPost.iter_outline_events().
+        """
+        if self.metrics.enabled:
+            yield from self._iter_markdown_measured(outlines)
+        else:
+            for o, _ in outlines:
+                yield f'{self._outline_to_text(o)}\n'
+        yield from self.FOOTER
+
+    def _iter_markdown_measured(self, outlines):
+        count = 0
+        rendering = 0.0
+        perf_counter = time.perf_counter
+        for o, _ in outlines:
+            begin = perf_counter()
+            text = self._outline_to_text(o)
+            rendering += perf_counter() - begin
+            count += 1
+            yield f'{text}\n'
+        self.metrics.add_time('Transformer.traversal_outline', rendering)
+        self.metrics.count('outlines_rendered', count)
+
+    def write_markdown(self, fp, chunks=None):
+        """
+        Write the markdown (or the given chunks) to any text stream: an open file, sys.stdout, a pipe, io.StringIO...
+        """
+        write = fp.write
+        if chunks is None:
+            chunks = self.iter_markdown()
+        if not self.metrics.enabled:
+            for chunk in chunks:
+                write(chunk)
+            return
+        written = 0
+        with self.metrics.stage('Transformer.write_markdown'):
+            for chunk in chunks:
+                write(chunk)
+                written += len(chunk.encode('utf-8'))
+        self.metrics.count('bytes_written', written)
+
+    def to_markdown_string(self):
+        return ''.join(self.iter_markdown())
 
     def to_markdown(self, custom_file_name=None):
         assert self.source.head and self.source.body
         file_name = f'{self.source.head.title}.md'
         if custom_file_name:
             file_name = custom_file_name
-        lines = []
-        for o in self.source.body.outlines:
-            self._traversal_outline(o, lines)
-
         with open(file_name, 'w', encoding='utf-8') as f:
-            for l in lines:
-                f.write(f'{l}\n')
-            # ad for self
-            f.write('\n')
-            f.write('> Generated by (Mubu2Markdown)[https://github.com/lkv1988/mubu2markdown]')
+            self.write_markdown(f)
+
+    def to_markdown_parts(self, index_name=None, level=None, max_bytes=None):
+        """
+        to_markdown() split by SplitMarkdownSink: the parts go to <index name without .md>/ (<index name>.parts/ if it
+        has no suffix), the index file links them. Returns the paths of the parts.
+        """
+        assert self.source.head and self.source.body
+        index = Path(index_name or f'{self.source.head.title}.md')
+        parts_dir = index.with_suffix('')
+        if parts_dir == index:
+            parts_dir = index.with_name(f'{index.name}.parts')
+        with _replaced_on_success(index) as f:
+            sink = SplitMarkdownSink(f, parts_dir, level, max_bytes, prefix=f'{index.stem}-',
+                                     link_base=index.parent, metrics=self.metrics)
+            try:
+                render_opml(self.source, [sink], self.metrics)
+            except BaseException:
+                sink.discard()
+                raise
+            sink.commit()
+        return sink.parts
+
+    def to_markdown_incremental(self, file_name, manifest_path=None, before_render=None, options=None):
+        """
+        to_markdown() that keeps a lib.merkle.Manifest at manifest_path (default: .<file name>.merkle next to the file)
+        and, if the file still is the one the manifest was written for, copies the markdown of every unchanged subtree
+        out of it instead of rendering it again. before_render(outlines) is called with the outlines that do get
+        rendered, before they are (e.g. to localize their images only). options (a dict) is whatever else changes the
+        markdown of an outline, like where before_render stores images: after a run with other options nothing is
+        reused. Returns (outlines rendered, outlines reused).
+        """
+        assert self.source.head and self.source.body
+        path = Path(file_name)
+        manifest_path = manifest_path or path.with_name(f'.{path.name}.merkle')
+        footer = ''.join(self.FOOTER).encode('utf-8')
+        fingerprint = options_digest(options)
+        previous, previous_body = Manifest.load(manifest_path), None
+        if previous is not None and previous.options != fingerprint:
+            previous = None
+        if previous is not None:
+            try:
+                previous_body = path.read_bytes()
+            except FileNotFoundError:
+                previous = None
+            else:
+                previous_body = previous_body[:-len(footer)] if previous_body.endswith(footer) else None
+                if previous_body is None or not previous.matches(previous_body):
+                    previous, previous_body = None, None
+        with self.metrics.stage('Transformer.subtree_hashes'):
+            hashes = SubtreeHashes(self.source.body.outlines or ())
+        plan = plan_incremental(hashes, previous)
+        if before_render is not None:
+            before_render([hashes.nodes[i] for i, k in plan if k is None])
+        with self.metrics.stage('Transformer.render_incremental'):
+            body, manifest, reused = render_incremental(hashes, lambda o: f'{self._outline_to_text(o)}\n', previous,
+                                                        previous_body, plan, fingerprint)
+        with open(path, 'wb') as f:
+            f.write(body)
+            f.write(footer)
+        manifest.save(manifest_path)
+        if self.metrics.enabled:
+            self.metrics.count('outlines_rendered', len(hashes) - reused)
+            self.metrics.count('outlines_reused', reused)
+        return len(hashes) - reused, reused
+
+
+class MarkdownSink(Sink):
+    """
+    Transformer's markdown as a lib.sinks sink, to render it in the same pass as other formats.
+    """
+
+    def __init__(self, fp, metrics: Metrics = None):
+        super().__init__(fp)
+        self._to_text = Transformer(None, metrics=metrics)._outline_to_text
+
+    def node(self, outline, depth):
+        self.write(f'{self._to_text(outline)}\n')
+
+    def end(self):
+        for chunk in Transformer.FOOTER:
+            self.write(chunk)
+
+
+class SplitMarkdownSink(Sink):
+    """
+    Transformer's markdown cut into parts: a part ends before every heading of `level` or higher (# is 1) and before
+    it would grow over max_bytes (a single outline is never cut). Parts are written next to parts_dir/<prefix>NNN.md
+    while they are rendered and moved there by commit() (or removed by discard()), the index (fp) gets the title, a
+    link per part and the footer. Nothing is held in memory but the outline being written.
+    """
+    HEADING_RE = re.compile(r'(#{1,6}) ')
+
+    def __init__(self, fp, parts_dir, level=None, max_bytes=None, prefix='', link_base=None, metrics: Metrics = None):
+        assert level or max_bytes
+        super().__init__(fp)
+        self._to_text = Transformer(None, metrics=metrics)._outline_to_text
+        self.parts_dir = Path(parts_dir)
+        self.level = level
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.link_base = link_base
+        self.parts = []
+        self._part = None
+        self._size = 0
+
+    def _title_of(self, text):
+        m = self.HEADING_RE.match(text)
+        if not m:
+            return None, None
+        return len(m.group(1)), text[m.end():].split('\n', 1)[0].strip()
+
+    def _next_part(self, title):
+        self.close()
+        path = self.parts_dir / f'{self.prefix}{len(self.parts) + 1:03d}.md'
+        self.parts.append(path)
+        self._part = open(_temporary_path(path), 'w', encoding='utf-8')
+        self._size = 0
+        link = os.path.relpath(path, self.link_base) if self.link_base else path.name
+        title = (title or f'Part {len(self.parts)}').replace('[', '\\[').replace(']', '\\]')
+        self.write(f'- [{title}]({urllib.parse.quote(Path(link).as_posix())})\n')
+
+    def start(self, head):
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        self.write(f'# {head.title}\n\n')
+
+    def node(self, outline, depth):
+        text = f'{self._to_text(outline)}\n'
+        size = len(text.encode('utf-8'))
+        level, title = self._title_of(outline.text)
+        if self._part is None \
+                or (self.level and level and level <= self.level and self._size) \
+                or (self.max_bytes and self._size and self._size + size > self.max_bytes):
+            self._next_part(title)
+        self._part.write(text)
+        self._size += size
+
+    def end(self):
+        self.close()
+        for chunk in Transformer.FOOTER:
+            self.write(chunk)
+
+    def close(self):
+        if self._part is not None:
+            self._part.close()
+            self._part = None
+
+    def commit(self):
+        """
+        Move the parts to their names, once the whole document went through.
+        """
+        self.close()
+        for path in self.parts:
+            os.replace(_temporary_path(path), path)
+
+    def discard(self):
+        """
+        Remove the parts written so far, after a failed rendering.
+        """
+        self.close()
+        for path in self.parts:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(_temporary_path(path))
+
+
+def _temporary_path(path):
+    # where an output is written before it replaces path: next to it, so that os.replace() is a rename
+    path = Path(path)
+    return path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+
+@contextlib.contextmanager
+def _replaced_on_success(path):
+    """
+    Text file to write path through: a temporary file that is moved over path if the block succeeds and removed if
+    it raises, so a failed conversion leaves neither a partial output nor an emptied old one behind.
+    """
+    tmp = _temporary_path(path)
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            yield f
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+# output formats of the command line, the sink rendering each and the suffix of its file
+SINKS = {
+    'markdown': (MarkdownSink, '.md'),
+    'opml': (OpmlSink, '.xml'),
+    'text': (TextSink, '.txt'),
+    'json': (JsonSink, '.json'),
+}
 
 
 class MubuPost:
     DATE_FORMAT = '%Y%m%d'
+    HEADING_RE = re.compile(r'heading(\d)')
+    NOTE_IMG_TOKEN_RE = re.compile(r'.*\!\[.*\]\(')
+    NOTE_CODE_TOKEN_RE = re.compile(r'```.+```', re.DOTALL)
+    # (tag, class) of the li.node children we read
+    NODE_PARTS = {
+        ('div', 'content mm-editor'): 'content',
+        ('ul', 'image-list'): 'images',
+        ('div', 'note mm-editor'): 'note',
+        ('div', 'children'): 'children',
+    }
+
+    # class of a content span -> (order, wrapper). The wrappers of all the classes of a span nest by order, lowest
+    # innermost: 'bold italic' is ***text***, 'bold codespan' **`text`**. A wrapper is a (prefix, suffix) pair or a
+    # function of the text, see register_span_handler(); classes without one (colors...) leave the text as it is.
+    SPAN_HANDLERS = {
+        'codespan': (0, ('`', '`')),
+        'strikethrough': (10, ('~~', '~~')),
+        'italic': (20, ('*', '*')),
+        'bold': (30, ('**', '**')),
+    }
+    # class attribute -> its composed wrapper, filled by _span_format() as classes are met
+    _span_formats = {}
 
-    def __init__(self, output_html_path, use_mubu_img: bool = False):
-        assert output_html_path
-        p = Path(output_html_path)
-        if not p.exists() or not p.is_file():
-            raise RuntimeError('Input file is not exist or not a file, please check it. -22')
+    # parse_to_opml/to_markdown with jobs split the top level subtrees into this many groups per worker
+    SUBTREE_GROUPS_PER_JOB = 4
+    # ... but only with this many processes (jobs capped to the CPUs) and for an export of this size or more, else
+    # they stay serial: the workers re-parse their subtrees, 1.6x the serial extraction, and the parent still parses
+    # the whole DOM and serializes the subtrees, so 2 processes are slower than 1 and 3 only win past ~1.7MB
+    SUBTREE_MIN_JOBS = 3
+    SUBTREE_MIN_BYTES = 2 << 20
+    # memoryview/bytearray/mmap sources are handed to lxml in slices of this size
+    FEED_CHUNK_SIZE = 1 << 20
+    # streaming reads its source in chunks of this size, the events of a chunk are all in memory at once
+    STREAM_CHUNK_SIZE = 1 << 16
+
+    def __init__(self, output_html_path, use_mubu_img: bool = False, metrics: Metrics = None,
+                 created_time=None, modified_time=None):
+        """
+        output_html_path is the exported html as a path, bytes/bytearray/memoryview/mmap or a binary stream.
+        Nothing is parsed until the DOM is needed by parse_to_opml() or to_markdown().
+        created_time and modified_time (epoch seconds) replace the file dates, which non-path sources do not have.
+        """
+        assert output_html_path is not None
         self.use_mubu_img = use_mubu_img
-        with open(output_html_path, 'r', encoding='utf-8') as source_file:
-            dom_bytes = bytes(source_file.read(), encoding='utf-8')
-        self.dom = etree.HTML(dom_bytes)
-        created_time = os.stat(output_html_path)[-1]
-        if created_time > 0:
+        self.metrics = metrics or NULL_METRICS
+        self.source = output_html_path
+        # None for a stream that is not a regular file
+        self.source_size = None
+        self._dom = None
+        self.title = None
+        self.created_time = None
+        self.modified_time = None
+        st = None
+        if isinstance(output_html_path, (str, os.PathLike)):
+            assert output_html_path
+            try:
+                st = os.stat(output_html_path)
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                raise RuntimeError('Input file is not exist or not a file, please check it. -22')
+            self.source_size = st.st_size
+            self.metrics.count('bytes_read', st.st_size)
+        elif isinstance(output_html_path, (bytes, bytearray, memoryview, mmap.mmap)):
+            assert len(output_html_path) > 0
+            self.source_size = len(output_html_path)
+            self.metrics.count('bytes_read', len(output_html_path))
+        elif hasattr(output_html_path, 'read'):
+            try:
+                st = os.fstat(output_html_path.fileno())
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                st = None
+            if st is not None and stat.S_ISREG(st.st_mode):
+                self.source_size = st.st_size
+        else:
+            raise RuntimeError(f'Unsupported input {type(output_html_path).__name__}, expect a path, bytes or a binary '
+                               f'stream. -22')
+        if created_time is None and st is not None:
+            created_time = st.st_ctime
+        if modified_time is None and st is not None:
+            modified_time = st.st_mtime
+        if created_time and created_time > 0:
             dt = datetime.datetime.fromtimestamp(created_time)
             self.created_time = dt.strftime(self.DATE_FORMAT)
-        modified_time = os.stat(output_html_path)[-2]
-        if modified_time > 0:
+        if modified_time and modified_time > 0:
             dt = datetime.datetime.fromtimestamp(modified_time)
             self.modified_time = dt.strftime(self.DATE_FORMAT)
 
+    def _parse_dom(self):
+        # huge_tree: libxml2 otherwise gives up on deeply nested outlines
+        parser = etree.HTMLParser(huge_tree=True)
+        source = self.source
+        if isinstance(source, bytes):
+            return etree.HTML(source, parser=parser)
+        if isinstance(source, (bytearray, memoryview, mmap.mmap)):
+            view = memoryview(source).cast('B')
+            for i in range(0, len(view), self.FEED_CHUNK_SIZE):
+                parser.feed(bytes(view[i:i + self.FEED_CHUNK_SIZE]))
+            return parser.close()
+        # libxml2 reads paths and streams itself, no python side copy of the document
+        if isinstance(source, os.PathLike):
+            source = os.fspath(source)
+        return etree.parse(source, parser=parser).getroot()
+
+    @property
+    def dom(self):
+        if self._dom is None:
+            with self.metrics.stage('MubuPost.etree_html'):
+                self._dom = self._parse_dom()
+        return self._dom
+
     @staticmethod
     def _get_element_attributes(element):
         # like a dict structure
@@ -141,139 +483,231 @@ class MubuPost:
         else:
             return self.created_time
 
-    def _is_code_span(self, element):
-        attrs = self._get_element_attributes(element)
-        if 'class' in attrs and attrs['class'] == 'codespan':
-            return True
-        return False
+    @classmethod
+    def register_span_handler(cls, class_name, wrapper, order=None):
+        """
+        Render content spans with class class_name through wrapper: a (prefix, suffix) pair or a function taking the
+        text (already wrapped by the handlers of lower order) and returning its markdown. order defaults to outermost.
+        Registered on cls only, subclasses keep their own table. The jobs workers of parse_to_opml()/to_markdown() get
+        the table sent over when it pickles (pairs, module level functions), otherwise only forked workers have it.
+        """
+        if order is None:
+            order = max((o for o, _ in cls.SPAN_HANDLERS.values()), default=0) + 10
+        if not callable(wrapper):
+            prefix, suffix = wrapper
+            wrapper = (prefix, suffix)
+        cls.SPAN_HANDLERS = {**cls.SPAN_HANDLERS, class_name: (order, wrapper)}
+        cls._span_formats = {}
 
-    @staticmethod
-    def _append_content_with_class(text, class_name):
-        if not class_name:
-            return text
-        if class_name == 'codespan':
-            return f'`{text}`'
-        elif class_name == 'bold':
-            return f'**{text}**'
-        elif class_name == 'italic':
-            return f'*{text}*'
-        elif class_name == 'strikethrough':
-            return f'~~{text}~~'
-        elif 'italic' in class_name and 'bold' in class_name:
-            return f'***{text}***'
+    @classmethod
+    def _span_format(cls, class_name):
+        """
+        The wrapper of a class attribute, composed once per distinct attribute: a (prefix, suffix) pair when every
+        class has one, else a function of the text.
+        """
+        fmt = cls._span_formats.get(class_name)
+        if fmt is not None:
+            return fmt
+        handlers = cls.SPAN_HANDLERS
+        wrappers = [w for _, w in sorted((handlers[c] for c in set(class_name.split()) if c in handlers),
+                                         key=lambda h: h[0])]
+        if not any(callable(w) for w in wrappers):
+            fmt = (''.join(w[0] for w in reversed(wrappers)), ''.join(w[1] for w in wrappers))
         else:
-            return text
+            def fmt(text):
+                for w in wrappers:
+                    text = w(text) if callable(w) else f'{w[0]}{text}{w[1]}'
+                return text
+        cls._span_formats[class_name] = fmt
+        return fmt
 
-    def _elements_to_outlines(self, element_children):
-        ret = []
-        for e in element_children:
-            class_name = self._get_element_attributes(e)['class']
-            is_normal_node = 'node' in class_name.split(' ')
-            assert is_normal_node
-            heading_r = re.compile(r'heading(\d)')
-            h_n = heading_r.findall(class_name)
-            content_editor = e.xpath('div[@class="content mm-editor"]')[0]
-            content = ''
-            if content_editor is not None and len(content_editor) > 0:
-                skip_first_one = True
-                iterated_elts = set()
-                for sub in content_editor.iter():
-                    if skip_first_one:
-                        skip_first_one = False
-                        continue
-                    if sub in iterated_elts:
-                        continue
-                    iterated_elts.add(sub)
-                    class_name = sub.attrib['class'] if 'class' in sub.attrib else None
-                    text = sub.text
-                    if class_name is not None and class_name == 'content-link':
-                        link_text = sub.xpath('*[contains(@class, "content-link-text")]')[0]
-                        iterated_elts.add(link_text)
-                        # print(f'Link text: {link_text.text}')
-                        link_mkd = f'[{link_text.text}]({sub.attrib["href"]})'
-                        content += link_mkd
-                    elif text is not None:
-                        content += self._append_content_with_class(text, class_name)
+    @staticmethod
+    def _element_children(element):
+        # same as xpath('*'): skip comments and processing instructions
+        return [c for c in element if isinstance(c.tag, str)]
+
+    def _find_link_text(self, link):
+        # same as xpath('*[contains(@class, "content-link-text")]')[0]
+        for c in link:
+            if isinstance(c.tag, str) and 'content-link-text' in (c.get('class') or ''):
+                return c
+        raise SyntaxError(f'content-link without link text at line:{self._get_element_source_line(link)}, -105')
+
+    @staticmethod
+    def _first_img_src(image_item):
+        # same as xpath('img[@src]')[0].attrib['src']
+        for c in image_item:
+            if c.tag == 'img':
+                src = c.get('src')
+                if src is not None:
+                    return src
+        raise SyntaxError('image-item without img src, -125')
+
+    def _content_editor_to_text(self, content_editor):
+        if len(content_editor) == 0:
+            return ''
+        parts = []
+        formats = self._span_formats
+        skipped = None
+        for sub in content_editor.iterdescendants():
+            if skipped is not None and sub in skipped:
+                continue
+            class_name = sub.get('class')
+            text = sub.text
+            if class_name is not None and class_name == 'content-link':
+                link_text = self._find_link_text(sub)
+                if skipped is None:
+                    skipped = set()
+                skipped.add(link_text)
+                parts.append(f'[{link_text.text}]({sub.attrib["href"]})')
+            elif text is None:
+                raise RuntimeError("text is None, -112")
+            elif class_name is None:
+                parts.append(text)
+            else:
+                fmt = formats.get(class_name) or self._span_format(class_name)
+                if type(fmt) is tuple:
+                    parts += (fmt[0], text, fmt[1])
+                else:
+                    parts.append(fmt(text))
+        return ''.join(parts)
+
+    def _image_list_to_urls(self, image_list):
+        img_arr = []
+        for img_li in image_list:
+            if img_li.tag == 'li' and img_li.get('class') == 'image-item':
+                img_arr.append(self._first_img_src(img_li))
+        return img_arr
+
+    def _parse_note(self, note, outline_attrs):
+        parts = ['\n']
+        mkd_images = []
+        mkd_codes = []
+        maybe_img_or_code = self._element_children(note)
+        if maybe_img_or_code and len(maybe_img_or_code) > 0:
+            index_in_elements = 0
+            while len(maybe_img_or_code) > index_in_elements:
+                element = maybe_img_or_code[index_in_elements]
+                element_tag = self._get_element_tag(element)
+                element_text = self._get_element_text(element)
+                if element_text:
+                    if element_text.startswith('\n'):
+                        element_text = element_text[1:].strip()
+                    elif len(element_text) > 1 and element_text.strip()[1] == '\n':
+                        # I cant explain this, but it works, this \n is U+200B, encode error
+                        element_text = element_text[2:].strip()
+                if element_tag == 'span':
+                    if self.NOTE_IMG_TOKEN_RE.search(element_text):
+                        # it's a image
+                        img_url = element_text + \
+                                  maybe_img_or_code[index_in_elements + 1].attrib['href'].rstrip('\n')
+                        mkd_images.append(img_url)
+                        index_in_elements += 2
+                    elif self.NOTE_CODE_TOKEN_RE.search(element_text):
+                        # it's a code
+                        mkd_codes.append(element_text)
+                        index_in_elements += 1
                     else:
-                        raise RuntimeError("text is None, -112")
-            outline_attrs = {}
-            # mubu image
-            if self.use_mubu_img:
-                nullable_image_list_arr = e.xpath('ul[@class="image-list"]')
-                nullable_image_list = None
-                if nullable_image_list_arr and len(nullable_image_list_arr) > 0:
-                    nullable_image_list = nullable_image_list_arr[0]
-                if nullable_image_list is not None:
-                    img_list_arr = nullable_image_list.xpath('li[@class="image-item"]')
-                    if img_list_arr and len(img_list_arr) > 0:
-                        img_arr = []
-                        for img_li in img_list_arr:
-                            img_arr.append(img_li.xpath('img[@src]')[0].attrib['src'])
-                        outline_attrs['mubu_imgs'] = img_arr
-            # parse note div ----- START
-            mkd_images = []
-            mkd_codes = []
-            nullable_note_content = e.xpath('div[@class="note mm-editor"]')
-            if len(nullable_note_content) > 0:
-                content += '\n'
-                img_token_re = re.compile(r'.*\!\[.*\]\(')
-                code_token_re = re.compile(r'```(.|\n)+```')
-                maybe_img_or_code = nullable_note_content[0].xpath('*')
-                if maybe_img_or_code and len(maybe_img_or_code) > 0:
-                    index_in_elements = 0
-                    while len(maybe_img_or_code) > index_in_elements:
-                        element = maybe_img_or_code[index_in_elements]
-                        element_tag = self._get_element_tag(element)
-                        element_text = self._get_element_text(element)
-                        if element_text:
-                            if element_text.startswith('\n'):
-                                element_text = element_text[1:].strip()
-                            elif len(element_text) > 1 and element_text.strip()[1] == '\n':
-                                # I cant explain this, but it works, this \n is U+200B, encode error
-                                element_text = element_text[2:].strip()
-                        if element_tag == 'span':
-                            if len(img_token_re.findall(element_text)) > 0:
-                                # it's a image
-                                img_url = element_text + \
-                                          maybe_img_or_code[index_in_elements + 1].attrib['href'].rstrip('\n')
-                                mkd_images.append(img_url)
-                                index_in_elements += 2
-                            elif len(code_token_re.findall(element_text)) > 0:
-                                # it's a code
-                                mkd_codes.append(element_text)
-                                index_in_elements += 1
-                            else:
-                                # normal text in note or something else?
-                                index_in_elements += 1
-                                content += f'>{element_text}'
-                        elif element_tag == 'a':
-                            # maybe a link
-                            assert element.attrib['class'] == 'content-link'
-                            link_url = element.attrib['href']
-                            content += f'{link_url}'
-                            index_in_elements += 1
-                        else:
-                            raise SyntaxError(f'what kind of tag beside "span" will appear at here? error code=118.'
-                                              f'--->tag:{element_tag}, text:{element_text} at line:{self._get_element_source_line(element)}')
-                if len(mkd_images) > 0:
-                    outline_attrs['mkd_imgs'] = mkd_images
-                if len(mkd_codes) > 0:
-                    outline_attrs['mkd_codes'] = mkd_codes
-            # parse note div ----- END
+                        # normal text in note or something else?
+                        index_in_elements += 1
+                        parts += ('>', element_text)
+                elif element_tag == 'a':
+                    # maybe a link
+                    assert element.attrib['class'] == 'content-link'
+                    link_url = element.attrib['href']
+                    parts.append(link_url)
+                    index_in_elements += 1
+                else:
+                    raise SyntaxError(f'what kind of tag beside "span" will appear at here? error code=118.'
+                                      f'--->tag:{element_tag}, text:{element_text} at line:{self._get_element_source_line(element)}')
+        if len(mkd_images) > 0:
+            outline_attrs['mkd_imgs'] = mkd_images
+        if len(mkd_codes) > 0:
+            outline_attrs['mkd_codes'] = mkd_codes
+        return ''.join(parts)
+
+    def _element_to_outline(self, e):
+        """
+        Build the Outline of one li.node, without its children. Returns (outline, li elements of the children).
+        """
+        class_name = self._get_element_attributes(e)['class']
+        is_normal_node = 'node' in class_name.split(' ')
+        assert is_normal_node
+        # one walk over the direct children instead of an xpath query per part
+        content_editor, image_list, note = None, None, None
+        children_lists = []
+        for part in e:
+            kind = self.NODE_PARTS.get((part.tag, part.get('class')))
+            if kind is None:
+                continue
+            if kind == 'children':
+                children_lists.append(part)
+            elif kind == 'content':
+                if content_editor is None:
+                    content_editor = part
+            elif kind == 'images':
+                if image_list is None:
+                    image_list = part
+            elif note is None:
+                note = part
+        if content_editor is None:
+            raise SyntaxError(f'node without content editor at line:{self._get_element_source_line(e)}, -140')
+        content = self._content_editor_to_text(content_editor)
+        outline_attrs = {}
+        # mubu image
+        if self.use_mubu_img and image_list is not None:
+            img_arr = self._image_list_to_urls(image_list)
+            if img_arr:
+                outline_attrs['mubu_imgs'] = img_arr
+        if note is not None:
+            if self.metrics.enabled:
+                with self.metrics.stage('MubuPost.parse_note'):
+                    content += self._parse_note(note, outline_attrs)
+            else:
+                content += self._parse_note(note, outline_attrs)
+        if self.metrics.enabled:
+            self._count_node(content_editor, note, outline_attrs)
+        if 'heading' in class_name:
+            h_n = self.HEADING_RE.findall(class_name)
             if h_n and len(h_n) == 1:
                 content = (int(h_n[0]) * '#') + ' ' + content
-            o = Outline(content, attrs=outline_attrs)
-            sub_children = e.xpath('div[@class="children"]/ul/li')
-            if sub_children and len(sub_children) > 0:
-                for sub_o in self._elements_to_outlines(sub_children):
-                    o.append_child(sub_o)
-            ret.append(o)
+        o = Outline(content, attrs=outline_attrs)
+        # same as xpath('div[@class="children"]/ul/li')
+        sub_children = [li for children in children_lists for ul in children if ul.tag == 'ul'
+                        for li in ul if li.tag == 'li']
+        return o, sub_children
+
+    def _count_node(self, content_editor, note, outline_attrs):
+        m = self.metrics
+        m.count('nodes')
+        m.count('spans', len(content_editor))
+        if note is not None:
+            m.count('notes')
+        for key, name in (('mubu_imgs', 'images'), ('mkd_imgs', 'images'), ('mkd_codes', 'codes')):
+            if key in outline_attrs:
+                m.count(name, len(outline_attrs[key]))
+
+    def _elements_to_outlines(self, element_children):
+        ret = []
+        # outlines of the current node's ancestors, indexed by depth
+        parents = []
+        # li elements of the node just handled, handed to preorder right after
+        sub_children = [None]
+        for e, depth in tree_walker.preorder(element_children, lambda _: sub_children[0]):
+            o, sub_children[0] = self._element_to_outline(e)
+            del parents[depth:]
+            if parents:
+                parents[-1].append_child(o)
+            else:
+                ret.append(o)
+            parents.append(o)
         return ret
 
-    def parse_to_opml(self):
+    def _top_level_items(self):
         # <div class="title"> user input text </div>
         title = self._get_element_text(self.dom.xpath('//div[@class="title"]')[0])
         assert title
+        self.title = title
         self.created_time = self._try_find_created_time_in_title(title)
         source_content = self._get_element_text(self.dom.xpath('//div[@class="publish"]/a')[0])
         if not source_content or str(source_content).strip() != '幕布文档':
@@ -282,16 +716,799 @@ class MubuPost:
         if not node_list_xp or len(node_list_xp) != 1:
             raise SyntaxError('Find node-list error, please check the output html. -35')
         root_element = node_list_xp[0]
+        return root_element.xpath('li')
+
+    def _subtree_jobs(self, items, jobs):
+        """
+        The number of processes to convert the top level items on, 0 when the serial conversion is faster.
+        An export of unknown size counts as a big one.
+        """
+        if not jobs or len(items) < 2:
+            return 0
+        jobs = min(jobs, os.cpu_count() or 1)
+        if jobs < self.SUBTREE_MIN_JOBS:
+            return 0
+        if self.source_size is not None and self.source_size < self.SUBTREE_MIN_BYTES:
+            return 0
+        return jobs
+
+    def _map_subtrees(self, items, jobs, render):
+        """
+        Split the top level items into contiguous groups, convert them with _convert_fragment on a pool of `jobs`
+        processes and return the results in document order.
+        The workers build posts of type(self) (which must be defined at module level) with its SPAN_HANDLERS, their
+        metrics are added to self.metrics.
+        """
+        groups = min(len(items), jobs * self.SUBTREE_GROUPS_PER_JOB)
+        fragments = []
+        for g in range(groups):
+            group = items[g * len(items) // groups:(g + 1) * len(items) // groups]
+            fragments.append(''.join(etree.tostring(li, method='html', encoding='unicode', with_tail=False)
+                                     for li in group))
+        cls = type(self)
+        span_handlers = cls.SPAN_HANDLERS
+        try:
+            pickle.dumps(span_handlers)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # lambdas: forked workers have them anyway
+            span_handlers = None
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_convert_fragment, fragments, itertools.repeat(cls),
+                                    itertools.repeat(span_handlers), itertools.repeat(self.use_mubu_img),
+                                    itertools.repeat(render), itertools.repeat(self.metrics.enabled)))
+        parts = []
+        for part, metrics in results:
+            if metrics is not None:
+                self.metrics.merge(metrics)
+            parts.append(part)
+        return parts
+
+    def parse_to_opml(self, jobs=None):
+        """
+        jobs > 1 converts the top level subtrees on a process pool, the model is identical to the serial one. Small
+        exports and fewer than SUBTREE_MIN_JOBS CPUs stay serial, see _subtree_jobs().
+        """
+        items = self._top_level_items()
+        return self._items_to_opml(items, self._subtree_jobs(items, jobs))
+
+    def _items_to_opml(self, items, jobs):
         outlines_holder = Outline('Stub')
-        for c in self._elements_to_outlines(root_element.xpath('li')):
-            outlines_holder.append_child(c)
-        head = Head(title, create_date=self.created_time, modified_date=self.modified_time)
+        with self.metrics.stage('MubuPost.elements_to_outlines'):
+            if jobs:
+                outlines = [o for part in self._map_subtrees(items, jobs, render=False) for o in part]
+            else:
+                outlines = self._elements_to_outlines(items)
+            for c in outlines:
+                outlines_holder.append_child(c)
+        head = Head(self.title, create_date=self.created_time, modified_date=self.modified_time)
         body = Body(outlines_holder.sub_outlines)
         return OPML(head, body)
 
-    def to_markdown(self, target_name=None):
-        Transformer(self.parse_to_opml()).to_markdown(target_name)
+    def _iter_html_events(self):
+        # a fed HTMLPullParser, etree.iterparse(html=True) ignores huge_tree and stops at 256 levels
+        parser = etree.HTMLPullParser(events=('start', 'end'), huge_tree=True)
+        source = self.source
+        if isinstance(source, (str, os.PathLike)):
+            reader = open(source, 'rb')
+        elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            reader = contextlib.nullcontext(_BufferReader(source))
+        else:
+            reader = contextlib.nullcontext(source)
+        with reader as r:
+            while True:
+                chunk = r.read(self.STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+
+    @staticmethod
+    def _release(li):
+        # the node is rendered already, drop it and its finished siblings
+        li.clear(keep_tail=True)
+        parent = li.getparent()
+        if parent is not None:
+            while li.getprevious() is not None:
+                del parent[0]
+
+    @staticmethod
+    def _is_children_div(element):
+        return element.tag == 'div' and element.get('class') == 'children'
+
+    def iter_outline_events(self):
+        """
+        Stream the export through an HTMLPullParser and yield (outline, depth) in document order without building the
+        DOM or the outline tree: a node is yielded as soon as its content is complete (when its children div opens),
+        and finished nodes are dropped right away, so memory is bounded by the nesting depth.
+        The outlines have no sub_outlines. The title is available as self.title once the first node came out, the
+        "publish" footer sits at the end of the export and is only checked after the last node.
+        """
+        title = None
+        node_list = None
+        publish_text = None
+        # [li, yielded] for the node being read at each depth
+        stack = []
+        for event, e in self._iter_html_events():
+            tag = e.tag
+            if event == 'start':
+                if tag == 'li':
+                    parent = e.getparent()
+                    if parent is node_list and node_list is not None:
+                        stack.append([e, False])
+                    elif stack and parent is not None and parent.tag == 'ul':
+                        holder = parent.getparent()
+                        if holder is not None and holder.getparent() is stack[-1][0] and self._is_children_div(holder):
+                            stack.append([e, False])
+                elif tag == 'div' and stack and not stack[-1][1] and e.getparent() is stack[-1][0] \
+                        and self._is_children_div(e):
+                    stack[-1][1] = True
+                    yield self._element_to_outline(stack[-1][0])[0], len(stack) - 1
+                elif tag == 'ul' and e.get('class') == 'node-list':
+                    parent = e.getparent()
+                    if parent is not None and parent.tag == 'body':
+                        if node_list is not None:
+                            raise SyntaxError('Find node-list error, please check the output html. -35')
+                        if title is None:
+                            raise SyntaxError('No title found before the node-list, please check the output html. -33')
+                        node_list = e
+                continue
+            # end
+            if stack and e is stack[-1][0]:
+                li, yielded = stack.pop()
+                if not yielded:
+                    yield self._element_to_outline(li)[0], len(stack)
+                self._release(li)
+            elif tag == 'div' and title is None and e.get('class') == 'title':
+                # <div class="title"> user input text </div>
+                title = self._get_element_text(e)
+                assert title
+                self.title = title
+                self.created_time = self._try_find_created_time_in_title(title)
+            elif tag == 'a' and publish_text is None:
+                parent = e.getparent()
+                if parent is not None and parent.tag == 'div' and parent.get('class') == 'publish':
+                    publish_text = self._get_element_text(e)
+        if node_list is None:
+            raise SyntaxError('Find node-list error, please check the output html. -35')
+        if not publish_text or str(publish_text).strip() != '幕布文档':
+            raise SyntaxError('Not MUBU html， please check it. -32')
+
+    def iter_markdown(self):
+        """
+        Markdown of the export straight from the iterparse events, byte-identical to the parse_to_opml() path.
+        """
+        return Transformer(None, metrics=self.metrics).render_outlines(self.iter_outline_events())
+
+    def render(self, sinks, streaming=False):
+        """
+        Feed the export to all lib.sinks sinks in one traversal, e.g. [MarkdownSink(md), OpmlSink(xml)].
+        streaming=True walks iter_outline_events() instead of the parse_to_opml() tree.
+        """
+        if not streaming:
+            render_opml(self.parse_to_opml(), sinks, self.metrics)
+            return
+        events = self.iter_outline_events()
+        # the head is complete once the first node came out
+        first = next(events, None)
+        if first is not None:
+            events = itertools.chain((first,), events)
+        head = Head(self.title, create_date=self.created_time, modified_date=self.modified_time)
+        fan_out(head, events, sinks, self.metrics)
+
+    def to_markdown(self, target_name=None, streaming=False, jobs=None):
+        """
+        streaming=True renders from iter_outline_events() instead of parse_to_opml(): no DOM and no outline tree are
+        built. The file is then written while the export is read, a broken export can leave a partial file behind.
+        jobs > 1 extracts and renders the top level subtrees on a process pool, the output is identical. Small exports
+        and fewer than SUBTREE_MIN_JOBS CPUs stay serial, see _subtree_jobs().
+        """
+        if not streaming:
+            # the items are looked up once, that walks the whole DOM
+            items = self._top_level_items()
+            jobs = self._subtree_jobs(items, jobs)
+            if not jobs:
+                Transformer(self._items_to_opml(items, 0), metrics=self.metrics).to_markdown(target_name)
+                return
+            chunks = itertools.chain(self._map_subtrees(items, jobs, render=True), Transformer.FOOTER)
+            with open(target_name or f'{self.title}.md', 'w', encoding='utf-8') as f:
+                Transformer(None, metrics=self.metrics).write_markdown(f, chunks)
+            return
+        chunks = self.iter_markdown()
+        # the first chunk comes after the title, which names the file by default
+        first = next(chunks)
+        file_name = target_name or f'{self.title}.md'
+        with open(file_name, 'w', encoding='utf-8') as f:
+            Transformer(None, metrics=self.metrics).write_markdown(f, itertools.chain((first,), chunks))
+
+
+def _render_outlines(outlines):
+    transformer = Transformer(None)
+    return ''.join(f'{transformer._outline_to_text(o)}\n'
+                   for o, _ in tree_walker.preorder(outlines, tree_walker.sub_outlines))
+
+
+def _convert_fragment(fragment, cls, span_handlers, use_mubu_img, render, measure):
+    """
+    Worker side of MubuPost._map_subtrees: the outlines of serialized top level li.node items, or their markdown,
+    and the Metrics of the work if measure.
+    """
+    if span_handlers is not None and cls.SPAN_HANDLERS != span_handlers:
+        # registered after this process was started
+        cls.SPAN_HANDLERS = span_handlers
+        cls._span_formats = {}
+    html = f'<html><head><meta charset="utf-8"></head><body><ul>{fragment}</ul></body></html>'
+    metrics = Metrics() if measure else None
+    post = cls(html.encode('utf-8'), use_mubu_img=use_mubu_img, metrics=metrics)
+    outlines = post._elements_to_outlines(post.dom.xpath('/html/body/ul/li'))
+    if metrics is not None:
+        # the fragment, the export was counted by the parent
+        metrics.counts.pop('bytes_read', None)
+    return (_render_outlines(outlines) if render else outlines), metrics
+
+
+class _BufferReader:
+    """
+    File-like view over a bytes-like buffer for iterparse, hands out slices without copying the whole buffer.
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast('B')
+        self.position = 0
+
+    def read(self, size=-1):
+        begin = self.position
+        end = len(self.view) if size is None or size < 0 else min(begin + size, len(self.view))
+        self.position = end
+        return bytes(self.view[begin:end])
+
+
+def collect_inputs(sources):
+    """
+    Expand files, directories (their *.html files) and glob patterns into a de-duplicated, ordered list of paths.
+    """
+    found = []
+    seen = set()
+    for source in sources:
+        p = Path(source)
+        if p.is_dir():
+            candidates = sorted(p.glob('*.html'))
+        elif p.is_file():
+            candidates = [p]
+        else:
+            candidates = sorted(Path(m) for m in glob.glob(source, recursive=True))
+        for c in candidates:
+            if not c.is_file():
+                continue
+            key = c.resolve()
+            if key not in seen:
+                seen.add(key)
+                found.append(c)
+    return found
+
+
+def duplicate_outputs(inputs):
+    """
+    Inputs that would write the same output files, {stem: paths}: exports with the same file name in different
+    directories (x/a.html, y/a.html -> a.md), archives with the same name (ex.zip, ex.tar.gz -> ex/).
+    """
+    groups = {}
+    for p in inputs:
+        key = (True, archive_stem(p)) if is_archive(p) else (False, Path(p).stem)
+        groups.setdefault(key, []).append(p)
+    return {stem: paths for (_, stem), paths in groups.items() if len(paths) > 1}
+
+
+def _check_outputs(inputs):
+    duplicates = duplicate_outputs(inputs)
+    if duplicates:
+        stem, paths = next(iter(duplicates.items()))
+        raise ValueError(f'{len(paths)} sources would write the same output {stem}: {", ".join(map(str, paths))}, '
+                         f'convert them into different output directories')
+
+
+def _localize_images(outlines, assets_dir, output_dir, input_path):
+    """
+    Store the images of outlines in assets_dir and link the local copies. Images that could not be fetched keep their
+    remote url, they are listed in a warning on stderr and returned, {url: error}.
+    """
+    localizer = ImageLocalizer(AssetStore(assets_dir))
+    try:
+        _, failed = localizer.localize_outlines(outlines, link_base=output_dir)
+    finally:
+        localizer.close()
+    if failed:
+        print(f'WARN {input_path}: {len(failed)} image(s) not fetched, kept their remote links: '
+              f'{", ".join(f"{url} ({error})" for url, error in failed.items())}', file=sys.stderr, flush=True)
+    return failed
+
+
+def _preorder(opml):
+    return (o for o, _ in tree_walker.preorder(opml.body.outlines, tree_walker.sub_outlines))
+
+
+def convert_file(input_path, output_dir, use_mubu_img=False, cache: ConversionCache = None, streaming=False,
+                 assets_dir=None, formats=('markdown',), incremental=False, split_level=None, split_size=None,
+                 index_path=None, metrics: Metrics = None):
+    """
+    Convert one export into output_dir/<input stem>.md, returns (input, output, error, seconds, cached), never raises
+    so one broken export does not take the rest of a batch down.
+    With a cache, an export whose bytes and options were converted before is copied out of it instead of parsed.
+    streaming renders through MubuPost.iter_outline_events(), without DOM or outline tree.
+    assets_dir downloads the images into a lib.assets.AssetStore there and links the local copies, images that cannot
+    be fetched keep their remote links (with a warning on stderr) and such a conversion is not cached.
+    formats other than just markdown (see SINKS) are all rendered in one traversal, output is then the first of the
+    files, the cache only holds markdown and is not used.
+    incremental keeps subtree hashes next to the output and re-renders (and fetches images for) only the branches that
+    changed since the last conversion of the same export, see Transformer.to_markdown_incremental.
+    split_level and/or split_size (bytes) cut the markdown into parts under output_dir/<input stem>/, output is then
+    the index linking them, see SplitMarkdownSink. Split conversions are not cached either.
+    index_path adds the outlines to a lib.search_index.SearchIndex while they are rendered (unless the index has this
+    export's bytes already), the document is the resolved input path.
+    metrics collects the stages and counters of the conversion, see lib.metrics.
+    """
+    begin = time.perf_counter()
+    formats = tuple(formats)
+    metrics = metrics or NULL_METRICS
+    metrics.count('files')
+    with SearchIndex(index_path) if index_path else contextlib.nullcontext() as index:
+        if formats != ('markdown',) or split_level or split_size:
+            return _convert_file_formats(input_path, output_dir, use_mubu_img, streaming, assets_dir, formats, begin,
+                                         split_level, split_size, index, metrics)
+        return _convert_file_markdown(input_path, output_dir, use_mubu_img, cache, streaming, assets_dir, incremental,
+                                      begin, index, metrics)
+
+
+def _index_target(input_path, index: SearchIndex):
+    if index is None:
+        return None, None
+    return str(Path(input_path).resolve()), _file_digest(input_path).hex()
+
+
+def _cache_key(cache: ConversionCache, input_path, use_mubu_img, assets_dir):
+    # everything but the export's bytes that changes the markdown convert_file caches
+    return cache.key_of_file(input_path, use_mubu_img=use_mubu_img, output_name=f'{Path(input_path).stem}.md',
+                             assets_dir=assets_dir and os.path.abspath(assets_dir))
+
+
+def _convert_file_markdown(input_path, output_dir, use_mubu_img, cache, streaming, assets_dir, incremental, begin,
+                           index, metrics):
+    output_name = f'{Path(input_path).stem}.md'
+    output_path = str(Path(output_dir) / output_name)
+    # urls of the images _localize_images could not fetch
+    not_fetched = {}
+    try:
+        document, digest = _index_target(input_path, index)
+        key = None
+        if cache:
+            key = _cache_key(cache, input_path, use_mubu_img, assets_dir)
+            markdown = cache.get_markdown(key)
+            # a cached export still gets parsed if the index does not have it
+            if markdown is not None and (index is None or index.is_current(document, digest)):
+                with open(output_path, 'wb') as f:
+                    f.write(markdown)
+                metrics.count('cache_hits')
+                return str(input_path), output_path, None, time.perf_counter() - begin, True
+        if streaming and index is not None:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                sink = IndexSink(index, document, digest, Transformer(None)._outline_to_text)
+                try:
+                    MubuPost(input_path, use_mubu_img=use_mubu_img, metrics=metrics).render(
+                        [MarkdownSink(f, metrics), sink], streaming=True)
+                finally:
+                    sink.close()
+        elif streaming:
+            MubuPost(input_path, use_mubu_img=use_mubu_img, metrics=metrics).to_markdown(output_path, streaming=True)
+        else:
+            opml = MubuPost(input_path, use_mubu_img=use_mubu_img, metrics=metrics).parse_to_opml()
+            if incremental:
+                def localize(outlines):
+                    not_fetched.update(_localize_images(outlines, assets_dir, output_dir, input_path))
+
+                # image links are relative to the output directory
+                options = {'assets_dir': os.path.abspath(assets_dir), 'link_base': os.path.abspath(output_dir)} \
+                    if assets_dir else None
+                Transformer(opml, metrics).to_markdown_incremental(output_path, options=options,
+                                                                   before_render=localize if assets_dir else None)
+            else:
+                if assets_dir:
+                    not_fetched.update(_localize_images(_preorder(opml), assets_dir, output_dir, input_path))
+                Transformer(opml, metrics).to_markdown(output_path)
+            if index is not None:
+                index.index_opml(document, opml, digest, Transformer(None)._outline_to_text)
+        # with remote links left in, the next run tries to fetch the images again
+        if cache and not not_fetched:
+            cache.put(key, Path(output_path).read_bytes())
+    except Exception as e:
+        return str(input_path), None, f'{type(e).__name__}: {e}', time.perf_counter() - begin, False
+    return str(input_path), output_path, None, time.perf_counter() - begin, False
+
+
+def _convert_file_formats(input_path, output_dir, use_mubu_img, streaming, assets_dir, formats, begin,
+                          split_level=None, split_size=None, index: SearchIndex = None, metrics: Metrics = None):
+    stem = Path(input_path).stem
+    output_paths = [str(Path(output_dir) / f'{stem}{SINKS[f][1]}') for f in formats]
+    split = None
+    try:
+        post = MubuPost(input_path, use_mubu_img=use_mubu_img, metrics=metrics)
+        document, digest = _index_target(input_path, index)
+        # every output is written to a temporary file and only replaces the old one once all were rendered
+        with contextlib.ExitStack() as files:
+            sinks = []
+            for f, p in zip(formats, output_paths):
+                fp = files.enter_context(_replaced_on_success(p))
+                if f == 'markdown' and (split_level or split_size):
+                    split = sink = SplitMarkdownSink(fp, Path(output_dir) / stem, split_level, split_size,
+                                                     prefix=f'{stem}-', link_base=output_dir, metrics=metrics)
+                else:
+                    sink = SINKS[f][0](fp)
+                sinks.append(sink)
+            if index is not None:
+                sinks.append(IndexSink(index, document, digest, Transformer(None)._outline_to_text))
+                files.callback(sinks[-1].close)
+            if streaming:
+                post.render(sinks, streaming=True)
+            else:
+                opml = post.parse_to_opml()
+                if assets_dir:
+                    _localize_images(_preorder(opml), assets_dir, output_dir, input_path)
+                render_opml(opml, sinks, metrics)
+            if split is not None:
+                split.commit()
+    except Exception as e:
+        if split is not None:
+            split.discard()
+        return str(input_path), None, f'{type(e).__name__}: {e}', time.perf_counter() - begin, False
+    return str(input_path), output_paths[0], None, time.perf_counter() - begin, False
+
+
+def convert_batch(inputs, output_dir, use_mubu_img=False, jobs=None, cache: ConversionCache = None,
+                  streaming=False, assets_dir=None, formats=('markdown',), incremental=False, split_level=None,
+                  split_size=None, index_path=None, metrics: Metrics = None):
+    """
+    Convert inputs on a process pool of `jobs` workers (None for one per CPU, 1 to stay in this process), yields the
+    convert_file results in completion order. The cache is trimmed to its size limit once the batch is done.
+    Raises ValueError if two inputs would write the same output, see duplicate_outputs().
+    metrics gets the measurements of every conversion, the workers send theirs back with their results.
+    """
+    _check_outputs(inputs)
+    os.makedirs(output_dir, exist_ok=True)
+    measure = metrics is not None and metrics.enabled
+    if jobs == 1:
+        for i in inputs:
+            yield convert_file(i, output_dir, use_mubu_img, cache, streaming, assets_dir, formats, incremental,
+                               split_level, split_size, index_path, metrics)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_convert_file_measured if measure else convert_file, i, output_dir, use_mubu_img,
+                                   cache, streaming, assets_dir, formats, incremental, split_level, split_size,
+                                   index_path) for i in inputs]
+            for f in as_completed(futures):
+                if measure:
+                    result, worker_metrics = f.result()
+                    metrics.merge(worker_metrics)
+                    yield result
+                else:
+                    yield f.result()
+    if cache:
+        cache.evict()
+
+
+def _convert_file_measured(*args):
+    # worker side of convert_batch with metrics: measure into a Metrics of our own, it goes back with the result
+    metrics = Metrics()
+    return convert_file(*args, metrics=metrics), metrics
+
+
+def _convert_member(archive, name, mtime, data, use_mubu_img, formats, streaming, index_path=None):
+    """
+    Worker side of convert_archive: renders one member (data, or read from the zip archive if None) in memory,
+    returns (archive:name, {output name: bytes}, error, seconds).
+    """
+    begin = time.perf_counter()
+    label = f'{archive}:{name}'
+    try:
+        with contextlib.closing(open_zip_member(archive, name)) if data is None else \
+                contextlib.nullcontext(data) as source, \
+                SearchIndex(index_path) if index_path else contextlib.nullcontext() as index:
+            post = MubuPost(source, use_mubu_img=use_mubu_img, created_time=mtime, modified_time=mtime)
+            buffers = [io.StringIO() for _ in formats]
+            sinks = [SINKS[f][0](b) for f, b in zip(formats, buffers)]
+            if index is not None:
+                # members are re-indexed every time, there is no digest to compare without reading them
+                sinks.append(IndexSink(index, label, None, Transformer(None)._outline_to_text))
+            try:
+                post.render(sinks, streaming=streaming)
+            finally:
+                if index is not None:
+                    sinks[-1].close()
+    except Exception as e:
+        return label, None, f'{type(e).__name__}: {e}', time.perf_counter() - begin
+    outputs = {member_output_name(name, SINKS[f][1]): b.getvalue().encode('utf-8') for f, b in zip(formats, buffers)}
+    return label, outputs, None, time.perf_counter() - begin
+
+
+def convert_archive(archive, output_dir=None, output_archive: ZipWriter = None, use_mubu_img=False, jobs=None,
+                    formats=('markdown',), streaming=False, index_path=None):
+    """
+    Convert the *.html members of a zip or tar archive without extracting it, yields convert_file-like results
+    (archive:member, output, error, seconds, False) in completion order. Dates come from the archive entries.
+    Outputs keep the member's path below a folder named after the archive, under output_dir or in output_archive: two
+    archives of the same name would overwrite each other, see duplicate_outputs(). Members go to a pool of `jobs`
+    processes (None for one per CPU, 1 to stay in this process), with at most 2 * jobs of them in flight: zip members
+    are read by the workers, tar members (which only read in order) are read here and their bytes sent over.
+    """
+    assert output_dir or output_archive
+    formats = tuple(formats)
+
+    def accept(name):
+        return name.lower().endswith('.html')
+
+    if is_zip(archive):
+        members = ((name, mtime, None) for name, mtime in zip_members(archive, accept))
+    else:
+        members = iter_tar_members(archive, accept)
+
+    prefix = archive_stem(archive)
+
+    def store(result):
+        label, outputs, error, seconds = result
+        mtime = mtimes.pop(label, None)
+        if error:
+            return label, None, error, seconds, False
+        outputs = {f'{prefix}/{name}': data for name, data in outputs.items()}
+        for output_name, data in outputs.items():
+            if output_archive:
+                output_archive.write(output_name, data, mtime)
+            else:
+                target = Path(output_dir) / output_name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_bytes(data)
+        first = next(iter(outputs))
+        where = f'{output_archive.zf.filename}:{first}' if output_archive else str(Path(output_dir) / first)
+        return label, where, None, seconds, False
+
+    mtimes = {}
+    if jobs == 1:
+        try:
+            for name, mtime, data in members:
+                mtimes[f'{archive}:{name}'] = mtime
+                yield store(_convert_member(str(archive), name, mtime, data, use_mubu_img, formats, streaming,
+                                            index_path))
+        finally:
+            close_zip(str(archive))
+        return
+    jobs = jobs or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = set()
+        for name, mtime, data in members:
+            mtimes[f'{archive}:{name}'] = mtime
+            running.add(pool.submit(_convert_member, str(archive), name, mtime, data, use_mubu_img, formats,
+                                    streaming, index_path))
+            if len(running) >= 2 * jobs:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for f in done:
+                    yield store(f.result())
+        for f in as_completed(running):
+            yield store(f.result())
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def watch(sources, output_dir, jobs=None, debounce=1.0, poll_interval=2.0, use_inotify=None, converted=(),
+          on_result=None, stop=None, **options):
+    """
+    Convert the *.html exports of the source directories (and the given export files) whenever they are added or
+    rewritten, until stop() is true or the process is interrupted. options are those of convert_file.
+    Files are converted on a pool of `jobs` processes with at most 2 * jobs conversions queued, a file that changes
+    while it is converted is converted once more afterwards. Files whose bytes did not change since they were last
+    converted here (or listed in converted, e.g. by a convert_batch run before) are skipped. A file that would write
+    the outputs of another existing one (same name in another directory, see duplicate_outputs()) is refused.
+    use_inotify=False polls the directories, see lib.watcher.Watcher.
+    on_result gets every convert_file result, (path, None, None, 0.0, False) for skipped files and
+    (path, None, error, 0.0, False) for refused ones.
+    Raises ValueError if a source is neither a directory nor a file.
+    """
+    jobs = jobs or os.cpu_count()
+    dirs, files = [], set()
+    for source in sources:
+        p = Path(source)
+        if p.is_dir():
+            dirs.append(p)
+        elif p.is_file():
+            dirs.append(p.parent)
+            files.add(p.resolve())
+        else:
+            raise ValueError(f'Cannot watch {source}, give directories or files')
+    dirs = list(dict.fromkeys(d.resolve() for d in dirs))
+    watched_dirs = {p.resolve() for p in map(Path, sources) if p.is_dir()}
+
+    def accept(path):
+        return path.suffix == '.html' and (path.parent in watched_dirs or path in files)
+
+    digests = {}
+    # output stem -> the export that writes it
+    owners = {}
+    for p in converted:
+        owners.setdefault(Path(p).stem, Path(p).resolve())
+        with contextlib.suppress(OSError):
+            digests[Path(p).resolve()] = _file_digest(p)
+    on_result = on_result or (lambda result: None)
+    os.makedirs(output_dir, exist_ok=True)
+    # path -> future of the conversions in flight; paths waiting for a worker, in order
+    running, queued = {}, {}
+    with Watcher(dirs, accept, debounce, poll_interval, use_inotify) as watcher, \
+            ProcessPoolExecutor(max_workers=jobs) as pool:
+        while not (stop and stop()):
+            for p in watcher.next_batch(timeout=0.2 if running or stop else None):
+                queued[p.resolve()] = None
+            done = [p for p, f in running.items() if f.done()]
+            for p in done:
+                on_result(running.pop(p).result())
+            for p in list(queued):
+                if len(running) >= 2 * jobs:
+                    break
+                if any(q.stem == p.stem for q in running):
+                    # converted (again) once the running conversion of it, or of a file with its name, is done
+                    continue
+                del queued[p]
+                owner = owners.get(p.stem)
+                if owner is not None and owner != p and owner.is_file():
+                    on_result((str(p), None, f'ValueError: {owner} writes the same output {p.stem}, convert them into '
+                                             f'different output directories', 0.0, False))
+                    continue
+                owners[p.stem] = p
+                try:
+                    digest = _file_digest(p)
+                except OSError:
+                    continue
+                if digests.get(p) == digest:
+                    on_result((str(p), None, None, 0.0, False))
+                    continue
+                digests[p] = digest
+                running[p] = pool.submit(convert_file, p, output_dir, **options)
+        for f in wait(running.values()).done:
+            on_result(f.result())
+
+
+def _print_result(result):
+    """
+    Print a convert_file result, returns whether it failed.
+    """
+    input_path, output_path, error, seconds, cached = result
+    if error:
+        print(f'FAIL {input_path} ({seconds:.3f}s): {error}', flush=True)
+        return True
+    if output_path is None:
+        print(f'SKIP {input_path} (unchanged)', flush=True)
+    else:
+        status = 'HIT ' if cached else 'OK  '
+        print(f'{status} {input_path} -> {output_path} ({seconds:.3f}s)', flush=True)
+    return False
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Convert Mubu HTML exports to Markdown.')
+    arg_parser.add_argument('sources', nargs='*', help='exported html files, directories or glob patterns')
+    arg_parser.add_argument('-o', '--output-dir', default='.', help='where the markdown files go, default: .')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+                            help='worker processes, default: one per CPU, 1 converts in this process')
+    arg_parser.add_argument('--use-mubu-img', action='store_true', help='show MUBU uploaded images in the output')
+    arg_parser.add_argument('--streaming', action='store_true',
+                            help='render while reading, memory bounded by the nesting depth instead of the post size')
+    arg_parser.add_argument('--assets-dir', help='download the images here (content addressed, shared by all posts) '
+                                                 'and link the local copies')
+    arg_parser.add_argument('-f', '--format', action='append', choices=list(SINKS), dest='formats',
+                            help='output format, repeat it to render several formats in one pass, default: markdown')
+    arg_parser.add_argument('--split-level', type=int, choices=range(1, 7), metavar='N',
+                            help='cut the markdown into one file per heading of level N or higher, plus an index')
+    arg_parser.add_argument('--split-size', type=int, metavar='KB',
+                            help='cut the markdown into files of at most this size (one outline is never cut), plus an '
+                                 'index')
+    arg_parser.add_argument('--incremental', action='store_true',
+                            help='keep subtree hashes next to the output and only re-render (and fetch the images of) '
+                                 'the branches that changed since the last run. Hashing a node costs about twice its '
+                                 'markdown: this pays off with --assets-dir, plain conversions get slower')
+    arg_parser.add_argument('--watch', action='store_true',
+                            help='keep running and convert exports added to or rewritten in the source directories')
+    arg_parser.add_argument('--debounce', type=float, default=1.0,
+                            help='--watch: seconds a file must stay untouched before it is converted, '
+                                 'default: %(default)s')
+    arg_parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='--watch: seconds between directory scans where inotify is not available, '
+                                 'default: %(default)s')
+    arg_parser.add_argument('--poll', action='store_true',
+                            help='--watch: scan the directories instead of using inotify, e.g. on network shares')
+    arg_parser.add_argument('--output-archive', help='write the conversions of zip/tar sources into this zip file '
+                                                     'instead of --output-dir')
+    arg_parser.add_argument('--index', metavar='DB', help='add every converted outline to this full-text index, search '
+                                                          'it with python -m lib.search_index DB words...')
+    arg_parser.add_argument('--metrics', metavar='JSON', help='write the summed stage timings and counters (nodes, '
+                                                              'spans, images...) of the html conversions to this file')
+    arg_parser.add_argument('--cache-dir', help='reuse conversions of unchanged exports from this directory')
+    arg_parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                            help='cache size limit in MB, least recently used entries go first, default: %(default)s')
+    arg_parser.add_argument('--clear-cache', action='store_true', help='empty the cache directory before converting')
+    arg_parser.add_argument('--invalidate-cache', action='store_true',
+                            help='drop the cache entries of the given sources (converted with the given options) '
+                                 'before converting them again')
+    args = arg_parser.parse_args(argv)
+
+    cache = None
+    if args.cache_dir:
+        cache = ConversionCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    if args.clear_cache or args.invalidate_cache:
+        if not cache:
+            arg_parser.error('--clear-cache and --invalidate-cache need --cache-dir')
+    if args.clear_cache:
+        print(f'{cache.clear()} cache files removed from {args.cache_dir}')
+        if not args.sources:
+            return 0
+    if not args.sources:
+        arg_parser.error('no source given')
+    if args.assets_dir and args.streaming:
+        arg_parser.error('--assets-dir needs the outline tree, it does not work with --streaming')
+    if args.incremental and (args.streaming or (args.formats and set(args.formats) != {'markdown'})):
+        arg_parser.error('--incremental works on the outline tree and markdown only')
+    if args.incremental and (args.split_level or args.split_size):
+        arg_parser.error('--incremental writes a single markdown file, it does not work with --split-*')
+    if args.watch:
+        for source in args.sources:
+            if not os.path.isdir(source) and not os.path.isfile(source):
+                arg_parser.error(f'--watch needs directories or files, {source} is neither (glob patterns cannot '
+                                 f'be watched)')
+
+    inputs = collect_inputs(args.sources)
+    try:
+        _check_outputs(inputs)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    archives = [p for p in inputs if is_archive(p)]
+    inputs = [p for p in inputs if not is_archive(p)]
+    if args.invalidate_cache:
+        invalidated = sum(cache.invalidate(_cache_key(cache, p, args.use_mubu_img, args.assets_dir)) for p in inputs)
+        print(f'{invalidated} cache entries of {len(inputs)} sources removed from {args.cache_dir}')
+    if not inputs and not archives and not args.watch:
+        print('No input file found.', file=sys.stderr)
+        return 2
+    if archives and (cache or args.assets_dir or args.incremental or args.split_level or args.split_size or args.watch):
+        arg_parser.error('zip/tar sources only work with -f, --streaming, --use-mubu-img and --index')
+    begin = time.perf_counter()
+    formats = tuple(dict.fromkeys(args.formats or ('markdown',)))
+    options = dict(use_mubu_img=args.use_mubu_img, cache=cache, streaming=args.streaming, assets_dir=args.assets_dir,
+                   formats=formats, incremental=args.incremental, split_level=args.split_level,
+                   split_size=args.split_size and args.split_size * 1024, index_path=args.index)
+    metrics = Metrics() if args.metrics else None
+    failed = sum(_print_result(r) for r in convert_batch(inputs, args.output_dir, jobs=args.jobs, metrics=metrics,
+                                                         **options))
+    if metrics:
+        metrics.write_json(args.metrics)
+    converted = len(inputs)
+    if archives:
+        with ZipWriter(args.output_archive) if args.output_archive else contextlib.nullcontext() as output_archive:
+            for archive in archives:
+                for result in convert_archive(archive, args.output_dir, output_archive, args.use_mubu_img, args.jobs,
+                                              formats, args.streaming, args.index):
+                    converted += 1
+                    failed += _print_result(result)
+    print(f'{converted - failed} converted, {failed} failed, {time.perf_counter() - begin:.3f}s in total')
+    if args.watch:
+        print(f'Watching {", ".join(args.sources)}, Ctrl-C to stop', flush=True)
+        try:
+            watch(args.sources, args.output_dir, args.jobs, args.debounce, args.poll_interval,
+                  False if args.poll else None, converted=inputs, on_result=_print_result, **options)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    pass
+    sys.exit(main())
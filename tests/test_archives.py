@@ -0,0 +1,129 @@
+"""
+Exports read straight out of zip and tar archives: what is converted, where it goes and the archives kept open.
+"""
+import io
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+import zipfile
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib import archives
+from lib.archives import ZipWriter, archive_stem, member_output_name, open_zip_member, zip_members
+from mubu2markdown import MubuPost, Transformer, convert_archive
+
+MTIME = 1600000000
+# member name -> output name below the archive's folder
+MEMBERS = {
+    'post.html': 'post.md',
+    'dir/sub/nested.html': 'dir/sub/nested.md',
+    '../escape.html': 'escape.md',
+}
+
+
+class ArchiveNamesTest(unittest.TestCase):
+    def test_archive_stem(self):
+        for name in ('ex.zip', 'ex.ZIP', 'a/b/ex.tar.gz', 'ex.tgz', 'ex.tar.xz', 'ex'):
+            self.assertEqual(archive_stem(name), 'ex', name)
+
+    def test_member_output_name(self):
+        for name, output in MEMBERS.items():
+            self.assertEqual(member_output_name(name, '.md'), output)
+        self.assertEqual(member_output_name('/abs/./a.html', '.json'), 'abs/a.json')
+
+
+class ConvertArchiveTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.html = {name: synthetic_mubu_html(CorpusSpec(breadth=3, depth=2, seed=i))[0].encode('utf-8')
+                    for i, name in enumerate(MEMBERS)}
+        cls.markdown = {MEMBERS[name]: Transformer(MubuPost(html).parse_to_opml()).to_markdown_string().encode('utf-8')
+                        for name, html in cls.html.items()}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+        self.zip = self.root / 'ex.zip'
+        with zipfile.ZipFile(self.zip, 'w') as zf:
+            for name, html in self.html.items():
+                zf.writestr(zipfile.ZipInfo(name, time.localtime(MTIME)[:6]), html)
+            zf.writestr('notes.txt', b'not an export')
+        self.tar = self.root / 'ex.tar.gz'
+        with tarfile.open(self.tar, 'w:gz') as tf:
+            for name, html in self.html.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(html)
+                info.mtime = MTIME
+                tf.addfile(info, io.BytesIO(html))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _outputs(self, out):
+        return {str(p.relative_to(out).as_posix()): p.read_bytes() for p in out.rglob('*') if p.is_file()}
+
+    def test_to_a_directory(self):
+        expected = {f'ex/{name}': markdown for name, markdown in self.markdown.items()}
+        for archive in (self.zip, self.tar):
+            for jobs in (1, 2):
+                out = self.root / f'out-{archive.name}-{jobs}'
+                results = list(convert_archive(archive, out, jobs=jobs))
+                self.assertEqual([r[2] for r in results], [None] * len(MEMBERS))
+                self.assertEqual(sorted(r[0] for r in results), sorted(f'{archive}:{n}' for n in MEMBERS))
+                self.assertEqual(self._outputs(out), expected, (archive.name, jobs))
+        self.assertEqual(archives._open_zips, {})
+
+    def test_to_a_zip(self):
+        for archive in (self.zip, self.tar):
+            target = self.root / f'{archive.name}.out.zip'
+            with ZipWriter(target) as writer:
+                results = list(convert_archive(archive, output_archive=writer, jobs=2, formats=('markdown', 'json')))
+            self.assertEqual([r[2] for r in results], [None] * len(MEMBERS))
+            with zipfile.ZipFile(target) as zf:
+                names = sorted(zf.namelist())
+                self.assertEqual(names, sorted(f'ex/{n}{s}' for n in (o[:-3] for o in self.markdown)
+                                               for s in ('.json', '.md')))
+                for name, markdown in self.markdown.items():
+                    info = zf.getinfo(f'ex/{name}')
+                    self.assertEqual(zf.read(info), markdown)
+                    self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+                    # zip dates have a 2 seconds resolution
+                    self.assertLessEqual(abs(time.mktime(info.date_time + (0, 0, -1)) - MTIME), 2)
+
+    def test_members_and_their_dates(self):
+        members = zip_members(self.zip, lambda n: n.endswith('.html'))
+        self.assertEqual([n for n, _ in members], list(MEMBERS))
+        self.assertTrue(all(abs(mtime - MTIME) <= 2 for _, mtime in members))
+
+    def test_open_archives_are_bounded(self):
+        paths = []
+        for i in range(archives.MAX_OPEN_ZIPS + 2):
+            paths.append(self.root / f'{i}.zip')
+            with zipfile.ZipFile(paths[-1], 'w') as zf:
+                zf.writestr('a.html', f'archive {i}')
+        try:
+            for i, path in enumerate(paths):
+                with open_zip_member(path, 'a.html') as f:
+                    self.assertEqual(f.read(), f'archive {i}'.encode())
+            self.assertEqual(list(archives._open_zips), [os.fspath(p) for p in paths[-archives.MAX_OPEN_ZIPS:]])
+            # a rewritten archive is opened again
+            with zipfile.ZipFile(paths[-1], 'w') as zf:
+                zf.writestr('a.html', 'rewritten, longer')
+            with open_zip_member(paths[-1], 'a.html') as f:
+                self.assertEqual(f.read(), b'rewritten, longer')
+            # members opened before the archive is closed stay readable
+            member = open_zip_member(paths[-2], 'a.html')
+            archives.close_zip(paths[-2])
+            self.assertNotIn(os.fspath(paths[-2]), archives._open_zips)
+            with member:
+                self.assertEqual(member.read(), f'archive {len(paths) - 2}'.encode())
+        finally:
+            for path in paths:
+                archives.close_zip(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
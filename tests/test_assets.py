@@ -0,0 +1,146 @@
+"""
+ImageLocalizer against a local HTTP server: missing images, flaky hosts and the same image under several urls.
+"""
+import contextlib
+import io
+import os
+import pathlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.assets import AssetStore, FetchError, ImageLocalizer
+from lib.conversion_cache import ConversionCache
+from lib.opml_processor import Body, Head, OPML, Outline
+from lib.outline_table import OutlineTable
+from mubu2markdown import convert_file
+
+PNG = b'\x89PNG\r\n\x1a\n fake image'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = hits = server.hits.get(self.path, 0) + 1
+        if self.path in ('/a.png', '/copy-of-a.png') or (self.path == '/flaky.png' and hits > 1):
+            self._reply(200, PNG, 'image/png')
+        elif self.path == '/flaky.png':
+            self._reply(503, b'busy', 'text/plain')
+        elif self.path == '/moved':
+            self.send_response(302)
+            self.send_header('Location', '/a.png')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._reply(404, b'not found', 'text/plain')
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageLocalizerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.hits = {}
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = AssetStore(os.path.join(self.dir.name, 'assets'))
+        self.localizer = ImageLocalizer(self.store, retries=2, backoff=0.01, timeout=5)
+
+    def tearDown(self):
+        self.localizer.close()
+        self.dir.cleanup()
+
+    def _opml(self, *outlines):
+        return OPML(Head('post'), Body(list(outlines)))
+
+    def test_missing_image_is_not_retried(self):
+        url = f'{self.base}/missing.png'
+        o = Outline('node', attrs={'mubu_imgs': [url]})
+        done, failed = self.localizer.localize([self._opml(o)])
+        self.assertEqual(done, {})
+        self.assertIsInstance(failed[url], FetchError)
+        self.assertEqual(failed[url].status, 404)
+        self.assertEqual(self.server.hits['/missing.png'], 1)
+        self.assertEqual(o.attrs['mubu_imgs'], [url])
+
+    def test_unavailable_then_ok_is_retried(self):
+        url = f'{self.base}/flaky.png'
+        o = Outline('node', attrs={'mkd_imgs': [f'![alt]({url}']})
+        done, failed = self.localizer.localize([self._opml(o)], link_base=self.dir.name)
+        self.assertEqual(failed, {})
+        self.assertEqual(self.server.hits['/flaky.png'], 2)
+        self.assertEqual(done[url].read_bytes(), PNG)
+        self.assertEqual(o.attrs['mkd_imgs'], [f'![alt](assets/{done[url].parent.name}/{done[url].name}'])
+
+    def test_duplicate_images_are_fetched_and_stored_once(self):
+        a, copy, moved = f'{self.base}/a.png', f'{self.base}/copy-of-a.png', f'{self.base}/moved'
+        first = Outline('first', attrs={'mubu_imgs': [a, copy]})
+        second = Outline('second', attrs={'mubu_imgs': str([a]), 'mkd_imgs': [f'![x]({moved}']})
+        done, failed = self.localizer.localize([self._opml(first), self._opml(second)])
+        self.assertEqual(failed, {})
+        self.assertEqual(self.server.hits['/a.png'], 2)
+        self.assertEqual(self.server.hits['/copy-of-a.png'], 1)
+        self.assertEqual(len(set(done.values())), 1)
+        stored = [p for p in pathlib.Path(self.store.root).rglob('*') if p.is_file()]
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(first.attrs['mubu_imgs'], [stored[0].resolve().as_posix()] * 2)
+
+    def test_outline_views_are_refused(self):
+        url = f'{self.base}/a.png'
+        table = OutlineTable.from_outlines([Outline('node', attrs={'mubu_imgs': [url]})])
+        with self.assertRaises(RuntimeError):
+            self.localizer.localize_outlines(table.roots())
+        self.assertEqual(self.server.hits, {})
+
+    def test_missing_images_keep_their_links(self):
+        html = synthetic_mubu_html(CorpusSpec(breadth=3, depth=2, images=1.0))[0]
+        # one image the server has, every other one is missing
+        html = html.replace('https://img.example.com/1.png', f'{self.base}/a.png')
+        html = html.replace('https://img.example.com/', f'{self.base}/')
+        export = pathlib.Path(self.dir.name) / 'post.html'
+        export.write_text(html, encoding='utf-8')
+        out = pathlib.Path(self.dir.name) / 'out'
+        out.mkdir()
+        cache = ConversionCache(pathlib.Path(self.dir.name) / 'cache')
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            _, output, error, _, _ = convert_file(export, out, use_mubu_img=True, cache=cache,
+                                                  assets_dir=os.path.join(self.dir.name, 'assets'))
+        self.assertIsNone(error)
+        markdown = pathlib.Path(output).read_text(encoding='utf-8')
+        self.assertNotIn(f'{self.base}/a.png', markdown)
+        self.assertIn('](../assets/', markdown)
+        self.assertIn(f'![]({self.base}/2.png)', markdown)
+        self.assertIn(f'![image]({self.base}/note/', markdown)
+        self.assertIn(f'WARN {export}: ', stderr.getvalue())
+        self.assertIn(f'{self.base}/2.png (HTTP 404', stderr.getvalue())
+        # fetched again by the next run
+        self.assertEqual(cache.size(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
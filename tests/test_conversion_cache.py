@@ -0,0 +1,99 @@
+"""
+ConversionCache keys, hits and misses, eviction, and the cache options of the command line.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib import conversion_cache
+from lib.conversion_cache import ConversionCache
+from mubu2markdown import main
+
+
+class ConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = ConversionCache(Path(self.dir.name) / 'cache', max_bytes=250)
+        self.export = Path(self.dir.name) / 'post.html'
+        self.export.write_bytes(b'<html>post</html>')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_hit_and_miss(self):
+        key = self.cache.key_of_file(self.export, use_mubu_img=False)
+        self.assertEqual(key, ConversionCache.key(b'<html>post</html>', use_mubu_img=False))
+        self.assertIsNone(self.cache.get_markdown(key))
+        self.cache.put(key, b'# post\n')
+        self.assertEqual(self.cache.get_markdown(key), b'# post\n')
+        # other bytes, other options
+        self.assertNotEqual(ConversionCache.key(b'<html>post.</html>', use_mubu_img=False), key)
+        self.assertNotEqual(self.cache.key_of_file(self.export, use_mubu_img=True), key)
+        self.assertTrue(self.cache.invalidate(key))
+        self.assertFalse(self.cache.invalidate(key))
+        self.assertIsNone(self.cache.get_markdown(key))
+
+    def test_other_version_misses(self):
+        key = self.cache.key_of_file(self.export)
+        self.cache.put(key, b'# post\n')
+        with mock.patch.object(conversion_cache, 'CACHE_VERSION', conversion_cache.CACHE_VERSION + 1):
+            other = self.cache.key_of_file(self.export)
+        self.assertNotEqual(other, key)
+        self.assertIsNone(self.cache.get_markdown(other))
+
+    def test_eviction_drops_least_recently_used(self):
+        keys = [ConversionCache.key(bytes([i])) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, b'x' * 100)
+            path = self.cache._path(key, conversion_cache.MARKDOWN_SUFFIX)
+            os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+        # reading the oldest makes it the most recent
+        self.cache.get_markdown(keys[0])
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertIsNone(self.cache.get_markdown(keys[1]))
+        self.assertIsNotNone(self.cache.get_markdown(keys[0]))
+        self.assertIsNotNone(self.cache.get_markdown(keys[2]))
+        self.assertEqual(self.cache.size(), 200)
+        self.assertEqual(self.cache.clear(), 2)
+
+
+class CacheCommandLineTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+        self.exports = []
+        for i in range(2):
+            self.exports.append(str(self.root / f'post{i}.html'))
+            Path(self.exports[-1]).write_text(synthetic_mubu_html(CorpusSpec(breadth=3, depth=2, seed=i))[0],
+                                              encoding='utf-8')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _run(self, exports, *options):
+        out = io.StringIO()
+        args = exports + ['-o', str(self.root / 'out'), '-j', '1', '--cache-dir', str(self.root / 'cache')]
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(main(args + list(options)), 0)
+        return out.getvalue()
+
+    def test_invalidate_cache(self):
+        self.assertNotIn('HIT', self._run(self.exports))
+        self.assertEqual(self._run(self.exports).count('HIT'), 2)
+        out = self._run(self.exports[:1], '--invalidate-cache')
+        self.assertIn('1 cache entries of 1 sources removed', out)
+        self.assertNotIn('HIT', out)
+        # the other export is still cached, the invalidated one is cached again
+        self.assertEqual(self._run(self.exports).count('HIT'), 2)
+        # entries of other options are other entries
+        self.assertIn('0 cache entries', self._run(self.exports, '--use-mubu-img', '--invalidate-cache'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+ConversionServer admission control and request parsing, on a real socket and a real worker pool.
+"""
+import asyncio
+import time
+import unittest
+
+import conversion_server
+from conversion_server import ConversionServer
+
+
+def _sleep_then_convert(source_kind, target_kind, body, use_mubu_img=False):
+    # the body is how long the conversion takes
+    time.sleep(float(body))
+    return 'done'
+
+
+class ConversionServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._convert = conversion_server.convert
+        conversion_server.convert = _sleep_then_convert
+        self.server = ConversionServer(workers=1, max_pending=2, timeout=0.2)
+        await self.server.start_pool()
+        self.listener = await asyncio.start_server(self.server.handle, '127.0.0.1', 0)
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.listener.close()
+        await self.listener.wait_closed()
+        self.server.close()
+        conversion_server.convert = self._convert
+
+    async def _request(self, head: bytes, body=b''):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.write(head + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        writer.close()
+        return int(status_line.split()[1])
+
+    async def _post(self, seconds):
+        body = str(seconds).encode()
+        return await self._request(b'POST /convert HTTP/1.1\r\nConnection: close\r\n'
+                                   b'Content-Length: %d\r\n\r\n' % len(body), body)
+
+    async def test_timed_out_conversions_keep_their_slot(self):
+        self.assertEqual(await asyncio.gather(self._post(1.0), self._post(1.0)), [504, 504])
+        # both are still in the pool
+        self.assertEqual(await self._post(0), 503)
+        deadline = time.monotonic() + 10
+        while self.server.stats.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self.assertEqual(self.server.stats.in_flight, 0)
+        self.assertEqual(await self._post(0), 200)
+
+    async def test_malformed_content_length(self):
+        for value in (b'abc', b'-5'):
+            status = await self._request(b'POST /convert HTTP/1.1\r\nContent-Length: ' + value + b'\r\n\r\n')
+            self.assertEqual(status, 400, value)
+
+
+if __name__ == '__main__':
+    unittest.main()
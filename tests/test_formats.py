@@ -0,0 +1,59 @@
+"""
+Conversions into several formats and split markdown: all outputs or none.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from mubu2markdown import SINKS, convert_file
+
+
+class FormatsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+        self.out = self.root / 'out'
+        self.out.mkdir()
+        self.good = self.root / 'post.html'
+        self.good.write_text(synthetic_mubu_html(CorpusSpec(breadth=4, depth=3))[0], encoding='utf-8')
+        # a Mubu export cut off in the middle of its nodes
+        self.bad = self.root / 'bad.html'
+        self.bad.write_text(self.good.read_text(encoding='utf-8')[:3000], encoding='utf-8')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _files(self):
+        return sorted(str(p.relative_to(self.out)) for p in self.out.rglob('*') if p.is_file())
+
+    def test_failed_conversion_leaves_nothing(self):
+        for streaming in (False, True):
+            for split_size in (None, 2000):
+                _, output, error, _, _ = convert_file(self.bad, self.out, formats=SINKS, streaming=streaming,
+                                                      split_size=split_size)
+                self.assertIsNone(output)
+                self.assertTrue(error)
+                self.assertEqual(self._files(), [], (streaming, split_size))
+
+    def test_failed_conversion_keeps_the_previous_outputs(self):
+        self.bad.write_bytes(self.good.read_bytes())
+        self.assertIsNone(convert_file(self.bad, self.out, formats=SINKS, split_size=2000)[2])
+        before = {name: (self.out / name).read_bytes() for name in self._files()}
+        self.bad.write_text(self.good.read_text(encoding='utf-8')[:3000], encoding='utf-8')
+        self.assertTrue(convert_file(self.bad, self.out, formats=SINKS, split_size=2000)[2])
+        self.assertEqual({name: (self.out / name).read_bytes() for name in self._files()}, before)
+
+    def test_outputs(self):
+        input_path, output, error, _, _ = convert_file(self.good, self.out, formats=SINKS, split_size=2000)
+        self.assertIsNone(error)
+        self.assertEqual(output, str(self.out / 'post.md'))
+        files = self._files()
+        self.assertEqual([f for f in files if '/' not in f], ['post.json', 'post.md', 'post.txt', 'post.xml'])
+        parts = [f for f in files if '/' in f]
+        self.assertTrue(parts)
+        self.assertTrue(all(p.startswith('post/post-') and p.endswith('.md') for p in parts))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Transformer.to_markdown_incremental must write what to_markdown writes, whatever the previous run left behind.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from mubu2markdown import MubuPost, Transformer, _preorder
+
+
+def _localize(outlines):
+    for o in outlines:
+        if o.attrs and o.attrs.get('mubu_imgs'):
+            o.attrs['mubu_imgs'] = [f'assets/{u.rsplit("/", 1)[-1]}' for u in o.attrs['mubu_imgs']]
+
+
+class IncrementalTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.html = synthetic_mubu_html(CorpusSpec(breadth=4, depth=3, images=0.5))[0].encode('utf-8')
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.target = Path(self.dir.name) / 'post.md'
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _full(self, localize=False, html=None):
+        opml = MubuPost(html or self.html, use_mubu_img=True).parse_to_opml()
+        if localize:
+            _localize(_preorder(opml))
+        path = Path(self.dir.name) / 'full.md'
+        Transformer(opml).to_markdown(str(path))
+        return path.read_text(encoding='utf-8')
+
+    def _incremental(self, localize=False, html=None):
+        opml = MubuPost(html or self.html, use_mubu_img=True).parse_to_opml()
+        if localize:
+            counts = Transformer(opml).to_markdown_incremental(str(self.target), before_render=_localize,
+                                                               options={'assets_dir': 'assets'})
+        else:
+            counts = Transformer(opml).to_markdown_incremental(str(self.target))
+        return counts, self.target.read_text(encoding='utf-8')
+
+    def test_unchanged_post_is_reused(self):
+        (rendered, reused), first = self._incremental()
+        self.assertEqual(reused, 0)
+        (rendered, reused), second = self._incremental()
+        self.assertEqual(rendered, 0)
+        self.assertEqual(first, second)
+        self.assertEqual(second, self._full())
+
+    def test_edited_subtree_is_rendered_alone(self):
+        (rendered, reused), _ = self._incremental()
+        self.assertEqual((rendered, reused), (84, 0))
+        # node 7 is the second child of node 1 and has 4 children: only it and node 1 changed
+        edited = self.html.replace(b' 7.0<', b' 7.0 edited<')
+        self.assertNotEqual(edited, self.html)
+        (rendered, reused), markdown = self._incremental(html=edited)
+        self.assertEqual((rendered, reused), (2, 82))
+        self.assertIn(' 7.0 edited', markdown)
+        self.assertEqual(markdown, self._full(html=edited))
+        # and back
+        (rendered, reused), markdown = self._incremental()
+        self.assertEqual((rendered, reused), (2, 82))
+        self.assertEqual(markdown, self._full())
+
+    def test_other_options_render_everything(self):
+        self._incremental()
+        (rendered, reused), localized = self._incremental(localize=True)
+        self.assertEqual(reused, 0)
+        self.assertIn('](assets/', localized)
+        self.assertEqual(localized, self._full(localize=True))
+        (rendered, reused), remote = self._incremental()
+        self.assertEqual(reused, 0)
+        self.assertNotIn('](assets/', remote)
+        self.assertEqual(remote, self._full())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Metrics of batch conversions: workers' measurements add up, NULL_METRICS never collects any.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.metrics import Metrics, NULL_METRICS
+from mubu2markdown import convert_batch
+
+
+class BatchMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.inputs = []
+        for i in range(3):
+            path = Path(self.dir.name) / f'post{i}.html'
+            path.write_text(synthetic_mubu_html(CorpusSpec(breadth=3, depth=2, seed=i))[0], encoding='utf-8')
+            self.inputs.append(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _convert(self, jobs, metrics):
+        results = list(convert_batch(self.inputs, Path(self.dir.name) / f'out{jobs}', jobs=jobs, metrics=metrics))
+        self.assertEqual([r[2] for r in results], [None] * len(self.inputs))
+
+    def test_workers_are_merged(self):
+        serial, parallel = Metrics(), Metrics()
+        self._convert(1, serial)
+        self._convert(2, parallel)
+        self.assertEqual(parallel.counts, serial.counts)
+        self.assertEqual(parallel.counts['files'], 3)
+        self.assertEqual(parallel.stage_calls, serial.stage_calls)
+
+    def test_null_metrics_stay_empty(self):
+        self._convert(2, NULL_METRICS)
+        self.assertFalse(NULL_METRICS)
+        worker = Metrics()
+        worker.count('files')
+        NULL_METRICS.merge(worker)
+        self.assertEqual(NULL_METRICS.summary(), {'stages': {}, 'counts': {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+List attributes survive the trip through OPML XML, and Transformer renders what they held.
+"""
+import io
+import unittest
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.opml_processor import OPML, Body, Head, Outline, Parser, list_attr
+from lib.sinks import OpmlSink, render_opml
+from mubu2markdown import MubuPost, Transformer
+
+
+class ListAttrTest(unittest.TestCase):
+    def test_lists_and_their_str(self):
+        items = ["it's", 'say "hi"', 'a\nb', '```python\nprint(1)\n```', 'C:\\path']
+        self.assertEqual(list_attr(items), items)
+        self.assertEqual(list_attr(str(items)), items)
+        self.assertEqual(list_attr(None), [])
+        self.assertEqual(list_attr(''), [])
+        with self.assertRaises(SyntaxError):
+            list_attr('not a list')
+        with self.assertRaises(SyntaxError):
+            list_attr("{'a': 1}")
+
+    def test_markdown_of_a_parsed_opml(self):
+        spec = CorpusSpec(breadth=4, depth=3, notes=0.8, code_blocks=0.8, images=0.8)
+        opml = MubuPost(synthetic_mubu_html(spec)[0].encode('utf-8'), use_mubu_img=True).parse_to_opml()
+        xml = io.StringIO()
+        render_opml(opml, [OpmlSink(xml, declaration=False)])
+        parsed = Parser(xml_string=xml.getvalue()).parse()
+        self.assertEqual(Transformer(opml).to_markdown_string(), Transformer(parsed).to_markdown_string())
+
+    def test_code_blocks_of_a_parsed_opml(self):
+        # what OpmlSink writes for the attributes MubuPost._parse_note collects
+        xml = ('<opml version="2.0"><head title="t"/><body><outline text="code" '
+               'mkd_codes="[&quot;```python\\nprint(\'hi\')\\n```&quot;]" mkd_imgs="[\'![a](http://x/a.png\']" '
+               'mubu_imgs="[\'http://x/b.png\']"/></body></opml>')
+        markdown = Transformer(Parser(xml_string=xml).parse()).to_markdown_string()
+        self.assertEqual(markdown, "code![](http://x/b.png)\n![a](http://x/a.png\n```python\nprint('hi')\n```\n"
+                         + ''.join(Transformer.FOOTER))
+        model = OPML(Head('t'), Body([Outline('code', attrs={
+            'mkd_codes': ["```python\nprint('hi')\n```"], 'mkd_imgs': ['![a](http://x/a.png'],
+            'mubu_imgs': ['http://x/b.png']})]))
+        self.assertEqual(markdown, Transformer(model).to_markdown_string())
+
+
+if __name__ == '__main__':
+    unittest.main()
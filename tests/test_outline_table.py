@@ -0,0 +1,64 @@
+"""
+The compact model: an OutlineTable renders the same markdown and XML as the Outline tree it was built from.
+"""
+import io
+import sys
+import unittest
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib import tree_walker
+from lib.opml_processor import OPML, Body, Outline, Parser
+from lib.outline_table import OutlineTable, OutlineView
+from lib.sinks import OpmlSink, render_opml
+from mubu2markdown import MubuPost, Transformer
+
+
+def _renders(opml):
+    xml = io.StringIO()
+    render_opml(opml, [OpmlSink(xml, declaration=False)])
+    return Transformer(opml).to_markdown_string(), xml.getvalue(), opml.to_xml_string()
+
+
+class OutlineTableTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        spec = CorpusSpec(breadth=4, depth=3, notes=0.8, code_blocks=0.8, images=0.8)
+        cls.opml = MubuPost(synthetic_mubu_html(spec)[0].encode('utf-8'), use_mubu_img=True).parse_to_opml()
+        xml = io.StringIO()
+        render_opml(cls.opml, [OpmlSink(xml, declaration=False)])
+        cls.xml = xml.getvalue()
+
+    def test_from_outlines(self):
+        table = OutlineTable.from_outlines(self.opml.body.outlines)
+        self.assertEqual(len(table), sum(1 for _ in tree_walker.preorder(self.opml.body.outlines,
+                                                                          tree_walker.sub_outlines)))
+        compact = OPML(self.opml.head, Body(table.roots()))
+        self.assertTrue(compact.body.is_valid())
+        self.assertEqual(_renders(compact), _renders(self.opml))
+
+    def test_compact_parser(self):
+        normal = Parser(xml_string=self.xml).parse()
+        compact = Parser(xml_string=self.xml, compact=True).parse()
+        self.assertIsInstance(compact.body.outlines[0], OutlineView)
+        self.assertEqual(_renders(compact), _renders(normal))
+
+    def test_views(self):
+        table = OutlineTable()
+        root = table.append('root', {'note': 'n'})
+        table.append('child', parent=root)
+        view = table.freeze().roots()[0]
+        self.assertNotIsInstance(view, Outline)
+        self.assertFalse(hasattr(view, '__dict__'))
+        self.assertEqual(OutlineView.__slots__, ('table', 'index'))
+        self.assertLess(sys.getsizeof(view), sys.getsizeof(Outline('x')))
+        self.assertEqual(str(view), 'outline text=root, children=1')
+        self.assertEqual(view.attrs, {'note': 'n'})
+        self.assertEqual([c.text for c in view.sub_outlines], ['child'])
+        self.assertIsNone(view.sub_outlines[0].sub_outlines)
+        self.assertEqual(view, table.roots()[0])
+        with self.assertRaises(RuntimeError):
+            view.append_child(Outline('x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+MubuPost with jobs > 1 must write what the serial conversion writes, subclasses and their span handlers included, and
+stay serial where the process pool would be slower.
+"""
+import io
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.metrics import Metrics
+from lib.sinks import OpmlSink, render_opml
+from mubu2markdown import MubuPost
+
+
+def _underline(text):
+    return f'<u>{text}</u>'
+
+
+class TaggedPost(MubuPost):
+    pass
+
+
+class LambdaPost(MubuPost):
+    pass
+
+
+class ParallelTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # registered at run time, after the module was imported
+        TaggedPost.register_span_handler('bold', ('<b>', '</b>'))
+        TaggedPost.register_span_handler('italic', _underline)
+        LambdaPost.register_span_handler('bold', lambda text: f'<strong>{text}</strong>')
+        cls.html = synthetic_mubu_html(CorpusSpec(breadth=6, depth=3, format_density=0.8))[0].encode('utf-8')
+
+    def setUp(self):
+        # the export is small and this machine may have a single CPU, use the pool anyway
+        for patch in (mock.patch.object(MubuPost, 'SUBTREE_MIN_BYTES', 0),
+                      mock.patch.object(MubuPost, 'SUBTREE_MIN_JOBS', 2),
+                      mock.patch('os.cpu_count', return_value=4)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _markdown(self, post_class, jobs=None, metrics=None):
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'out.md'
+            post_class(self.html, metrics=metrics).to_markdown(str(target), jobs=jobs)
+            return target.read_text(encoding='utf-8')
+
+    def test_to_markdown_jobs(self):
+        self.assertEqual(self._markdown(MubuPost), self._markdown(MubuPost, jobs=2))
+
+    def test_parse_to_opml_jobs(self):
+        models = []
+        for jobs in (None, 2):
+            buffer = io.StringIO()
+            render_opml(MubuPost(self.html).parse_to_opml(jobs=jobs), [OpmlSink(buffer)])
+            models.append(buffer.getvalue())
+        self.assertEqual(models[0], models[1])
+
+    def test_subclass_handlers_reach_the_workers(self):
+        serial = self._markdown(TaggedPost)
+        self.assertIn('<b>', serial)
+        self.assertIn('<u>', serial)
+        self.assertEqual(serial, self._markdown(TaggedPost, jobs=2))
+
+    def test_unpicklable_handlers(self):
+        serial = self._markdown(LambdaPost)
+        self.assertIn('<strong>', serial)
+        self.assertEqual(serial, self._markdown(LambdaPost, jobs=2))
+
+    def test_metrics_of_the_workers(self):
+        serial, parallel = Metrics(), Metrics()
+        self._markdown(MubuPost, metrics=serial)
+        self._markdown(MubuPost, jobs=2, metrics=parallel)
+        for name in ('nodes', 'spans', 'bytes_read'):
+            self.assertEqual(serial.counts[name], parallel.counts[name], name)
+
+    def test_pool_is_used(self):
+        with mock.patch.object(MubuPost, '_map_subtrees', side_effect=RuntimeError('pool')):
+            with self.assertRaisesRegex(RuntimeError, 'pool'):
+                self._markdown(MubuPost, jobs=2)
+
+    def test_stays_serial(self):
+        post = MubuPost(self.html)
+        items = post._top_level_items()
+        self.assertEqual(post._subtree_jobs(items, 2), 2)
+        self.assertEqual(post._subtree_jobs(items, 8), 4)
+        for jobs, cpus, min_bytes in ((None, 4, 0), (1, 4, 0), (2, 1, 0), (3, 4, len(self.html) + 1)):
+            with mock.patch('os.cpu_count', return_value=cpus), \
+                    mock.patch.object(MubuPost, 'SUBTREE_MIN_BYTES', min_bytes):
+                self.assertEqual(post._subtree_jobs(items, jobs), 0, (jobs, cpus, min_bytes))
+        self.assertEqual(post._subtree_jobs(items[:1], 4), 0)
+        with mock.patch.object(MubuPost, 'SUBTREE_MIN_BYTES', len(self.html) + 1), \
+                mock.patch.object(MubuPost, '_map_subtrees', side_effect=RuntimeError('pool')):
+            self.assertEqual(self._markdown(MubuPost, jobs=4), self._markdown(MubuPost))
+            self.assertEqual(MubuPost(self.html).parse_to_opml(jobs=4).to_xml_string(),
+                             MubuPost(self.html).parse_to_opml().to_xml_string())
+        # a stream of unknown size counts as big
+        self.assertIsNone(MubuPost(io.BytesIO(self.html)).source_size)
+        with mock.patch.object(MubuPost, 'SUBTREE_MIN_BYTES', 2 << 20):
+            self.assertEqual(MubuPost(io.BytesIO(self.html))._subtree_jobs(items, 4), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
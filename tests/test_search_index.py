@@ -0,0 +1,92 @@
+"""
+SearchIndex: what gets indexed, where hits point to, re-indexing and several writers.
+"""
+import io
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.search_index import IndexSink, SearchIndex
+from mubu2markdown import MarkdownSink, MubuPost, Transformer
+
+
+def _index_post(db_path, document, seed):
+    html = synthetic_mubu_html(CorpusSpec(breadth=5, depth=3, seed=seed))[0].encode('utf-8')
+    with SearchIndex(db_path) as index:
+        return index.index_opml(document, MubuPost(html).parse_to_opml(), str(seed))
+
+
+class SearchIndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        html = synthetic_mubu_html(CorpusSpec(breadth=4, depth=3, notes=0.5, code_blocks=0.5))[0].encode('utf-8')
+        cls.opml = MubuPost(html).parse_to_opml()
+        cls.markdown = Transformer(cls.opml).to_markdown_string().split('\n')
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'index.db')
+        self.index = SearchIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def test_hits_point_at_their_markdown_line(self):
+        self.index.index_opml('post', self.opml, 'v1', Transformer(None)._outline_to_text)
+        hits = self.index.search('markdown', limit=1000)
+        self.assertTrue(hits)
+        for hit in hits:
+            self.assertEqual(self.markdown[hit.line - 1], hit.text.split('\n', 1)[0])
+
+    def test_cjk_substrings(self):
+        self.index.index_opml('post', self.opml)
+        self.assertTrue(self.index.search('文'))
+        self.assertTrue(all('中文' in h.text for h in self.index.search('中文')))
+
+    def test_code_blocks_are_searchable(self):
+        self.index.index_opml('post', self.opml)
+        self.assertTrue(self.index.search('code:print', raw=True))
+
+    def test_same_digest_is_skipped(self):
+        self.assertTrue(self.index.index_opml('post', self.opml, 'v1'))
+        self.assertFalse(self.index.index_opml('post', self.opml, 'v1'))
+        count = self.index.stats()['outlines']
+        self.assertTrue(self.index.index_opml('post', self.opml, 'v2'))
+        self.assertEqual(self.index.stats(), {'documents': 1, 'outlines': count})
+        self.assertTrue(self.index.remove('post'))
+        self.assertEqual(self.index.stats(), {'documents': 0, 'outlines': 0})
+
+    def test_sink_writes_nothing_for_a_failed_rendering(self):
+        sink = IndexSink(self.index, 'post', 'v1')
+        sink.start(self.opml.head)
+        sink.node(self.opml.body.outlines[0], 0)
+        # no transaction is open while the document renders
+        self.assertFalse(self.index.db.in_transaction)
+        sink.close()
+        self.assertEqual(self.index.stats()['outlines'], 0)
+
+    def test_sink_indexes_like_index_opml(self):
+        buffer = io.StringIO()
+        sink = IndexSink(self.index, 'post', 'v1', Transformer(None)._outline_to_text)
+        html = synthetic_mubu_html(CorpusSpec(breadth=4, depth=3))[0].encode('utf-8')
+        MubuPost(html).render([MarkdownSink(buffer), sink], streaming=True)
+        lines = buffer.getvalue().split('\n')
+        hits = self.index.search('node', limit=1000)
+        self.assertTrue(hits)
+        for hit in hits:
+            self.assertEqual(lines[hit.line - 1], hit.text.split('\n', 1)[0])
+
+    def test_several_processes(self):
+        path = os.path.join(self.dir.name, 'shared.db')
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            done = list(pool.map(_index_post, [path] * 8, [f'post{i}' for i in range(8)], range(8)))
+        self.assertEqual(done, [True] * 8)
+        with SearchIndex(path) as index:
+            self.assertEqual(index.stats(), {'documents': 8, 'outlines': 8 * 155})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Snapshots: the lazy views and the Outline objects read back render the same markdown and XML as the model written.
+"""
+import io
+import os
+import tempfile
+import unittest
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib import tree_walker
+from lib.opml_processor import LIST_ATTRS, OPML, Body, Head, Outline, Parser
+from lib.outline_table import OutlineTable
+from lib.sinks import OpmlSink, render_opml
+from lib.snapshot import MAGIC, Snapshot, write_snapshot
+from mubu2markdown import MubuPost, Transformer
+
+
+def _renders(opml):
+    xml = io.StringIO()
+    render_opml(opml, [OpmlSink(xml, declaration=False)])
+    return Transformer(opml).to_markdown_string(), xml.getvalue(), opml.to_xml_string()
+
+
+class SnapshotTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        spec = CorpusSpec(breadth=4, depth=3, notes=0.8, code_blocks=0.8, images=0.8)
+        cls.post = MubuPost(synthetic_mubu_html(spec)[0].encode('utf-8'), use_mubu_img=True).parse_to_opml()
+        xml = io.StringIO()
+        render_opml(cls.post, [OpmlSink(xml, declaration=False)])
+        cls.xml = xml.getvalue()
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'post.snap')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _check_round_trip(self, opml):
+        expected = _renders(opml)
+        size = write_snapshot(opml, self.path)
+        self.assertEqual(size, os.path.getsize(self.path))
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(_renders(snapshot.opml()), expected)
+            materialized = snapshot.to_opml()
+        self.assertEqual(_renders(materialized), expected)
+        return materialized
+
+    def test_models(self):
+        for name, opml in (('MubuPost', self.post), ('Parser', Parser(xml_string=self.xml).parse()),
+                           ('compact Parser', Parser(xml_string=self.xml, compact=True).parse())):
+            with self.subTest(name):
+                materialized = self._check_round_trip(opml)
+                # lists whatever the source held, str() of a list for a parsed OPML
+                values = [v for o, _ in tree_walker.preorder(materialized.body.outlines, tree_walker.sub_outlines)
+                          for k, v in (o.attrs or {}).items() if k in LIST_ATTRS]
+                self.assertTrue(values)
+                self.assertTrue(all(isinstance(v, list) for v in values))
+
+    def test_smaller_than_the_xml(self):
+        self.assertLess(write_snapshot(self.post, self.path), len(self.xml.encode('utf-8')))
+
+    def test_table_out_of_order(self):
+        # children appended after later roots, so indices are not in preorder
+        table = OutlineTable()
+        first = table.append('first', {'note': 'n'})
+        second = table.append('second')
+        table.append('second child', parent=second)
+        table.append('first child', {'mubu_imgs': ['http://x/a.png', 'http://x/b.png']}, parent=first)
+        table.append('first grandchild', parent=table.append('first child 2', parent=first))
+        opml = OPML(Head('title', owner_email='a@b.c'), Body(table.freeze().roots()))
+        self._check_round_trip(opml)
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual([snapshot.texts[i] for i in range(len(snapshot))],
+                             ['first', 'first child', 'first child 2', 'first grandchild', 'second', 'second child'])
+            self.assertEqual(snapshot.root_indices, [0, 4])
+            self.assertEqual(snapshot.children_of(0), [1, 2])
+            self.assertEqual(snapshot.attrs_of(1), {'mubu_imgs': ['http://x/a.png', 'http://x/b.png']})
+            head = snapshot.head()
+            self.assertEqual((head.title, head.owner_email, head.owner_name), ('title', 'a@b.c', None))
+
+    def test_texts_holding_nul(self):
+        opml = OPML(Head('t'), Body([Outline('a\0b', [Outline('c')]), Outline('\0')]))
+        materialized = self._check_round_trip(opml)
+        self.assertEqual(materialized.body.outlines[0].text, 'a\0b')
+
+    def test_not_a_snapshot(self):
+        for content in (b'', b'<opml/>', MAGIC[:-1] + b'\x01' + bytes(64)):
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(RuntimeError):
+                Snapshot(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Content spans: the markdown of combined classes, the order of handlers and the cache of composed wrappers.
+"""
+import html
+import unittest
+
+from mubu2markdown import MubuPost
+
+
+def _export(*spans):
+    """
+    A Mubu export of one node whose content is spans, (class or None, text) pairs.
+    """
+    content = ''.join(f'<span class="{c}">{html.escape(t)}</span>' if c else f'<span>{html.escape(t)}</span>'
+                      for c, t in spans)
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"></head><body><div class="title">spans</div>'
+            f'<ul class="node-list"><li class="node"><div class="content mm-editor">{content}</div></li></ul>'
+            '<div class="publish"><a href="https://mubu.com">幕布文档</a></div></body></html>').encode('utf-8')
+
+
+def _text(post_class, *spans):
+    return post_class(_export(*spans)).parse_to_opml().body.outlines[0].text
+
+
+class SpanTest(unittest.TestCase):
+    def test_combined_classes(self):
+        for class_name, markdown in (
+                ('bold', '**x**'),
+                ('bold codespan', '**`x`**'),
+                ('codespan bold', '**`x`**'),
+                ('italic strikethrough', '*~~x~~*'),
+                ('bold italic', '***x***'),
+                ('strikethrough bold italic codespan', '***~~`x`~~***'),
+                ('bold text-color-red', '**x**'),
+                ('bold  bold', '**x**'),
+                ('text-color-red', 'x'),
+        ):
+            self.assertEqual(_text(MubuPost, (class_name, 'x')), markdown, class_name)
+
+    def test_spans_of_a_node(self):
+        self.assertEqual(_text(MubuPost, (None, 'a '), ('bold codespan', 'b'), (None, ' c '), ('italic', 'd')),
+                         'a **`b`** c *d*')
+
+    def test_handler_order(self):
+        class Post(MubuPost):
+            pass
+
+        # outermost by default, else by order whatever the order of the classes in the attribute
+        Post.register_span_handler('underline', ('<u>', '</u>'))
+        Post.register_span_handler('mark', ('==', '=='), order=5)
+        Post.register_span_handler('upper', str.upper, order=15)
+        self.assertEqual(_text(Post, ('bold underline', 'x')), '<u>**x**</u>')
+        self.assertEqual(_text(Post, ('strikethrough mark codespan', 'x')), '~~==`x`==~~')
+        self.assertEqual(_text(Post, ('italic upper strikethrough', 'x')), '*~~X~~*')
+        self.assertEqual(_text(Post, ('upper underline bold', 'x')), '<u>**X**</u>')
+
+    def test_registering_resets_the_cache(self):
+        class Post(MubuPost):
+            pass
+
+        self.assertEqual(_text(Post, ('bold italic', 'x')), '***x***')
+        self.assertIn('bold italic', Post._span_formats)
+        Post.register_span_handler('bold', ('<b>', '</b>'))
+        self.assertEqual(Post._span_formats, {})
+        self.assertEqual(_text(Post, ('bold italic', 'x')), '<b>*x*</b>')
+        self.assertEqual(Post._span_format('bold italic'), ('<b>*', '*</b>'))
+        # MubuPost and its cache are untouched
+        self.assertEqual(MubuPost.SPAN_HANDLERS['bold'], (30, ('**', '**')))
+        self.assertEqual(_text(MubuPost, ('bold italic', 'x')), '***x***')
+        self.assertEqual(MubuPost._span_formats['bold italic'], ('***', '***'))
+
+
+if __name__ == '__main__':
+    unittest.main()
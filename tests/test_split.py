@@ -0,0 +1,80 @@
+"""
+Split markdown: the parts add up to the unsplit markdown, the index links them and parts stay under max_bytes.
+"""
+import re
+import tempfile
+import unittest
+import urllib.parse
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.opml_processor import Outline
+from mubu2markdown import MubuPost, Transformer, convert_file
+
+LINK_RE = re.compile(r'^- \[.*\]\((.*)\)$', re.MULTILINE)
+
+
+class SplitTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        spec = CorpusSpec(breadth=4, depth=4, notes=0.5, code_blocks=0.5, images=0.5)
+        cls.html = synthetic_mubu_html(spec)[0].encode('utf-8')
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _opml(self):
+        opml = MubuPost(self.html).parse_to_opml()
+        # one outline bigger than any part may be
+        opml.body.outlines[1].append_child(Outline('big ' + 'x' * 5000))
+        return opml
+
+    def _check(self, index, parts, unsplit, link_base):
+        self.assertTrue(parts)
+        body = ''.join(p.read_text(encoding='utf-8') for p in parts)
+        self.assertEqual(body + ''.join(Transformer.FOOTER), unsplit)
+        links = LINK_RE.findall(index.read_text(encoding='utf-8'))
+        self.assertEqual([(Path(link_base) / urllib.parse.unquote(link)).resolve() for link in links],
+                         [p.resolve() for p in parts])
+
+    def test_by_level(self):
+        opml = self._opml()
+        index = self.root / 'out' / 'post.md'
+        index.parent.mkdir()
+        parts = Transformer(opml).to_markdown_parts(str(index), level=2)
+        self._check(index, parts, Transformer(opml).to_markdown_string(), index.parent)
+        self.assertEqual(parts[0].parent, self.root / 'out' / 'post')
+        for part in parts:
+            first = part.read_text(encoding='utf-8').split('\n', 1)[0]
+            self.assertRegex(first, r'^#{1,2} ')
+            self.assertNotRegex(part.read_text(encoding='utf-8')[len(first):], r'\n#{1,2} ')
+
+    def test_by_size(self):
+        opml = self._opml()
+        index = self.root / 'post'
+        parts = Transformer(opml).to_markdown_parts(str(index), max_bytes=2000)
+        self._check(index, parts, Transformer(opml).to_markdown_string(), self.root)
+        self.assertEqual(parts[0].parent, self.root / 'post.parts')
+        big = [p for p in parts if p.stat().st_size > 2000]
+        self.assertEqual([p.read_text(encoding='utf-8') for p in big], ['big ' + 'x' * 5000 + '\n'])
+        self.assertGreater(len(parts), 3)
+
+    def test_convert_file(self):
+        export = self.root / 'post.html'
+        export.write_bytes(self.html)
+        (self.root / 'whole').mkdir()
+        (self.root / 'split').mkdir()
+        whole = convert_file(export, self.root / 'whole')[1]
+        for streaming in (False, True):
+            index = convert_file(export, self.root / 'split', split_level=3, split_size=1500, streaming=streaming)[1]
+            parts = sorted((self.root / 'split' / 'post').glob('post-*.md'))
+            self._check(Path(index), parts, Path(whole).read_text(encoding='utf-8'), self.root / 'split')
+            self.assertTrue(all(p.stat().st_size <= 1500 for p in parts))
+
+
+if __name__ == '__main__':
+    unittest.main()
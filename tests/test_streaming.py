@@ -0,0 +1,51 @@
+"""
+Rendering from MubuPost.iter_outline_events() must write what rendering the parsed outline tree writes.
+"""
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.sinks import JsonSink, OpmlSink, TextSink
+from mubu2markdown import MarkdownSink, MubuPost
+
+
+class StreamingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        spec = CorpusSpec(breadth=4, depth=4, notes=0.6, code_blocks=0.5, images=0.5, links=0.3, format_density=0.6)
+        cls.html = synthetic_mubu_html(spec)[0].encode('utf-8')
+
+    def test_to_markdown(self):
+        for use_mubu_img in (False, True):
+            outputs = []
+            with tempfile.TemporaryDirectory() as d:
+                for streaming in (False, True):
+                    target = Path(d) / f'{streaming}.md'
+                    MubuPost(self.html, use_mubu_img=use_mubu_img).to_markdown(str(target), streaming=streaming)
+                    outputs.append(target.read_text(encoding='utf-8'))
+            self.assertEqual(outputs[0], outputs[1], f'use_mubu_img={use_mubu_img}')
+
+    def test_every_sink(self):
+        outputs = []
+        for streaming in (False, True):
+            buffers = [io.StringIO() for _ in range(4)]
+            sinks = [MarkdownSink(buffers[0]), OpmlSink(buffers[1]), TextSink(buffers[2]), JsonSink(buffers[3])]
+            MubuPost(self.html, use_mubu_img=True).render(sinks, streaming=streaming)
+            outputs.append([b.getvalue() for b in buffers])
+        for name, tree, streamed in zip(('markdown', 'opml', 'text', 'json'), *outputs):
+            self.assertEqual(tree, streamed, name)
+
+    def test_deep_nesting(self):
+        html = synthetic_mubu_html(CorpusSpec(breadth=1, depth=400))[0].encode('utf-8')
+        outputs = []
+        for streaming in (False, True):
+            buffer = io.StringIO()
+            MubuPost(html).render([MarkdownSink(buffer)], streaming=streaming)
+            outputs.append(buffer.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
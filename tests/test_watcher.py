@@ -0,0 +1,175 @@
+"""
+Watcher (inotify and polling) and watch mode: debounced reports, skipped rewrites, refused output clashes.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, synthetic_mubu_html
+from lib.watcher import Watcher
+from mubu2markdown import main, watch
+
+DEBOUNCE = 0.3
+
+
+class _WatcherTests:
+    use_inotify = None
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+        try:
+            self.watcher = Watcher([self.root], lambda p: p.suffix == '.html', DEBOUNCE, 0.05, self.use_inotify)
+        except OSError as e:
+            self.dir.cleanup()
+            self.skipTest(f'no inotify: {e}')
+
+    def tearDown(self):
+        self.watcher.close()
+        self.dir.cleanup()
+
+    def _batches(self, seconds):
+        batches = []
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            batch = self.watcher.next_batch(timeout=deadline - time.monotonic())
+            if batch:
+                batches.append((time.monotonic(), batch))
+        return batches
+
+    def test_a_file_written_in_pieces_comes_out_once(self):
+        path = self.root / 'post.html'
+        with open(path, 'w') as f:
+            for i in range(5):
+                f.write(f'piece {i}\n')
+                f.flush()
+                time.sleep(DEBOUNCE / 5)
+        written = time.monotonic()
+        (self.root / 'notes.txt').write_text('not watched')
+        batches = self._batches(4 * DEBOUNCE)
+        self.assertEqual([b for _, b in batches], [[path]])
+        self.assertGreaterEqual(batches[0][0] - written, DEBOUNCE * 0.9)
+
+    def test_rewrites_come_out_again_in_order(self):
+        first, second = self.root / 'a.html', self.root / 'b.html'
+        first.write_text('a')
+        # mtimes far enough apart for any file system
+        time.sleep(0.05)
+        second.write_text('b')
+        self.assertEqual([b for _, b in self._batches(3 * DEBOUNCE)], [[first, second]])
+        first.write_text('a, rewritten')
+        self.assertEqual([b for _, b in self._batches(3 * DEBOUNCE)], [[first]])
+        self.assertEqual(self.watcher.next_batch(timeout=0.1), [])
+
+
+class InotifyTest(_WatcherTests, unittest.TestCase):
+    use_inotify = True
+
+    def test_source(self):
+        self.assertFalse(self.watcher.polling)
+
+
+class PollingTest(_WatcherTests, unittest.TestCase):
+    use_inotify = False
+
+    def test_source(self):
+        self.assertTrue(self.watcher.polling)
+
+
+class WatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.dir.name)
+        self.sources = [self.root / 'x', self.root / 'y']
+        for d in self.sources:
+            d.mkdir()
+        self.out = self.root / 'out'
+        self.html = synthetic_mubu_html(CorpusSpec(breadth=3, depth=2))[0]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _watch(self, use_inotify, steps):
+        """
+        Run watch() in a thread, call each step and wait for the number of results it returns to come in.
+        """
+        results = []
+        stop = threading.Event()
+        thread = threading.Thread(target=watch, args=(self.sources, self.out), kwargs=dict(
+            jobs=1, debounce=0.1, poll_interval=0.05, use_inotify=use_inotify, on_result=results.append,
+            stop=stop.is_set))
+        thread.start()
+        try:
+            # the watcher is set up once the output directory exists
+            deadline = time.monotonic() + 5
+            while not self.out.is_dir() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+            for step in steps:
+                expected = len(results) + step()
+                deadline = time.monotonic() + 10
+                while len(results) < expected and time.monotonic() < deadline:
+                    time.sleep(0.02)
+                self.assertEqual(len(results), expected)
+        finally:
+            stop.set()
+            thread.join(10)
+        return results
+
+    def test_watch(self):
+        for use_inotify in (None, False):
+            with self.subTest(use_inotify=use_inotify):
+                export = self.sources[0] / 'post.html'
+                clash = self.sources[1] / 'post.html'
+
+                def add():
+                    export.write_text(self.html, encoding='utf-8')
+                    return 1
+
+                def rewrite_same_bytes():
+                    export.write_text(self.html, encoding='utf-8')
+                    return 1
+
+                def add_clash():
+                    clash.write_text(self.html, encoding='utf-8')
+                    return 1
+
+                def edit():
+                    export.write_text(self.html.replace(' 7.0<', ' 7.0 Edited<'), encoding='utf-8')
+                    return 1
+
+                added, skipped, refused, edited = self._watch(use_inotify, [add, rewrite_same_bytes, add_clash, edit])
+                self.assertEqual(added[:3], (str(export.resolve()), str(self.out / 'post.md'), None))
+                self.assertEqual(skipped, (str(export.resolve()), None, None, 0.0, False))
+                self.assertEqual(refused[:2], (str(clash.resolve()), None))
+                self.assertIn('same output post', refused[2])
+                self.assertIsNone(edited[2])
+                self.assertIn('Edited', (self.out / 'post.md').read_text(encoding='utf-8'))
+                export.unlink()
+                clash.unlink()
+
+    def test_globs_are_refused_before_converting(self):
+        (self.sources[0] / 'post.html').write_text(self.html, encoding='utf-8')
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit) as raised:
+            main([os.path.join(self.sources[0], 'p*.html'), '--watch', '--poll', '-o', str(self.out)])
+        self.assertEqual(raised.exception.code, 2)
+        self.assertIn('glob patterns cannot be watched', stderr.getvalue())
+        self.assertFalse(self.out.exists())
+
+    def test_clashing_sources_are_refused(self):
+        for d in self.sources:
+            (d / 'post.html').write_text(self.html, encoding='utf-8')
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit):
+            main([str(d) for d in self.sources] + ['--watch', '--poll', '-o', str(self.out)])
+        self.assertIn('would write the same output post', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()